@@ -31,6 +31,13 @@ def create_app(profile='production'):
     # initialize extensions
     db.init_app(app)
 
+    # size the connection pools of the Fastly and Dasher clients
+    from . import httpclient
+    httpclient.configure(
+        pool_maxsize=app.config['HTTP_POOL_MAXSIZE'],
+        timeout=(app.config['HTTP_CONNECT_TIMEOUT'],
+                 app.config['HTTP_READ_TIMEOUT']))
+
     # register blueprints
     from .api_v1 import api as api_blueprint
     app.register_blueprint(api_blueprint, url_prefix=None)
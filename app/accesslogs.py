@@ -0,0 +1,329 @@
+"""Analysis of CDN access logs, to find the hot pages of editions.
+
+:func:`analyze_logs` streams access logs from local files (JSON lines,
+optionally gzip-compressed, one request per line), and counts the requests
+for each page of each edition in bounded memory: counts are kept in a
+count-min sketch (:class:`CountMinSketch`), which may overestimate but
+never underestimates them, and only the ``top_k`` most requested pages of
+each edition are tracked (:class:`TopK`).
+
+Requests are attributed to products by host name (the product's
+`~app.models.Product.domain`), and to editions by path (``/v/<edition>/``,
+or the ``main`` edition at the root). Build pages, unknown hosts, editions
+that aren't in the DB (or are deprecated) and failed requests (4xx and 5xx
+statuses) aren't counted, so the number of tracked editions is bounded by
+the DB rather than by the paths in the logs.
+
+The results are saved as each edition's `~app.models.HotPath` rows, which
+are consumed by cache warming (see `app.warming`). Run the analysis with
+``run.py analyze_logs``.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+from array import array
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from . import db
+from .models import Product, Edition, HotPath
+
+__all__ = ['CountMinSketch', 'TopK', 'LogAnalyzer', 'read_records',
+           'analyze_logs']
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+HOST_FIELDS = ('host', 'req_host', 'request_host')
+"""Fields of log records that may hold the request's host name."""
+
+PATH_FIELDS = ('url', 'path', 'req_url', 'request_url', 'uri')
+"""Fields of log records that may hold the request's path (or URL)."""
+
+STATUS_FIELDS = ('status', 'resp_status', 'status_code')
+"""Fields of log records that may hold the response status."""
+
+MAX_PATH_LENGTH = 1024
+"""Longest page path that's counted (see `app.models.HotPath.path`)."""
+
+
+class CountMinSketch(object):
+    """Count-min sketch of the number of occurrences of keys.
+
+    Parameters
+    ----------
+    width : int, optional
+        Number of counters per row. Estimates exceed the true count by at
+        most ``2 * total / width`` with a probability of
+        ``1 - 2 ** -depth``.
+    depth : int, optional
+        Number of rows (hash functions), at most 8.
+    """
+
+    def __init__(self, width=2 ** 16, depth=4):
+        super(CountMinSketch, self).__init__()
+        if not 1 <= depth <= 8:
+            raise ValueError('depth must be between 1 and 8')
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self._rows = [array('q', bytes(8 * width)) for _ in range(depth)]
+
+    def _indices(self, key):
+        # Each row's hash is 4 bytes of the key's SHA-256 digest
+        digest = hashlib.sha256(key.encode('utf-8')).digest()
+        return [int.from_bytes(digest[4 * i:4 * (i + 1)], 'little')
+                % self.width for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        """Count occurrences of a key.
+
+        Returns
+        -------
+        estimate : int
+            Estimated number of occurrences of the key, including these.
+        """
+        self.total += count
+        estimate = None
+        for row, i in zip(self._rows, self._indices(key)):
+            row[i] += count
+            estimate = row[i] if estimate is None else min(estimate, row[i])
+        return estimate
+
+    def estimate(self, key):
+        """Estimate the number of occurrences of a key."""
+        return min(row[i] for row, i in zip(self._rows, self._indices(key)))
+
+
+class TopK(object):
+    """The `k` keys with the largest estimated counts in a sketch.
+
+    Parameters
+    ----------
+    k : int
+        Number of keys to track.
+    """
+
+    def __init__(self, k):
+        super(TopK, self).__init__()
+        self.k = k
+        self._counts = {}
+        # Lower bound of the smallest tracked count
+        self._min_count = 0
+
+    def update(self, key, estimate):
+        """Offer a key with its current estimated count."""
+        if key in self._counts or len(self._counts) < self.k:
+            self._counts[key] = estimate
+            return
+        if estimate <= self._min_count:
+            return
+        min_key = min(self._counts, key=self._counts.get)
+        self._min_count = self._counts[min_key]
+        if estimate > self._min_count:
+            del self._counts[min_key]
+            self._counts[key] = estimate
+
+    def items(self):
+        """Get the tracked keys and counts, from most to least frequent.
+
+        Returns
+        -------
+        items : list of tuple
+            ``(key, count)`` tuples.
+        """
+        return sorted(self._counts.items(), key=lambda item: (-item[1],
+                                                              item[0]))
+
+
+class LogAnalyzer(object):
+    """Count requests for the pages of editions.
+
+    Parameters
+    ----------
+    domains : dict
+        Product slugs, keyed by the products' domains.
+    edition_slugs : set of tuple
+        ``(product, edition)`` slugs of the editions to track. Requests for
+        other editions aren't counted.
+    top_k : int, optional
+        Number of pages to track per edition.
+    width : int, optional
+        Width of the count-min sketch (see `CountMinSketch`).
+    depth : int, optional
+        Depth of the count-min sketch (see `CountMinSketch`).
+    """
+
+    def __init__(self, domains, edition_slugs, top_k=100, width=2 ** 16,
+                 depth=4):
+        super(LogAnalyzer, self).__init__()
+        self.domains = domains
+        self.edition_slugs = edition_slugs
+        self.top_k = top_k
+        self.sketch = CountMinSketch(width=width, depth=depth)
+        self.editions = {}
+        """Tracked pages of each edition, as `TopK` instances keyed by
+        ``(product, edition)`` slugs.
+        """
+        self.requests = 0
+        """Number of requests counted."""
+        self.skipped = 0
+        """Number of records that weren't counted."""
+
+    def add_record(self, record):
+        """Count the request of a log record (a dict)."""
+        host = _get_field(record, HOST_FIELDS)
+        url = _get_field(record, PATH_FIELDS)
+        status = _get_field(record, STATUS_FIELDS)
+        try:
+            failed = status is not None and int(status) >= 400
+        except ValueError:
+            failed = True
+        if host is None or url is None or failed:
+            self.skipped += 1
+            return
+
+        parts = urlsplit(url)
+        host = (parts.netloc or host).split(':')[0].lower()
+        page = self.resolve(host, parts.path)
+        if page is None:
+            self.skipped += 1
+            return
+        product_slug, edition_slug, path = page
+
+        self.requests += 1
+        estimate = self.sketch.add(
+            '\n'.join((product_slug, edition_slug, path)))
+        edition = (product_slug, edition_slug)
+        if edition not in self.editions:
+            self.editions[edition] = TopK(self.top_k)
+        self.editions[edition].update(path, estimate)
+
+    def resolve(self, host, path):
+        """Resolve a request to the page of an edition.
+
+        Returns
+        -------
+        page : tuple
+            ``(product, edition, path)`` tuple of the product and edition
+            slugs, and the page's path relative to the edition (as in the
+            ``CACHE_WARMING_PATHS`` configuration), or `None` if the request
+            isn't for a tracked edition.
+        """
+        product_slug = self.domains.get(host)
+        if product_slug is None:
+            return None
+        parts = path.lstrip('/').split('/')
+        if parts[0] == 'builds':
+            return None
+        if parts[0] == 'v' and len(parts) > 1 and parts[1] != '':
+            edition_slug, path = parts[1], '/'.join(parts[2:])
+        else:
+            edition_slug, path = 'main', '/'.join(parts)
+        if (product_slug, edition_slug) not in self.edition_slugs \
+                or len(path) > MAX_PATH_LENGTH:
+            return None
+        return product_slug, edition_slug, path
+
+
+def _get_field(record, fields):
+    for field in fields:
+        value = record.get(field)
+        if value is not None:
+            return str(value)
+    return None
+
+
+def read_records(filenames):
+    """Read log records from JSON lines files.
+
+    Files with a ``.gz`` extension are decompressed. Lines that aren't JSON
+    objects are skipped.
+
+    Parameters
+    ----------
+    filenames : list of str
+        Log files.
+
+    Yields
+    ------
+    record : dict
+        Log record.
+    """
+    for filename in filenames:
+        if filename.endswith('.gz'):
+            f = gzip.open(filename, 'rt', encoding='utf-8')
+        else:
+            f = open(filename, 'rt', encoding='utf-8')
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log.warning('Skipping invalid line in {0}'.format(
+                        filename))
+                    continue
+                if isinstance(record, dict):
+                    yield record
+
+
+def analyze_logs(filenames, top_k=100, width=2 ** 16, depth=4,
+                 dry_run=False):
+    """Find the hot pages of editions in access logs, and save them as the
+    editions' `~app.models.HotPath` rows.
+
+    This function must be called from within an application context.
+
+    Parameters
+    ----------
+    filenames : list of str
+        Log files (see `read_records`).
+    top_k : int, optional
+        Number of pages to keep per edition.
+    width : int, optional
+        Width of the count-min sketch (see `CountMinSketch`).
+    depth : int, optional
+        Depth of the count-min sketch (see `CountMinSketch`).
+    dry_run : bool, optional
+        If `True`, don't save the results.
+
+    Returns
+    -------
+    summary : dict
+        Summary with ``requests`` (number of requests counted),
+        ``skipped`` (number of records not counted) and ``editions`` fields.
+        ``editions`` maps ``product/edition`` slugs to lists of
+        ``(path, hits)`` tuples, from most to least requested.
+    """
+    domains = {product.domain.lower(): product.slug
+               for product in Product.query.all()}
+    editions = {(edition.product.slug, edition.slug): edition
+                for edition in Edition.query.join(Product)
+                .filter(Edition.date_ended == None)}  # NOQA
+    analyzer = LogAnalyzer(domains, set(editions), top_k=top_k, width=width,
+                           depth=depth)
+    for record in read_records(filenames):
+        analyzer.add_record(record)
+
+    summary = {'requests': analyzer.requests,
+               'skipped': analyzer.skipped,
+               'editions': {}}
+    date_analyzed = datetime.now()
+    for (product_slug, edition_slug), top in analyzer.editions.items():
+        edition = editions[(product_slug, edition_slug)]
+        items = top.items()
+        summary['editions']['/'.join((product_slug, edition_slug))] = items
+        if dry_run:
+            continue
+        HotPath.query.filter(HotPath.edition_id == edition.id)\
+            .delete(synchronize_session=False)
+        for rank, (path, hits) in enumerate(items):
+            db.session.add(HotPath(edition=edition, path=path, hits=hits,
+                                   rank=rank, date_analyzed=date_analyzed))
+    if not dry_run:
+        db.session.commit()
+    return summary
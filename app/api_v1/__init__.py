@@ -2,4 +2,5 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import products, builds, editions, dashboards, errorhandlers  # NOQA
+from . import products, builds, editions, dashboards, metrics, \
+    errorhandlers  # NOQA
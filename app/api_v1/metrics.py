@@ -0,0 +1,37 @@
+"""API v1 route for application metrics."""
+
+from flask import Response
+
+from . import api
+from .. import metrics
+
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Show the application's metrics (see ``app.metrics``), such as the
+    replication lag of mirror buckets, in the Prometheus text format.
+
+    Metrics are kept in memory by each server process.
+
+    **Example request**
+
+    .. code-block:: http
+
+       GET /metrics HTTP/1.1
+       Host: localhost:5000
+
+    **Example response**
+
+    .. code-block:: http
+
+       HTTP/1.0 200 OK
+       Content-Type: text/plain; version=0.0.4; charset=utf-8
+
+       # HELP ltd_keeper_mirror_lag_seconds Age of the oldest queued ...
+       # TYPE ltd_keeper_mirror_lag_seconds gauge
+       ltd_keeper_mirror_lag_seconds{mirror="lsst-the-docs-mirror"} 0.0
+
+    :statuscode 200: No error.
+    """
+    return Response(metrics.render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
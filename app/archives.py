@@ -0,0 +1,700 @@
+"""Streaming ingestion of build archives into S3, and streaming downloads
+of builds as zip archives.
+
+Rather than uploading a build file by file, a client can send a single tar
+or zip archive of the build (or upload it to the bucket and send its key).
+LTD Keeper unpacks the archive member by member and uploads the members to
+the build's directory in parallel.
+
+Memory use is bounded regardless of the archive's size: tar archives are read
+as streams, zip archives are spooled to disk if necessary, and at most a few
+members per upload thread are held in memory (larger members are spooled to
+temporary files).
+
+In the other direction, `stream_zip_archive` generates a zip archive of a
+directory on the fly, as objects are downloaded from S3, and can save a
+copy of the archive in the bucket while streaming it (see
+`get_archive_url`).
+"""
+
+import logging
+import mimetypes
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+from . import s3
+from .exceptions import ValidationError
+from .utils import normalize_relative_path
+
+__all__ = ['ARCHIVE_FORMATS', 'guess_archive_format', 'iter_archive_members',
+           'upload_archive', 'upload_bucket_archive', 'stream_zip_archive',
+           'get_archive_url']
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+ARCHIVE_FORMATS = ('tar', 'zip')
+"""Supported archive formats. Compressed tar archives (gzip, bz2 and xz)
+are detected automatically.
+"""
+
+# Members larger than this (bytes) are spooled to disk rather than memory
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Chunk size (bytes) for copying streams
+CHUNK_SIZE = 1024 * 1024
+
+# Minimum size (bytes) of the parts of an S3 multipart upload, except the
+# last part
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Sizes and offsets (bytes) from which zip records need ZIP64 fields
+_ZIP64_LIMIT = zipfile.ZIP64_LIMIT
+
+
+def guess_archive_format(filename):
+    """Guess the format of an archive from its file name.
+
+    Parameters
+    ----------
+    filename : str
+        File name or S3 key of the archive.
+
+    Returns
+    -------
+    archive_format : str
+        One of `ARCHIVE_FORMATS`.
+
+    Raises
+    ------
+    app.exceptions.ValidationError
+        Raised if the file name isn't recognized as an archive.
+    """
+    name = filename.lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    for ext in ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz'):
+        if name.endswith(ext):
+            return 'tar'
+    raise ValidationError('Unknown archive format: ' + filename)
+
+
+def iter_archive_members(fileobj, archive_format):
+    """Iterate over the regular files in an archive.
+
+    Parameters
+    ----------
+    fileobj : file-like object
+        The archive. Tar archives are read as a stream. Zip archives must be
+        seekable.
+    archive_format : str
+        One of `ARCHIVE_FORMATS`.
+
+    Yields
+    ------
+    path : str
+        Normalized path of the member in the archive.
+    member_fileobj : file-like object
+        Readable content of the member. For tar archives this is only
+        readable until the next member is yielded.
+    size : int
+        Size of the member, in bytes.
+
+    Raises
+    ------
+    app.exceptions.ValidationError
+        Raised if the archive can't be read, or a member's path is absolute
+        or outside the archive's root.
+    """
+    if archive_format == 'tar':
+        try:
+            with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    path = normalize_relative_path(member.name)
+                    yield path, tar.extractfile(member), member.size
+        except tarfile.TarError as e:
+            raise ValidationError('Invalid tar archive: ' + str(e))
+    elif archive_format == 'zip':
+        try:
+            with zipfile.ZipFile(fileobj) as zf:
+                for info in zf.infolist():
+                    if info.filename.endswith('/'):
+                        # directory entry
+                        continue
+                    path = normalize_relative_path(info.filename)
+                    with zf.open(info) as member_fileobj:
+                        yield path, member_fileobj, info.file_size
+        except zipfile.BadZipfile as e:
+            raise ValidationError('Invalid zip archive: ' + str(e))
+    else:
+        raise ValidationError('Unknown archive format: ' + archive_format)
+
+
+def upload_archive(fileobj, archive_format, bucket_name, root_path,
+                   aws_access_key_id, aws_secret_access_key,
+                   aws_region_name=None, aws_endpoint_url=None,
+                   surrogate_key=None, cache_control=None,
+                   surrogate_control=None, max_workers=8):
+    """Upload the members of an archive to a directory in an S3 bucket.
+
+    Members are uploaded in parallel as the archive is read, with a
+    ``Content-Type`` guessed from their file names.
+
+    Parameters
+    ----------
+    fileobj : file-like object
+        The archive. Zip archives that aren't seekable are first spooled to
+        a temporary file.
+    archive_format : str
+        One of `ARCHIVE_FORMATS`.
+    bucket_name : str
+        Name of an S3 bucket.
+    root_path : str
+        Directory in the S3 bucket where members are uploaded.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    surrogate_key : str, optional
+        Value of the ``x-amz-meta-surrogate-key`` header of the objects.
+    cache_control : str, optional
+        Value of the ``Cache-Control`` header of the objects.
+    surrogate_control : str, optional
+        Value of the ``x-amz-meta-surrogate-control`` header of the objects.
+    max_workers : int, optional
+        Maximum number of members to upload concurrently.
+
+    Returns
+    -------
+    n_objects : int
+        Number of objects uploaded.
+    n_bytes : int
+        Total size of the uploaded objects.
+
+    Raises
+    ------
+    app.exceptions.ValidationError
+        Raised if the archive is invalid.
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    client = s3.get_client(aws_access_key_id, aws_secret_access_key,
+                           aws_region_name=aws_region_name,
+                           aws_endpoint_url=aws_endpoint_url)
+
+    metadata = {}
+    if surrogate_key is not None:
+        metadata['surrogate-key'] = surrogate_key
+    if surrogate_control is not None:
+        metadata['surrogate-control'] = surrogate_control
+
+    if archive_format == 'zip' and not _is_seekable(fileobj):
+        with tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(fileobj, spool, CHUNK_SIZE)
+            spool.seek(0)
+            return _upload_members(client, spool, archive_format,
+                                   bucket_name, root_path, metadata,
+                                   cache_control, max_workers)
+    return _upload_members(client, fileobj, archive_format,
+                           bucket_name, root_path, metadata,
+                           cache_control, max_workers)
+
+
+def upload_bucket_archive(archive_key, bucket_name, root_path,
+                          aws_access_key_id, aws_secret_access_key,
+                          aws_region_name=None, aws_endpoint_url=None,
+                          **kwargs):
+    """Upload the members of an archive that's already in an S3 bucket to a
+    directory in the same bucket.
+
+    Tar archives are streamed from S3. Zip archives are downloaded to a
+    temporary file first, since they're read from their end.
+
+    Parameters
+    ----------
+    archive_key : str
+        Key of the archive object in the bucket. The archive's format is
+        guessed from the key (see `guess_archive_format`).
+    bucket_name : str
+        Name of an S3 bucket.
+    root_path : str
+        Directory in the S3 bucket where members are uploaded.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    **kwargs
+        Additional keyword arguments for `upload_archive`.
+
+    Returns
+    -------
+    n_objects : int
+        Number of objects uploaded.
+    n_bytes : int
+        Total size of the uploaded objects.
+    """
+    archive_format = guess_archive_format(archive_key)
+
+    client = s3.get_client(aws_access_key_id, aws_secret_access_key,
+                           aws_region_name=aws_region_name,
+                           aws_endpoint_url=aws_endpoint_url)
+    body = client.get_object(Bucket=bucket_name, Key=archive_key)['Body']
+
+    return upload_archive(body, archive_format, bucket_name, root_path,
+                          aws_access_key_id, aws_secret_access_key,
+                          aws_region_name=aws_region_name,
+                          aws_endpoint_url=aws_endpoint_url, **kwargs)
+
+
+def _is_seekable(fileobj):
+    try:
+        return fileobj.seekable()
+    except AttributeError:
+        return False
+
+
+def _upload_members(client, fileobj, archive_format, bucket_name, root_path,
+                    metadata, cache_control, max_workers):
+    """Spool and upload archive members with a bounded number of members in
+    flight.
+    """
+    if not root_path.endswith('/'):
+        root_path += '/'
+
+    # Limit the members that are read ahead of the uploads
+    slots = threading.BoundedSemaphore(2 * max_workers)
+    errors = []
+    n_objects = 0
+    n_bytes = 0
+
+    def upload(key, spool, content_type):
+        try:
+            put_args = {}
+            if cache_control is not None:
+                put_args['CacheControl'] = cache_control
+            client.put_object(Bucket=bucket_name,
+                              Key=key,
+                              Body=spool,
+                              ACL='public-read',
+                              ContentType=content_type,
+                              Metadata=metadata,
+                              **put_args)
+        except Exception as e:
+            log.exception('Failed to upload {0}'.format(key))
+            errors.append(e)
+        finally:
+            spool.close()
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for path, member_fileobj, size in iter_archive_members(
+                fileobj, archive_format):
+            if len(errors) > 0:
+                break
+            slots.acquire()
+            spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            shutil.copyfileobj(member_fileobj, spool, CHUNK_SIZE)
+            spool.seek(0)
+            content_type = mimetypes.guess_type(path)[0] \
+                or 'application/octet-stream'
+            executor.submit(upload, root_path + path, spool, content_type)
+            n_objects += 1
+            n_bytes += size
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    log.info('Uploaded {0:d} archive members ({1:d} bytes) to {2}:{3}'.format(
+        n_objects, n_bytes, bucket_name, root_path))
+    return n_objects, n_bytes
+
+
+def stream_zip_archive(bucket_name, root_path,
+                       aws_access_key_id, aws_secret_access_key,
+                       aws_region_name=None, aws_endpoint_url=None,
+                       archive_key=None, max_workers=8,
+                       part_size=16 * 1024 * 1024):
+    """Stream a zip archive of a directory in an S3 bucket.
+
+    The directory is listed before this function returns, but objects are
+    only downloaded as the archive is consumed. Up to `max_workers` object
+    downloads are started ahead of the one being compressed, and object
+    contents are streamed in chunks, so memory use doesn't depend on the
+    size of the directory or its objects. Directory redirect objects (see
+    `app.s3.copy_directory`) aren't included in the archive.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    root_path : str
+        Directory in the S3 bucket to archive. Archive members are named
+        relative to this directory.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    archive_key : str, optional
+        If set, a copy of the archive is saved to the bucket with this key
+        (in a multipart upload, while the archive is streamed). The upload
+        is aborted if the archive isn't consumed completely.
+    max_workers : int, optional
+        Maximum number of object downloads to start ahead.
+    part_size : int, optional
+        Size (bytes) of the parts of the archive's upload, and thus of the
+        buffer used to save the archive.
+
+    Returns
+    -------
+    chunks : generator of bytes
+        Content of the zip archive.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    if not root_path.endswith('/'):
+        root_path += '/'
+
+    objects = s3.list_directory(bucket_name, root_path,
+                                aws_access_key_id, aws_secret_access_key,
+                                aws_region_name=aws_region_name,
+                                aws_endpoint_url=aws_endpoint_url)
+    redirect_paths = set(s3.directory_redirect_paths(objects))
+    paths = sorted(path for path in objects if path not in redirect_paths)
+
+    # Prefetched downloads each hold one of the client's pooled connections
+    client = s3.get_client(aws_access_key_id, aws_secret_access_key,
+                           aws_region_name=aws_region_name,
+                           aws_endpoint_url=aws_endpoint_url)
+
+    uploader = None
+    if archive_key is not None:
+        uploader = _MultipartUpload(client, bucket_name, archive_key,
+                                    max(part_size, MIN_PART_SIZE))
+    return _iter_zip_archive(client, bucket_name, root_path, paths,
+                             uploader, max_workers)
+
+
+def get_archive_url(bucket_name, archive_key,
+                    aws_access_key_id, aws_secret_access_key,
+                    aws_region_name=None, aws_endpoint_url=None,
+                    filename=None, expires_in=3600):
+    """Get a presigned download URL for an archive saved in an S3 bucket by
+    `stream_zip_archive`.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    archive_key : str
+        Key of the archive in the bucket.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    filename : str, optional
+        File name suggested to clients that download the archive (in a
+        ``Content-Disposition`` header).
+    expires_in : int, optional
+        Lifetime of the URL, in seconds.
+
+    Returns
+    -------
+    url : str
+        Presigned URL, or `None` if the archive doesn't exist.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    client = s3.get_client(aws_access_key_id, aws_secret_access_key,
+                           aws_region_name=aws_region_name,
+                           aws_endpoint_url=aws_endpoint_url)
+
+    try:
+        client.head_object(Bucket=bucket_name, Key=archive_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+
+    params = {'Bucket': bucket_name, 'Key': archive_key}
+    if filename is not None:
+        params['ResponseContentDisposition'] = \
+            'attachment; filename="{0}"'.format(filename)
+    return client.generate_presigned_url('get_object', Params=params,
+                                         ExpiresIn=expires_in)
+
+
+class _ZipOutput(object):
+    """Unseekable file-like object that buffers the output of a
+    `zipfile.ZipFile` until it's drained.
+    """
+
+    def __init__(self):
+        super(_ZipOutput, self).__init__()
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class _ZipStreamWriter(object):
+    """Write a zip archive to an unseekable stream, member by member.
+
+    Members are deflated, and written with a data descriptor (their CRC and
+    sizes follow their data) and ZIP64 sizes, so that they can be written in
+    chunks without knowing their sizes in advance. `zipfile.ZipFile.open`
+    can only write members this way from Python 3.6.
+    """
+
+    def __init__(self, fileobj):
+        super(_ZipStreamWriter, self).__init__()
+        self._fileobj = fileobj
+        self._offset = 0
+        self._entries = []
+        self._member = None
+
+    def _write(self, data):
+        self._fileobj.write(data)
+        self._offset += len(data)
+
+    def start_member(self, name, date_time):
+        """Start a member, named `name`, modified at the `date_time`
+        ``(year, month, day, hour, minute, second)`` tuple.
+        """
+        try:
+            name_bytes = name.encode('ascii')
+            flags = 0x08
+        except UnicodeEncodeError:
+            name_bytes = name.encode('utf-8')
+            flags = 0x08 | 0x800
+        year, month, day, hour, minute, second = date_time
+        dos_date = (max(year, 1980) - 1980) << 9 | month << 5 | day
+        dos_time = hour << 11 | minute << 5 | second // 2
+        # Placeholder ZIP64 sizes; the real ones are in the data descriptor
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+        self._member = {'name': name_bytes, 'flags': flags,
+                        'dos_date': dos_date, 'dos_time': dos_time,
+                        'offset': self._offset, 'crc': 0, 'size': 0,
+                        'compressed_size': 0,
+                        'compressor': zlib.compressobj(
+                            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)}
+        self._write(struct.pack('<4s2B4HL2L2H', b'PK\x03\x04', 45, 0, flags,
+                                zipfile.ZIP_DEFLATED, dos_time, dos_date, 0,
+                                0xFFFFFFFF, 0xFFFFFFFF, len(name_bytes),
+                                len(extra)))
+        self._write(name_bytes)
+        self._write(extra)
+
+    def write(self, data):
+        """Write data to the current member."""
+        member = self._member
+        member['crc'] = zlib.crc32(data, member['crc'])
+        member['size'] += len(data)
+        compressed = member['compressor'].compress(data)
+        member['compressed_size'] += len(compressed)
+        self._write(compressed)
+
+    def end_member(self):
+        """Finish the current member."""
+        member = self._member
+        compressed = member.pop('compressor').flush()
+        member['compressed_size'] += len(compressed)
+        self._write(compressed)
+        self._write(struct.pack('<4sLQQ', b'PK\x07\x08', member['crc'],
+                                member['compressed_size'], member['size']))
+        self._entries.append(member)
+        self._member = None
+
+    def close(self):
+        """Write the archive's central directory."""
+        directory_offset = self._offset
+        for entry in self._entries:
+            zip64_fields = []
+            fields = []
+            for key in ('size', 'compressed_size', 'offset'):
+                if entry[key] >= _ZIP64_LIMIT:
+                    zip64_fields.append(entry[key])
+                    fields.append(0xFFFFFFFF)
+                else:
+                    fields.append(entry[key])
+            size, compressed_size, offset = fields
+            extra = b''
+            if len(zip64_fields) > 0:
+                extra = struct.pack('<HH' + 'Q' * len(zip64_fields), 1,
+                                    8 * len(zip64_fields), *zip64_fields)
+            self._write(struct.pack(
+                '<4s4B4HL2L5H2L', b'PK\x01\x02', 45, 3, 45, 0,
+                entry['flags'], zipfile.ZIP_DEFLATED, entry['dos_time'],
+                entry['dos_date'], entry['crc'], compressed_size, size,
+                len(entry['name']), len(extra), 0, 0, 0, 0o644 << 16,
+                offset))
+            self._write(entry['name'])
+            self._write(extra)
+
+        count = len(self._entries)
+        directory_size = self._offset - directory_offset
+        if count >= 0xFFFF or directory_offset >= _ZIP64_LIMIT \
+                or directory_size >= _ZIP64_LIMIT:
+            zip64_offset = self._offset
+            self._write(struct.pack('<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45,
+                                    0, 0, count, count, directory_size,
+                                    directory_offset))
+            self._write(struct.pack('<4sLQL', b'PK\x06\x07', 0, zip64_offset,
+                                    1))
+            count = min(count, 0xFFFF)
+            directory_size = min(directory_size, 0xFFFFFFFF)
+            directory_offset = min(directory_offset, 0xFFFFFFFF)
+        self._write(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, count, count,
+                                directory_size, directory_offset, 0))
+
+
+class _MultipartUpload(object):
+    """Upload of a stream to S3, part by part.
+
+    The multipart upload is only created once a full part is written;
+    smaller streams are uploaded in a single request.
+    """
+
+    def __init__(self, client, bucket_name, key, part_size):
+        super(_MultipartUpload, self).__init__()
+        self._client = client
+        self._bucket_name = bucket_name
+        self._key = key
+        self._part_size = part_size
+        self._buffer = bytearray()
+        self._parts = []
+        self._upload_id = None
+
+    def write(self, data):
+        self._buffer.extend(data)
+        if len(self._buffer) >= self._part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            self._upload_id = self._client.create_multipart_upload(
+                Bucket=self._bucket_name, Key=self._key,
+                ContentType='application/zip')['UploadId']
+        part_number = len(self._parts) + 1
+        r = self._client.upload_part(
+            Bucket=self._bucket_name, Key=self._key,
+            UploadId=self._upload_id, PartNumber=part_number,
+            Body=bytes(self._buffer))
+        self._parts.append({'PartNumber': part_number, 'ETag': r['ETag']})
+        self._buffer.clear()
+
+    def complete(self):
+        if self._upload_id is None:
+            self._client.put_object(
+                Bucket=self._bucket_name, Key=self._key,
+                Body=bytes(self._buffer), ContentType='application/zip')
+        else:
+            self._upload_part()
+            self._client.complete_multipart_upload(
+                Bucket=self._bucket_name, Key=self._key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': self._parts})
+        log.info('Saved archive {0}:{1}'.format(self._bucket_name,
+                                                self._key))
+
+    def abort(self):
+        if self._upload_id is not None:
+            self._client.abort_multipart_upload(
+                Bucket=self._bucket_name, Key=self._key,
+                UploadId=self._upload_id)
+
+
+def _iter_zip_archive(client, bucket_name, root_path, paths, uploader,
+                      max_workers):
+    """Generate a zip archive from objects, prefetching their downloads."""
+    output = _ZipOutput()
+    completed = False
+
+    def drain():
+        data = output.drain()
+        if uploader is not None and len(data) > 0:
+            uploader.write(data)
+        return data
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            downloads = deque()
+            pending_paths = iter(paths)
+
+            def start_download():
+                path = next(pending_paths, None)
+                if path is not None:
+                    downloads.append((path, executor.submit(
+                        client.get_object, Bucket=bucket_name,
+                        Key=root_path + path)))
+
+            for _ in range(max_workers):
+                start_download()
+
+            writer = _ZipStreamWriter(output)
+            while len(downloads) > 0:
+                path, future = downloads.popleft()
+                response = future.result()
+                start_download()
+
+                writer.start_member(
+                    path, response['LastModified'].timetuple()[:6])
+                body = response['Body']
+                for chunk in iter(lambda: body.read(CHUNK_SIZE), b''):
+                    writer.write(chunk)
+                    data = drain()
+                    if len(data) > 0:
+                        yield data
+                body.close()
+                writer.end_member()
+            writer.close()
+            yield drain()
+        if uploader is not None:
+            uploader.complete()
+        completed = True
+    finally:
+        if uploader is not None and not completed:
+            uploader.abort()
@@ -0,0 +1,155 @@
+"""Cache-Control policies for published objects.
+
+A :class:`CachePolicy` picks the ``Cache-Control`` and ``Surrogate-Control``
+headers of each object copied into an edition, from an ordered list of
+rules that match the object's path and content type. For example,
+fingerprinted static assets can be cached by browsers forever, while HTML
+pages are revalidated.
+
+Rules are dicts with any of these fields:
+
+``path``
+    Glob pattern (see `fnmatch`) matched against the object's path,
+    relative to the edition's directory.
+``path_regex``
+    Regular expression searched for in the object's path.
+``content_type``
+    Glob pattern matched against the object's ``Content-Type``.
+``cache_control``
+    ``Cache-Control`` header of matching objects.
+``surrogate_control``
+    ``Surrogate-Control`` header (``x-amz-meta-surrogate-control``) of
+    matching objects.
+
+A rule matches an object if all of its ``path``, ``path_regex`` and
+``content_type`` fields match. The first matching rule applies; headers
+that it doesn't set, and the headers of objects that no rule matches, are
+the edition's defaults.
+
+Rules are configured as a JSON array with the
+``LTD_KEEPER_CACHE_CONTROL_RULES`` environment variable (the
+``CACHE_CONTROL_RULES`` configuration). `DEFAULT_RULES` are used otherwise.
+
+Headers are only set when objects are copied, so each policy has a
+`CachePolicy.digest` that editions fold into their fingerprints (see
+`app.models.Edition.rebuild_from_build`): when the rules change, the next
+rebuild of each edition copies all its objects with the new headers,
+instead of skipping or syncing them.
+"""
+
+import fnmatch
+import hashlib
+import json
+import re
+
+__all__ = ['DEFAULT_RULES', 'CachePolicy', 'get_cache_policy']
+
+
+DEFAULT_RULES = [
+    # Assets with a content hash in their file name never change. Hashes
+    # have at least one letter, so that names with dates or numbers (such
+    # as figure-20190401.png) aren't mistaken for them
+    {'path_regex':
+        r'[.-](?=[0-9]*[a-f])[0-9a-f]{8,}\.'
+        r'(css|js|woff2?|ttf|eot|svg|png|jpg|gif)$',
+     'cache_control': 'public, max-age=31536000, immutable'},
+    # Pages change with each rebuild, so browsers only cache them briefly
+    {'content_type': 'text/html',
+     'cache_control': 'public, max-age=60'},
+]
+"""Rules used when ``CACHE_CONTROL_RULES`` isn't configured."""
+
+
+class CachePolicy(object):
+    """Cache header policy for the objects of an edition.
+
+    Parameters
+    ----------
+    rules : list of dict
+        Ordered rules (see the module documentation).
+    cache_control : str, optional
+        Default ``Cache-Control`` header.
+    surrogate_control : str, optional
+        Default ``Surrogate-Control`` header.
+
+    Attributes
+    ----------
+    digest : str
+        Hex SHA-256 digest of the rules and defaults. Policies with the same
+        digest set the same headers.
+    """
+
+    def __init__(self, rules, cache_control=None, surrogate_control=None):
+        super(CachePolicy, self).__init__()
+        self.cache_control = cache_control
+        self.surrogate_control = surrogate_control
+        self.digest = hashlib.sha256(json.dumps(
+            [rules, cache_control, surrogate_control],
+            sort_keys=True).encode('utf-8')).hexdigest()
+        self._rules = []
+        for rule in rules:
+            rule = dict(rule)
+            if 'path_regex' in rule:
+                rule['path_regex'] = re.compile(rule['path_regex'])
+            self._rules.append(rule)
+
+    def get_headers(self, path, content_type=None):
+        """Get the cache headers of an object.
+
+        Parameters
+        ----------
+        path : str
+            Path of the object, relative to the edition's directory.
+        content_type : str, optional
+            ``Content-Type`` of the object.
+
+        Returns
+        -------
+        cache_control : str
+            ``Cache-Control`` header, or `None` to keep the object's header.
+        surrogate_control : str
+            ``Surrogate-Control`` header, or `None` to keep the object's
+            header.
+        """
+        for rule in self._rules:
+            if self._match(rule, path, content_type):
+                return (rule.get('cache_control', self.cache_control),
+                        rule.get('surrogate_control', self.surrogate_control))
+        return self.cache_control, self.surrogate_control
+
+    @staticmethod
+    def _match(rule, path, content_type):
+        if 'path' in rule and not fnmatch.fnmatchcase(path, rule['path']):
+            return False
+        if 'path_regex' in rule and rule['path_regex'].search(path) is None:
+            return False
+        if 'content_type' in rule:
+            # ignore parameters like "; charset=utf-8"
+            mime_type = (content_type or '').split(';')[0].strip()
+            if not fnmatch.fnmatchcase(mime_type, rule['content_type']):
+                return False
+        return True
+
+
+def get_cache_policy(config, cache_control=None, surrogate_control=None):
+    """Get the cache policy configured for the application.
+
+    Parameters
+    ----------
+    config : dict
+        The application's configuration.
+    cache_control : str, optional
+        Default ``Cache-Control`` header.
+    surrogate_control : str, optional
+        Default ``Surrogate-Control`` header.
+
+    Returns
+    -------
+    policy : `CachePolicy`
+        The cache policy.
+    """
+    rules = config.get('CACHE_CONTROL_RULES')
+    if rules is None:
+        rules = DEFAULT_RULES
+    return CachePolicy(rules, cache_control=cache_control,
+                       surrogate_control=surrogate_control)
@@ -2,8 +2,7 @@
 of product editions and builds.
 """
 
-import requests
-
+from . import httpclient
 from .exceptions import DasherError
 
 
@@ -38,7 +37,8 @@ def build_dashboards(product_urls, dasher_url, logger):
 
     dasher_build_url = '{0}/build'.format(dasher_url)
     request_data = {'product_urls': product_urls}
-    r = requests.post(dasher_build_url, json=request_data)
+    r = httpclient.get_session('dasher').post(dasher_build_url,
+                                              json=request_data)
 
     if r.status_code != 202:
         raise DasherError('Dasher error (status {0})'.format(r.status_code))
@@ -51,6 +51,10 @@ def build_dashboard_safely(app, request, product):
     a build uploard or an edition change, so this function logs errors, but
     allows the route to return cleanly.
 
+    Once the dashboard build is triggered, a purge of the product's
+    surrogate key from Fastly is queued for ``LTD_DASHER_PURGE_DELAY``
+    seconds later (see `app.models.Product.purge`).
+
     Parameters
     ----------
     app :
@@ -64,6 +68,11 @@ def build_dashboard_safely(app, request, product):
         build_dashboards([product.get_url()],
                          app.config['LTD_DASHER_URL'],
                          app.logger)
+        if app.config['LTD_DASHER_URL'] is not None:
+            # Dashboards are cached with the product's surrogate key. Dasher
+            # builds them asynchronously, so the purge is held for long
+            # enough for its upload, and isn't merged with earlier purges
+            product.purge(delay=app.config['LTD_DASHER_PURGE_DELAY'])
     except Exception:
         app.logger.exception(
             'LTD Dasher failed '
@@ -4,13 +4,38 @@ See https://docs.fastly.com/api/ for more information about the Fastly API.
 """
 
 import logging
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
 import requests
 
+from . import httpclient
 from .exceptions import FastlyError
 
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+# API rate limits last reported by Fastly, keyed by service ID
+_rate_limits = {}
+_rate_limits_lock = threading.Lock()
+
+
+def get_rate_limits():
+    """Get the API rate limits that Fastly last reported for each service.
+
+    Returns
+    -------
+    rate_limits : dict
+        Keys are service IDs. Values are dicts with ``remaining`` (number
+        of API requests left in the current window), ``reset`` (Unix time
+        when the window ends) and ``updated`` (Unix time of the response
+        that reported them) fields.
+    """
+    with _rate_limits_lock:
+        return {service_id: dict(rate_limit)
+                for service_id, rate_limit in _rate_limits.items()}
+
 
 class FastlyService(object):
     """API client for a Fastly service.
@@ -21,29 +46,247 @@ class FastlyService(object):
         The Fastly service ID.
     api_key : str
         The Fastly API key. We only support key-based authentication.
+    api_root : str, optional
+        Root URL of the Fastly API (`DEFAULT_API_ROOT` by default), e.g. of
+        a stand-in server (see `app.standins`).
     """
 
-    def __init__(self, service_id, api_key):
+    DEFAULT_API_ROOT = 'https://api.fastly.com'
+    """Root URL of Fastly's API."""
+
+    MAX_PURGE_KEYS = 256
+    """Maximum number of surrogate keys in a bulk purge request."""
+
+    def __init__(self, service_id, api_key, api_root=None):
         super(FastlyService, self).__init__()
         self.service_id = service_id
         self.api_key = api_key
-        self._api_root = 'https://api.fastly.com'
+        if api_root is None:
+            api_root = self.DEFAULT_API_ROOT
+        self._api_root = api_root.rstrip('/')
+        # Connections are pooled by the process-wide session
+        self._session = httpclient.get_session('fastly')
 
     def _url(self, path):
         return self._api_root + path
 
-    def purge_key(self, surrogate_key):
+    def _post(self, path, headers):
+        return self._request('post', path, headers)
+
+    def _request(self, method, path, headers, data=None):
+        r = self._session.request(method, self._url(path), headers=headers,
+                                  data=data)
+        self._record_rate_limit(r)
+        return r
+
+    def _record_rate_limit(self, r):
+        """Track the API budget from Fastly's rate limit headers."""
+        try:
+            remaining = int(r.headers['Fastly-RateLimit-Remaining'])
+            reset = float(r.headers.get('Fastly-RateLimit-Reset', 0))
+        except (KeyError, ValueError):
+            return
+        with _rate_limits_lock:
+            _rate_limits[self.service_id] = {'remaining': remaining,
+                                             'reset': reset,
+                                             'updated': time.time()}
+
+    @property
+    def rate_limit(self):
+        """The API rate limit that Fastly last reported for the service
+        (see `get_rate_limits`), or `None` if it's unknown.
+        """
+        with _rate_limits_lock:
+            rate_limit = _rate_limits.get(self.service_id)
+            return dict(rate_limit) if rate_limit is not None else None
+
+    def _headers(self):
+        return {'Fastly-Key': self.api_key,
+                'Accept': 'application/json'}
+
+    def _purge_headers(self, soft):
+        headers = self._headers()
+        if soft:
+            # Mark content as stale rather than removing it, so that it can
+            # still be served (stale-while-revalidate) while it's refreshed
+            headers['Fastly-Soft-Purge'] = '1'
+        return headers
+
+    def purge_key(self, surrogate_key, soft=False):
         """Instant purge URLs with a given `surrogate_key`.
 
         See
         https://docs.fastly.com/api/purge#purge_077dfb4aa07f49792b13c87647415537
         for more information.
+
+        Parameters
+        ----------
+        surrogate_key : str
+            The surrogate key to purge.
+        soft : bool, optional
+            If `True`, soft purge the URLs: mark them as stale instead of
+            removing them from the cache.
         """
         path = '/service/{service}/purge/{surrogate_key}'.format(
             service=self.service_id, surrogate_key=surrogate_key)
-        log.info('Fastly purge {0}'.format(path))
-        r = requests.post(self._url(path),
-                          headers={'Fastly-Key': self.api_key,
-                                   'Accept': 'application/json'})
+        log.info('Fastly {0}purge {1}'.format('soft ' if soft else '', path))
+        r = self._post(path, self._purge_headers(soft))
         if r.status_code != 200:
             raise FastlyError(r.json)
+
+    def purge_keys(self, surrogate_keys, soft=False):
+        """Instant purge URLs with any of the given `surrogate_keys`, in
+        bulk.
+
+        Keys are purged with as few requests as possible, in batches of up
+        to `MAX_PURGE_KEYS` keys. A failed batch doesn't stop the others.
+
+        See
+        https://docs.fastly.com/api/purge#purge_db35b293f8a724717fcf25628d713583
+        for more information.
+
+        Parameters
+        ----------
+        surrogate_keys : list of str
+            The surrogate keys to purge. Duplicates are purged once.
+        soft : bool, optional
+            If `True`, soft purge the URLs: mark them as stale instead of
+            removing them from the cache.
+
+        Returns
+        -------
+        results : dict
+            Keys are the surrogate keys. Values are dicts with ``purged``
+            (`True` if the key was purged), ``purge_id`` (Fastly's ID of
+            the purge, if any) and ``error`` (the error message of a failed
+            purge, or `None`) fields.
+        """
+        # Remove duplicates, but keep the order
+        surrogate_keys = list(OrderedDict.fromkeys(surrogate_keys))
+        path = '/service/{service}/purge'.format(service=self.service_id)
+        results = OrderedDict()
+        for i in range(0, len(surrogate_keys), self.MAX_PURGE_KEYS):
+            batch = surrogate_keys[i:i + self.MAX_PURGE_KEYS]
+            log.info('Fastly {0}purge {1} ({2:d} keys)'.format(
+                'soft ' if soft else '', path, len(batch)))
+            headers = self._purge_headers(soft)
+            headers['Surrogate-Key'] = ' '.join(batch)
+            try:
+                r = self._post(path, headers)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                error = None if r.status_code == 200 else \
+                    'Fastly responded {0:d}: {1}'.format(r.status_code,
+                                                         r.text)
+            if error is not None:
+                log.warning('Fastly purge of {0:d} keys failed: {1}'.format(
+                    len(batch), error))
+                purge_ids = {}
+            else:
+                try:
+                    purge_ids = r.json()
+                except ValueError:
+                    purge_ids = {}
+            for key in batch:
+                results[key] = {'purged': error is None,
+                                'purge_id': purge_ids.get(key),
+                                'error': error}
+        return results
+
+    def purge_url(self, url, soft=False):
+        """Instant purge a single URL.
+
+        See https://docs.fastly.com/api/purge for more information.
+
+        Parameters
+        ----------
+        url : str
+            The URL to purge, e.g. ``'https://pipelines.lsst.io/v/v1/'``.
+        soft : bool, optional
+            If `True`, soft purge the URL: mark it as stale instead of
+            removing it from the cache.
+        """
+        url_parts = urllib.parse.urlsplit(url)
+        path = '/purge/' + url_parts.netloc + url_parts.path
+        log.info('Fastly {0}purge {1}'.format('soft ' if soft else '', path))
+        r = self._post(path, self._purge_headers(soft))
+        if r.status_code != 200:
+            raise FastlyError(r.json)
+
+    def purge_all(self):
+        """Purge all content of the service.
+
+        This is a single API request, but it empties the cache of every
+        product served by the service.
+
+        See https://docs.fastly.com/api/purge for more information.
+        """
+        path = '/service/{service}/purge_all'.format(service=self.service_id)
+        log.warning('Fastly purge {0}'.format(path))
+        r = self._post(path, self._purge_headers(False))
+        if r.status_code != 200:
+            raise FastlyError(r.json)
+
+    def set_dictionary_item(self, dictionary_id, key, value):
+        """Create or update an item of an edge dictionary of the service.
+
+        See https://docs.fastly.com/api/config#dictionary_item for more
+        information.
+
+        Parameters
+        ----------
+        dictionary_id : str
+            ID of the edge dictionary.
+        key : str
+            Key of the item.
+        value : str
+            Value of the item.
+        """
+        path = self._dictionary_item_path(dictionary_id, key)
+        log.info('Fastly set {0} to {1}'.format(path, value))
+        r = self._request('put', path, self._headers(),
+                          data={'item_value': value})
+        if r.status_code != 200:
+            raise FastlyError(r.json)
+
+    def delete_dictionary_item(self, dictionary_id, key):
+        """Delete an item of an edge dictionary of the service, if it
+        exists.
+
+        See https://docs.fastly.com/api/config#dictionary_item for more
+        information.
+
+        Parameters
+        ----------
+        dictionary_id : str
+            ID of the edge dictionary.
+        key : str
+            Key of the item.
+        """
+        path = self._dictionary_item_path(dictionary_id, key)
+        log.info('Fastly delete {0}'.format(path))
+        r = self._request('delete', path, self._headers())
+        if r.status_code not in (200, 404):
+            raise FastlyError(r.json)
+
+    def _dictionary_item_path(self, dictionary_id, key):
+        return '/service/{service}/dictionary/{dictionary}/item/{key}'\
+            .format(service=self.service_id, dictionary=dictionary_id,
+                    key=urllib.parse.quote(key, safe=''))
+
+
+def raise_for_failed_purges(results):
+    """Raise a `~app.exceptions.FastlyError` if any key of a bulk purge
+    failed.
+
+    Parameters
+    ----------
+    results : dict
+        Results of `FastlyService.purge_keys`.
+    """
+    failed = [key for key, result in results.items() if not result['purged']]
+    if len(failed) > 0:
+        raise FastlyError('Failed to purge {0:d} of {1:d} surrogate keys: '
+                          '{2}'.format(len(failed), len(results),
+                                       results[failed[0]]['error']))
@@ -0,0 +1,102 @@
+"""Shared HTTP sessions for external services (Fastly and LTD Dasher).
+
+Each service has a single `requests.Session`, shared by all threads of the
+process, so that requests reuse pooled keep-alive connections rather than
+resolving, connecting and negotiating TLS on each call. Requests made with
+the sessions have a default timeout.
+
+Pool sizes and timeouts are set from the ``HTTP_POOL_MAXSIZE``,
+``HTTP_CONNECT_TIMEOUT`` and ``HTTP_READ_TIMEOUT`` configuration when the
+application is created (see :func:`configure`).
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+__all__ = ['get_session', 'configure', 'close_sessions']
+
+
+DEFAULT_POOL_MAXSIZE = 10
+"""Default maximum number of pooled connections per host."""
+
+DEFAULT_TIMEOUT = (3.05, 30.)
+"""Default ``(connect, read)`` timeouts of requests, in seconds."""
+
+_settings = {'pool_maxsize': DEFAULT_POOL_MAXSIZE,
+             'timeout': DEFAULT_TIMEOUT}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class _Session(requests.Session):
+    """A `requests.Session` with a default timeout."""
+
+    def __init__(self, timeout):
+        super(_Session, self).__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(_Session, self).request(method, url, **kwargs)
+
+
+def configure(pool_maxsize=None, timeout=None):
+    """Set the pool size and timeout of sessions.
+
+    Existing sessions are closed, so that new sessions are created with the
+    settings.
+
+    Parameters
+    ----------
+    pool_maxsize : int, optional
+        Maximum number of pooled connections per host. Set this to at least
+        the number of threads that make requests concurrently.
+    timeout : float or tuple, optional
+        Default timeout of requests, in seconds, or a ``(connect, read)``
+        tuple of timeouts.
+    """
+    with _sessions_lock:
+        if pool_maxsize is not None:
+            _settings['pool_maxsize'] = pool_maxsize
+        if timeout is not None:
+            _settings['timeout'] = timeout
+        _close_sessions()
+
+
+def get_session(service):
+    """Get the shared session of a service.
+
+    Parameters
+    ----------
+    service : str
+        Name of the service, e.g. ``'fastly'``.
+
+    Returns
+    -------
+    session : `requests.Session`
+        The service's session.
+    """
+    with _sessions_lock:
+        session = _sessions.get(service)
+        if session is None:
+            session = _Session(_settings['timeout'])
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=_settings['pool_maxsize'])
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[service] = session
+        return session
+
+
+def close_sessions():
+    """Close all sessions and their pooled connections."""
+    with _sessions_lock:
+        _close_sessions()
+
+
+def _close_sessions():
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
@@ -0,0 +1,131 @@
+"""Background execution of long-running jobs.
+
+Some operations, like tearing down a product, touch thousands of S3 objects
+and can't be completed inside an HTTP request. Routes hand these operations
+to :func:`submit`, which runs them in a thread pool. Each job runs inside its
+own application context and database session.
+
+Jobs that wait for something, like a page to change in Fastly, shouldn't
+sleep in the thread pool, which has only ``JOBS_MAX_WORKERS`` threads.
+Instead, they reschedule themselves with :func:`submit_later`.
+
+Set the ``JOBS_EAGER`` configuration to run jobs synchronously, inside the
+caller's context (this is how the test harness runs jobs).
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from flask import current_app
+
+from . import db
+
+__all__ = ['submit', 'submit_later']
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def submit(func, *args, **kwargs):
+    """Run ``func(*args, **kwargs)`` as a background job.
+
+    This function must be called from within an application context.
+
+    Parameters
+    ----------
+    func : callable
+        The job function. Since the job runs in a new application context,
+        pass database entities by their ID rather than as instances.
+    *args, **kwargs
+        Arguments passed to `func`.
+
+    Returns
+    -------
+    future : `concurrent.futures.Future`
+        Future for the job's return value. When ``JOBS_EAGER`` is set, the
+        job has already run and any exception it raised is propagated to the
+        caller instead.
+    """
+    app = current_app._get_current_object()
+
+    if app.config['JOBS_EAGER']:
+        future = Future()
+        future.set_result(func(*args, **kwargs))
+        return future
+
+    log.info('Submitting job {0}'.format(func.__name__))
+    return _get_executor(app).submit(_run_job, app, func, args, kwargs)
+
+
+def submit_later(delay, func, *args, **kwargs):
+    """Run ``func(*args, **kwargs)`` as a background job after a delay.
+
+    A timer thread submits the job (see `submit`) once the delay has passed,
+    so no job thread is held while waiting. Delayed jobs that haven't been
+    submitted when the process exits are dropped.
+
+    This function must be called from within an application context.
+
+    Parameters
+    ----------
+    delay : float
+        Seconds to wait before submitting the job.
+    func : callable
+        The job function.
+    *args, **kwargs
+        Arguments passed to `func`.
+
+    Returns
+    -------
+    timer : `threading.Timer`
+        The timer that submits the job, or `None` when ``JOBS_EAGER`` is
+        set, in which case the caller sleeps for the delay and then runs
+        the job.
+    """
+    app = current_app._get_current_object()
+
+    if app.config['JOBS_EAGER']:
+        time.sleep(delay)
+        submit(func, *args, **kwargs)
+        return None
+
+    timer = threading.Timer(delay, _submit_in_context,
+                            args=(app, func, args, kwargs))
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def _submit_in_context(app, func, args, kwargs):
+    """Submit a job from a timer thread."""
+    with app.app_context():
+        submit(func, *args, **kwargs)
+
+
+def _get_executor(app):
+    """Get the process-wide job executor, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config['JOBS_MAX_WORKERS'])
+        return _executor
+
+
+def _run_job(app, func, args, kwargs):
+    """Run a job function in a new application context."""
+    with app.app_context():
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            app.logger.exception('Job {0} failed'.format(func.__name__))
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
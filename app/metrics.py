@@ -0,0 +1,168 @@
+"""In-process metrics registry.
+
+Modules declare counters and gauges at import time with :func:`counter` and
+:func:`gauge`, and update them as they work. The ``GET /metrics`` endpoint
+renders all metrics in the Prometheus text exposition format (see
+:func:`render`).
+
+Metrics are kept in memory, per process, and reset when the process
+restarts.
+"""
+
+import threading
+from collections import OrderedDict
+
+__all__ = ['Counter', 'Gauge', 'Registry', 'REGISTRY', 'counter', 'gauge',
+           'render']
+
+
+class _Metric(object):
+    """Base class for metrics with labelled values.
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric, e.g. ``'ltd_keeper_mirror_failures_total'``.
+    documentation : str
+        One-line description of the metric.
+    callback : callable, optional
+        Function that returns the metric's samples, as a list of
+        ``(labels, value)`` tuples, when the metric is rendered. Use a
+        callback for values that are computed rather than recorded.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, callback=None):
+        super(_Metric, self).__init__()
+        self.name = name
+        self.documentation = documentation
+        self._callback = callback
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def get(self, **labels):
+        """Get the value of the metric with the given labels (0 if the
+        value was never recorded).
+        """
+        if self._callback is not None:
+            for sample_labels, value in self._callback():
+                if sample_labels == labels:
+                    return value
+            return 0
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Get the metric's samples as a list of ``(labels, value)``
+        tuples.
+        """
+        if self._callback is not None:
+            return list(self._callback())
+        with self._lock:
+            return [(dict(key), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """A value that only increases, like a count of events."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increase the value of the counter with the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, like a queue length."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        """Set the value of the gauge with the given labels."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Registry(object):
+    """A collection of metrics."""
+
+    def __init__(self):
+        super(Registry, self).__init__()
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, callback):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, callback=callback)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(
+                    'Metric {0} is a {1}'.format(name, metric.kind))
+            return metric
+
+    def counter(self, name, documentation, callback=None):
+        """Get (or create) a `Counter`."""
+        return self._register(Counter, name, documentation, callback)
+
+    def gauge(self, name, documentation, callback=None):
+        """Get (or create) a `Gauge`."""
+        return self._register(Gauge, name, documentation, callback)
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format.
+
+        Returns
+        -------
+        text : str
+            The metrics.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name,
+                                                 metric.documentation))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+            for labels, value in metric.samples():
+                lines.append('{0}{1} {2}'.format(
+                    metric.name, _format_labels(labels), repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    items = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')\
+            .replace('\n', '\\n')
+        items.append('{0}="{1}"'.format(name, value))
+    return '{' + ','.join(items) + '}'
+
+
+REGISTRY = Registry()
+"""The application's metrics registry."""
+
+
+def counter(name, documentation, callback=None):
+    """Get (or create) a `Counter` in the application's registry."""
+    return REGISTRY.counter(name, documentation, callback=callback)
+
+
+def gauge(name, documentation, callback=None):
+    """Get (or create) a `Gauge` in the application's registry."""
+    return REGISTRY.gauge(name, documentation, callback=callback)
+
+
+def render():
+    """Render the application's metrics (see `Registry.render`)."""
+    return REGISTRY.render()
@@ -0,0 +1,246 @@
+"""Replication of edition directories to mirror buckets.
+
+When the ``S3_MIRROR_BUCKETS`` configuration lists mirror buckets, edition
+rebuilds hand the objects they changed to :func:`replicate`. Each mirror
+has an in-process queue of replications that a single background job (see
+`app.jobs`) drains in order, copying and deleting objects with
+`app.s3.mirror_directory`, so the mirrors receive only the change sets
+rather than full re-syncs.
+
+If a replication fails, the next replication of the same directory to
+that mirror is a full synchronization.
+
+Mirror buckets can be in other regions than the buckets they mirror. The
+region of each mirror is taken from the ``S3_BUCKET_REGIONS`` configuration,
+or discovered from S3 once per process (see `get_mirror_region`), and the
+mirror's objects are copied with a client for that region.
+
+Per-mirror progress is exported as metrics (see `app.metrics`):
+
+``ltd_keeper_mirror_lag_seconds``
+    Age of the oldest replication that hasn't completed (0 when the
+    mirror is up to date).
+``ltd_keeper_mirror_pending``
+    Number of queued replications.
+``ltd_keeper_mirror_objects_copied_total``
+    Objects copied to the mirror.
+``ltd_keeper_mirror_objects_deleted_total``
+    Objects deleted from the mirror.
+``ltd_keeper_mirror_failures_total``
+    Failed replications.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from . import jobs
+from . import metrics
+from . import s3
+
+__all__ = ['replicate', 'get_status', 'get_mirror_region']
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class _MirrorQueue(object):
+    """Replications waiting for a mirror bucket."""
+
+    def __init__(self):
+        super(_MirrorQueue, self).__init__()
+        self.replications = deque()
+        # True while a job is draining the queue
+        self.draining = False
+        # Directories whose last replication failed
+        self.failed_paths = set()
+        self.last_replicated = None
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+# Regions of mirror buckets, discovered from S3
+_regions = {}
+
+
+def get_mirror_region(mirror, config):
+    """Get the AWS region of a mirror bucket.
+
+    The region is the mirror's region in the ``S3_BUCKET_REGIONS``
+    configuration, or the region discovered from S3 (if
+    ``S3_DISCOVER_BUCKET_REGIONS``), which is cached for the life of the
+    process. Otherwise, it's the ``AWS_REGION`` configuration.
+
+    Parameters
+    ----------
+    mirror : str
+        Name of the mirror bucket.
+    config : dict
+        The application's configuration.
+
+    Returns
+    -------
+    region_name : str
+        Name of the mirror's region, or `None` for the default region.
+    """
+    if mirror in config['S3_BUCKET_REGIONS']:
+        return config['S3_BUCKET_REGIONS'][mirror]
+    if not config['S3_DISCOVER_BUCKET_REGIONS']:
+        return config['AWS_REGION']
+    with _queues_lock:
+        if mirror in _regions:
+            return _regions[mirror]
+    try:
+        region = s3.get_bucket_region(
+            mirror, config['AWS_ID'], config['AWS_SECRET'],
+            aws_endpoint_url=config['S3_ENDPOINT_URL'])
+    except Exception:
+        # Try again with the next replication
+        log.exception('Could not discover the region of mirror {0}'.format(
+            mirror))
+        return config['AWS_REGION']
+    with _queues_lock:
+        _regions[mirror] = region
+    return region
+
+
+def get_status():
+    """Get the replication status of each mirror bucket.
+
+    Returns
+    -------
+    status : dict
+        Keys are mirror bucket names. Values are dicts with ``pending``
+        (number of queued replications), ``lag`` (age, in seconds, of the
+        oldest queued replication) and ``last_replicated`` (Unix time of
+        the last completed replication, or `None`) fields.
+    """
+    now = time.time()
+    with _queues_lock:
+        return {mirror: {'pending': len(queue.replications),
+                         'lag': (now - queue.replications[0]['queued']
+                                 if len(queue.replications) > 0 else 0.),
+                         'last_replicated': queue.last_replicated}
+                for mirror, queue in _queues.items()}
+
+
+_objects_copied = metrics.counter(
+    'ltd_keeper_mirror_objects_copied_total',
+    'Objects copied to mirror buckets.')
+_objects_deleted = metrics.counter(
+    'ltd_keeper_mirror_objects_deleted_total',
+    'Objects deleted from mirror buckets.')
+_failures = metrics.counter(
+    'ltd_keeper_mirror_failures_total',
+    'Failed replications to mirror buckets.')
+metrics.gauge(
+    'ltd_keeper_mirror_pending',
+    'Replications queued for mirror buckets.',
+    callback=lambda: [({'mirror': mirror}, status['pending'])
+                      for mirror, status in get_status().items()])
+metrics.gauge(
+    'ltd_keeper_mirror_lag_seconds',
+    'Age of the oldest queued replication for mirror buckets.',
+    callback=lambda: [({'mirror': mirror}, status['lag'])
+                      for mirror, status in get_status().items()])
+
+
+def replicate(bucket_name, root_path, copied_paths=None, deleted_paths=None,
+              aws_region_name=None, aws_endpoint_url=None):
+    """Queue the replication of a directory to the mirror buckets.
+
+    This function must be called from within an application context. It
+    does nothing if ``S3_MIRROR_BUCKETS`` isn't configured.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of the S3 bucket with the directory.
+    root_path : str
+        Directory in the S3 bucket.
+    copied_paths : list of str, optional
+        Paths of the objects that changed, relative to `root_path`. If
+        `None`, the whole directory is synchronized.
+    deleted_paths : list of str, optional
+        Paths of the objects that were deleted, relative to `root_path`.
+    aws_region_name : str, optional
+        The name of the AWS region of the bucket with the directory.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint of the bucket with the directory, if not the
+        region's default endpoint.
+    """
+    for mirror in current_app.config['S3_MIRROR_BUCKETS']:
+        replication = {'bucket_name': bucket_name,
+                       'root_path': root_path,
+                       'copied_paths': copied_paths,
+                       'deleted_paths': deleted_paths,
+                       'aws_region_name': aws_region_name,
+                       'aws_endpoint_url': aws_endpoint_url,
+                       'queued': time.time()}
+        with _queues_lock:
+            queue = _queues.setdefault(mirror, _MirrorQueue())
+            queue.replications.append(replication)
+            start_job = not queue.draining
+            queue.draining = True
+        if start_job:
+            jobs.submit(_drain_queue, mirror)
+
+
+def _drain_queue(mirror):
+    """Run a mirror's queued replications, in order (run as a job)."""
+    config = current_app.config
+    queue = _queues[mirror]
+    drained = False
+    try:
+        while True:
+            with _queues_lock:
+                if len(queue.replications) == 0:
+                    queue.draining = False
+                    drained = True
+                    return
+                # The replication stays queued until it's done, for the lag
+                replication = queue.replications[0]
+                root_path = replication['root_path']
+                full_sync = (replication['copied_paths'] is None or
+                             root_path in queue.failed_paths)
+
+            failed = False
+            try:
+                changes = s3.mirror_directory(
+                    replication['bucket_name'], mirror, root_path,
+                    config['AWS_ID'], config['AWS_SECRET'],
+                    aws_region_name=get_mirror_region(mirror, config),
+                    aws_endpoint_url=config['S3_ENDPOINT_URL'],
+                    copied_paths=(None if full_sync
+                                  else replication['copied_paths']),
+                    deleted_paths=replication['deleted_paths'],
+                    max_workers=config['S3_MAX_WORKERS'],
+                    src_aws_region_name=replication['aws_region_name'],
+                    src_aws_endpoint_url=replication['aws_endpoint_url'])
+            except Exception:
+                log.exception('Replication of {0} to {1} failed'.format(
+                    root_path, mirror))
+                _failures.inc(mirror=mirror)
+                failed = True
+            else:
+                _objects_copied.inc(len(changes['copied']), mirror=mirror)
+                _objects_deleted.inc(len(changes['deleted']), mirror=mirror)
+
+            with _queues_lock:
+                queue.replications.popleft()
+                if failed:
+                    queue.failed_paths.add(root_path)
+                else:
+                    queue.failed_paths.discard(root_path)
+                    queue.last_replicated = time.time()
+    finally:
+        if not drained:
+            # Let the next replication start a new job, rather than
+            # leaving the queue stuck after an unexpected error
+            with _queues_lock:
+                queue.draining = False
@@ -4,6 +4,8 @@ Copyright 2016 AURA/LSST.
 Copyright 2014 Miguel Grinberg.
 """
 from datetime import datetime
+import hashlib
+import logging
 import uuid
 import urllib.parse
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -12,11 +14,21 @@ from flask import url_for, current_app
 
 from . import db
 from . import s3
+from . import archives
 from . import route53
 from . import fastly
+from . import mirrors
+from . import purges
+from . import probes
+from . import warming
+from .cachepolicy import get_cache_policy
 from .exceptions import ValidationError
 from .utils import split_url, format_utc_datetime, \
-    JSONEncodedVARCHAR, MutableList, validate_product_slug, validate_path_slug
+    JSONEncodedVARCHAR, MutableList, validate_product_slug, \
+    validate_path_slug, normalize_relative_path, validate_soft_purge
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
 
 
 class Permission(object):
@@ -150,6 +162,13 @@ class Product(db.Model):
     root_fastly_domain = db.Column(db.Unicode(255), nullable=False)
     # Name of the S3 bucket hosting builds
     bucket_name = db.Column(db.Unicode(255), nullable=True)
+    # AWS region of the bucket; discovered from S3 if not set
+    bucket_region = db.Column(db.String(64), nullable=True)
+    # URL of the bucket's S3 endpoint (if not the region's default endpoint)
+    bucket_endpoint_url = db.Column(db.Unicode(255), nullable=True)
+    # Soft purge (mark stale) rather than hard purge editions from Fastly
+    # after rebuilds, unless an edition overrides it
+    soft_purge = db.Column(db.Boolean, nullable=False, default=False)
     # surrogate_key for Fastly quick purges of dashboards
     # FIXME nullable initially, projects will dynamically create keys as needed
     # Editions and Builds have independent surrogate keys.
@@ -200,6 +219,9 @@ class Product(db.Model):
             'domain': self.domain,
             'fastly_domain': self.fastly_domain,
             'bucket_name': self.bucket_name,
+            'bucket_region': self.bucket_region,
+            'bucket_endpoint_url': self.bucket_endpoint_url,
+            'soft_purge': self.soft_purge,
             'published_url': self.published_url,
             'surrogate_key': self.surrogate_key
         }
@@ -215,6 +237,10 @@ class Product(db.Model):
             self.bucket_name = data['bucket_name']
         except KeyError as e:
             raise ValidationError('Invalid Product: missing ' + e.args[0])
+        self.bucket_region = data.get('bucket_region')
+        self.bucket_endpoint_url = data.get('bucket_endpoint_url')
+        self.soft_purge = validate_soft_purge(data.get('soft_purge', False),
+                                              nullable=False)
 
         # clean any full stops pre-pended on inputted fully qualified domains
         self.root_domain = self.root_domain.lstrip('.')
@@ -232,15 +258,17 @@ class Product(db.Model):
         AWS_ID = current_app.config['AWS_ID']
         AWS_SECRET = current_app.config['AWS_SECRET']
         if ROUTE_53 and AWS_ID is not None and AWS_SECRET is not None:
-            route53.create_cname(self.domain, self.fastly_domain,
-                                 AWS_ID, AWS_SECRET)
+            route53.create_cname(
+                self.domain, self.fastly_domain, AWS_ID, AWS_SECRET,
+                aws_endpoint_url=current_app.config['ROUTE53_ENDPOINT_URL'])
 
         return self
 
     def patch_data(self, data):
         """Partial update of fields from PUT requests on an existing product.
 
-        Currently only updates to doc_repo and title are supported.
+        Currently only updates to doc_repo, title, bucket_region,
+        bucket_endpoint_url and soft_purge are supported.
         """
         if 'doc_repo' in data:
             self.doc_repo = data['doc_repo']
@@ -248,6 +276,285 @@ class Product(db.Model):
         if 'title' in data:
             self.title = data['title']
 
+        if 'bucket_region' in data:
+            self.bucket_region = data['bucket_region']
+
+        if 'bucket_endpoint_url' in data:
+            self.bucket_endpoint_url = data['bucket_endpoint_url']
+
+        if 'soft_purge' in data:
+            soft_purge = validate_soft_purge(data['soft_purge'],
+                                             nullable=False)
+            if soft_purge != self.soft_purge:
+                # The editions' objects need new Surrogate-Control headers
+                # (see Edition.get_cache_policy), so their next rebuilds
+                # copy all of them
+                for edition in self.editions.filter(
+                        Edition.soft_purge == None):  # NOQA
+                    edition.fingerprint = None
+            self.soft_purge = soft_purge
+
+    def get_bucket_region(self):
+        """Get the AWS region of the product's S3 bucket.
+
+        The region is, in order of precedence, the product's
+        ``bucket_region``, the bucket's region in the ``S3_BUCKET_REGIONS``
+        configuration, or the region discovered from S3 (if
+        ``S3_DISCOVER_BUCKET_REGIONS``), which is saved as the product's
+        ``bucket_region`` so that it's only discovered once. Otherwise, it's
+        the ``AWS_REGION`` configuration.
+
+        Returns
+        -------
+        region_name : str
+            Name of the bucket's region, or `None` for the default region.
+        """
+        if self.bucket_region is not None:
+            return self.bucket_region
+
+        config = current_app.config
+        if self.bucket_name in config['S3_BUCKET_REGIONS']:
+            return config['S3_BUCKET_REGIONS'][self.bucket_name]
+
+        if config['S3_DISCOVER_BUCKET_REGIONS'] \
+                and self.bucket_name is not None \
+                and config['AWS_ID'] is not None \
+                and config['AWS_SECRET'] is not None:
+            try:
+                self.bucket_region = s3.get_bucket_region(
+                    self.bucket_name,
+                    config['AWS_ID'], config['AWS_SECRET'],
+                    aws_endpoint_url=self.get_bucket_endpoint_url())
+            except Exception:
+                log.exception('Could not discover the region of bucket '
+                              '{0}'.format(self.bucket_name))
+            else:
+                log.info('Bucket {0} is in {1}'.format(self.bucket_name,
+                                                       self.bucket_region))
+                db.session.add(self)
+                return self.bucket_region
+
+        return config['AWS_REGION']
+
+    def get_bucket_endpoint_url(self):
+        """Get the URL of the S3 endpoint of the product's bucket (the
+        product's ``bucket_endpoint_url``, or the ``S3_ENDPOINT_URL``
+        configuration).
+        """
+        if self.bucket_endpoint_url is not None:
+            return self.bucket_endpoint_url
+        return current_app.config['S3_ENDPOINT_URL']
+
+    def get_aws_args(self):
+        """Get the AWS arguments of the `app.s3` functions for the
+        product's bucket.
+
+        Returns
+        -------
+        aws_args : dict
+            The ``aws_access_key_id``, ``aws_secret_access_key``,
+            ``aws_region_name`` and ``aws_endpoint_url`` arguments, or
+            `None` if AWS credentials aren't configured.
+        """
+        AWS_ID = current_app.config['AWS_ID']
+        AWS_SECRET = current_app.config['AWS_SECRET']
+        if AWS_ID is None or AWS_SECRET is None:
+            return None
+        return {'aws_access_key_id': AWS_ID,
+                'aws_secret_access_key': AWS_SECRET,
+                'aws_region_name': self.get_bucket_region(),
+                'aws_endpoint_url': self.get_bucket_endpoint_url()}
+
+    def purge(self, delay=None):
+        """Queue a purge of the product's surrogate key, which dashboards
+        are cached with, from Fastly (see `app.purges`).
+
+        Parameters
+        ----------
+        delay : float, optional
+            Seconds to hold the purge, instead of the debounce window (see
+            `app.purges.enqueue`).
+        """
+        if self.surrogate_key is not None:
+            purges.enqueue([self.surrogate_key], soft=bool(self.soft_purge),
+                           delay=delay)
+
+    def replicate(self, root_path, copied_paths=None, deleted_paths=None):
+        """Queue the replication of a directory of the product's bucket
+        to the mirror buckets (see `app.mirrors.replicate`).
+        """
+        if len(current_app.config['S3_MIRROR_BUCKETS']) == 0:
+            return
+        mirrors.replicate(self.bucket_name, root_path,
+                          copied_paths=copied_paths,
+                          deleted_paths=deleted_paths,
+                          aws_region_name=self.get_bucket_region(),
+                          aws_endpoint_url=self.get_bucket_endpoint_url())
+
+    def teardown(self):
+        """Delete the product, along with all of its builds and editions.
+
+        This method accomplishes the following:
+
+        1. Deletes all objects in the product's directory of the S3 bucket
+           (in parallel batches), if it has a bucket, and queues their
+           deletion from the mirror buckets (see `app.mirrors`).
+        2. Deletes the product's CNAME from Route 53.
+        3. Queues the purge of the product, edition and build surrogate keys
+           from Fastly (see `app.purges`).
+        4. Deletes the edition, build and product records from the DB
+           (in bulk).
+
+        The caller is responsible for committing the DB session. Because
+        this method is slow for large products, run it as a background job
+        (see `app.tasks.teardown_product`).
+        """
+        ROUTE_53 = not current_app.config['DISABLE_ROUTE53']
+        aws_args = self.get_aws_args()
+
+        if aws_args is not None:
+            if self.bucket_name is not None:
+                s3.delete_directory(
+                    self.bucket_name,
+                    self.slug + '/',
+                    max_workers=current_app.config['S3_MAX_WORKERS'],
+                    **aws_args)
+                self.replicate(self.slug)
+
+            if ROUTE_53:
+                route53.delete_cname(
+                    self.domain,
+                    aws_args['aws_access_key_id'],
+                    aws_args['aws_secret_access_key'],
+                    aws_endpoint_url=current_app.config[
+                        'ROUTE53_ENDPOINT_URL'])
+
+        editions = self.editions.all()
+        builds = self.builds.all()
+        for edition in editions:
+            if edition.alias_of_id is not None:
+                route_alias(edition.bucket_root_dirname, None)
+        # Queued like other purges, so that a large product's keys are
+        # planned against the Fastly API budget (see app.purges)
+        surrogate_keys = [self.surrogate_key]
+        surrogate_keys.extend(e.surrogate_key for e in editions)
+        surrogate_keys.extend(b.surrogate_key for b in builds)
+        purges.enqueue([key for key in surrogate_keys if key is not None])
+
+        # Editions reference builds, so they're deleted first, after their
+        # hot paths
+        edition_ids = [e.id for e in editions]
+        if len(edition_ids) > 0:
+            HotPath.query.filter(HotPath.edition_id.in_(edition_ids))\
+                .delete(synchronize_session=False)
+        Edition.query.filter(Edition.product_id == self.id)\
+            .delete(synchronize_session=False)
+        Build.query.filter(Build.product_id == self.id)\
+            .delete(synchronize_session=False)
+
+        # The bulk deletes bypass the session, so the deleted records are
+        # removed from it before the product is deleted, or the session
+        # would try to update them
+        for obj in editions + builds:
+            if obj in db.session:
+                db.session.expunge(obj)
+        db.session.expire(self)
+        db.session.delete(self)
+
+
+def route_alias(root_path, target_path):
+    """Route requests for an alias edition's directory to its target's
+    directory in Fastly.
+
+    Routes are the items of the ``FASTLY_ALIAS_DICTIONARY_ID`` edge
+    dictionary, which the service's VCL looks up (see
+    ``docs/editions.rst``). This function does nothing if the dictionary,
+    or Fastly, isn't configured.
+
+    Parameters
+    ----------
+    root_path : str
+        Directory of the alias in the product's bucket.
+    target_path : str
+        Directory of the target in the product's bucket, or `None` to
+        remove the route.
+    """
+    config = current_app.config
+    if config['FASTLY_ALIAS_DICTIONARY_ID'] is None \
+            or config['FASTLY_SERVICE_ID'] is None \
+            or config['FASTLY_KEY'] is None:
+        return
+    fastly_service = fastly.FastlyService(
+        config['FASTLY_SERVICE_ID'], config['FASTLY_KEY'],
+        api_root=config['FASTLY_API_ROOT'])
+    root_path = root_path.rstrip('/')
+    if target_path is None:
+        fastly_service.delete_dictionary_item(
+            config['FASTLY_ALIAS_DICTIONARY_ID'], root_path)
+    else:
+        fastly_service.set_dictionary_item(
+            config['FASTLY_ALIAS_DICTIONARY_ID'], root_path,
+            target_path.rstrip('/'))
+
+
+def open_directory_archive(product, root_path, fingerprint, filename):
+    """Open a zip archive of a directory in a product's bucket for
+    download.
+
+    Archives are cached in the bucket, keyed by the content `fingerprint`:
+    if an archive with the same fingerprint was generated before, its URL
+    is returned. Otherwise the archive is streamed from S3 (see
+    `app.archives.stream_zip_archive`), and saved to the bucket as it's
+    streamed.
+
+    Parameters
+    ----------
+    product : Product
+        The product whose bucket has the directory.
+    root_path : str
+        Directory in the bucket.
+    fingerprint : str
+        Content fingerprint of the directory (see
+        `app.s3.fingerprint_directory`). If `None`, the archive isn't
+        cached.
+    filename : str
+        File name suggested to clients for the archive.
+
+    Returns
+    -------
+    archive : dict
+        Either a ``url`` field, a presigned URL of the cached archive, or a
+        ``chunks`` field, a generator of the archive's content.
+
+    Raises
+    ------
+    ValidationError
+        Raised if S3 isn't configured.
+    """
+    aws_args = product.get_aws_args()
+    if aws_args is None:
+        raise ValidationError('Archives require S3 to be configured')
+
+    archive_key = None
+    if fingerprint is not None:
+        archive_key = '/'.join((product.slug, '_archives',
+                                fingerprint + '.zip'))
+        url = archives.get_archive_url(
+            product.bucket_name, archive_key,
+            filename=filename,
+            expires_in=current_app.config['S3_PRESIGN_EXPIRES'],
+            **aws_args)
+        if url is not None:
+            return {'url': url}
+
+    chunks = archives.stream_zip_archive(
+        product.bucket_name, root_path,
+        archive_key=archive_key,
+        max_workers=current_app.config['S3_MAX_WORKERS'],
+        part_size=current_app.config['S3_MULTIPART_PART_SIZE'],
+        **aws_args)
+    return {'chunks': chunks}
+
 
 class Build(db.Model):
     """DB model for documentation builds."""
@@ -271,6 +578,9 @@ class Build(db.Model):
     uploaded = db.Column(db.Boolean, default=False)
     # The surrogate-key header for Fastly (quick purges); 32-char hex
     surrogate_key = db.Column(db.String(32), nullable=False)
+    # SHA-256 fingerprint of the uploaded objects' paths and ETags
+    # (null if not computed)
+    fingerprint = db.Column(db.String(64), nullable=True)
 
     # Relationships
     # product - from Product class
@@ -289,6 +599,23 @@ class Build(db.Model):
                  '', '', '')
         return urllib.parse.urlunparse(parts)
 
+    @classmethod
+    def from_url(cls, build_url):
+        """Get a build from its API URL.
+
+        Raises
+        ------
+        ValidationError
+            Raised if the URL doesn't refer to an existing build.
+        """
+        build_endpoint, build_args = split_url(build_url)
+        if build_endpoint != 'api.get_build' or 'id' not in build_args:
+            raise ValidationError('Invalid build_url: ' + build_url)
+        build = cls.query.get(build_args['id'])
+        if build is None:
+            raise ValidationError('Invalid build_url: ' + build_url)
+        return build
+
     def get_url(self):
         """API URL for this entity."""
         return url_for('api.get_build', id=self.id, _external=True)
@@ -360,9 +687,285 @@ class Build(db.Model):
             if data['uploaded'] is True:
                 self.register_uploaded_build()
 
+    def ingest_archive(self, fileobj=None, archive_format=None,
+                       archive_key=None):
+        """Upload the build's files from a tar or zip archive.
+
+        The archive is either streamed from `fileobj`, or read from the
+        `archive_key` object in the product's bucket (see `app.archives`).
+        Once it's ingested, register the build as uploaded with
+        `register_uploaded_build`.
+
+        Parameters
+        ----------
+        fileobj : file-like object, optional
+            Archive file.
+        archive_format : str, optional
+            Format of `fileobj` (see `app.archives.ARCHIVE_FORMATS`).
+        archive_key : str, optional
+            Key of an archive in the product's bucket, used if `fileobj`
+            isn't set.
+
+        Returns
+        -------
+        n_objects : int
+            Number of objects uploaded.
+
+        Raises
+        ------
+        ValidationError
+            Raised if the archive is invalid, or S3 isn't configured.
+        """
+        aws_args = self.product.get_aws_args()
+        if aws_args is None:
+            raise ValidationError('Archive uploads need S3 to be configured')
+
+        upload_args = dict(
+            surrogate_key=self.surrogate_key,
+            max_workers=current_app.config['S3_MAX_WORKERS'],
+            **aws_args)
+        if fileobj is not None:
+            if archive_format not in archives.ARCHIVE_FORMATS:
+                raise ValidationError('Invalid archive format: {0}'.format(
+                    archive_format))
+            n_objects, _ = archives.upload_archive(
+                fileobj, archive_format,
+                self.product.bucket_name, self.bucket_root_dirname,
+                **upload_args)
+        elif archive_key is not None:
+            n_objects, _ = archives.upload_bucket_archive(
+                archive_key,
+                self.product.bucket_name, self.bucket_root_dirname,
+                **upload_args)
+        else:
+            raise ValidationError('No archive was provided')
+        return n_objects
+
+    def validate_uploads(self, files=None):
+        """Validate the files of a presigned upload request (see
+        `presign_uploads`), without creating any uploads.
+
+        Parameters
+        ----------
+        files : list of dict, optional
+            Files to upload (see `presign_uploads`).
+
+        Returns
+        -------
+        files : list of dict
+            The files, with normalized ``path``, ``size`` and
+            ``content_type`` fields.
+
+        Raises
+        ------
+        ValidationError
+            Raised if a file is invalid, or S3 isn't configured.
+        """
+        if self.product.get_aws_args() is None:
+            raise ValidationError('Presigned uploads need S3 to be '
+                                  'configured')
+
+        if files is None:
+            files = []
+        valid_files = []
+        for f in files:
+            try:
+                size = int(f['size'])
+                path = normalize_relative_path(f['path'])
+            except (KeyError, TypeError, ValueError):
+                raise ValidationError('Invalid upload file: {0!r}'.format(f))
+            if size < 0:
+                raise ValidationError('Invalid upload file: {0!r}'.format(f))
+            valid_files.append({'path': path, 'size': size,
+                                'content_type': f.get('content_type')})
+        return valid_files
+
+    def presign_uploads(self, files=None, post=False):
+        """Create presigned URLs so that clients without AWS credentials can
+        upload the build's files directly to S3.
+
+        Parameters
+        ----------
+        files : list of dict, optional
+            Files to upload, each with a ``path`` relative to the build's
+            directory, a ``size`` in bytes and an optional ``content_type``
+            (see `app.s3.presign_uploads`).
+        post : bool, optional
+            If `True`, also create a presigned POST policy for uploading any
+            file in the build's directory (see `app.s3.presign_post`).
+
+        Returns
+        -------
+        upload : dict
+            The ``expires_in`` lifetime of the URLs (seconds), the presigned
+            ``post`` policy (or `None`), and the presigned uploads of the
+            ``files``.
+
+        Raises
+        ------
+        ValidationError
+            Raised if a file is invalid, or S3 isn't configured.
+        """
+        valid_files = self.validate_uploads(files=files)
+        aws_args = self.product.get_aws_args()
+
+        expires_in = current_app.config['S3_PRESIGN_EXPIRES']
+        presign_args = dict(
+            surrogate_key=self.surrogate_key,
+            expires_in=expires_in,
+            **aws_args)
+        upload = {'expires_in': expires_in, 'post': None, 'files': []}
+        if post:
+            upload['post'] = s3.presign_post(
+                self.product.bucket_name, self.bucket_root_dirname,
+                **presign_args)
+        if len(valid_files) > 0:
+            upload['files'] = s3.presign_uploads(
+                self.product.bucket_name, self.bucket_root_dirname,
+                valid_files,
+                multipart_threshold=current_app.config[
+                    'S3_MULTIPART_THRESHOLD'],
+                part_size=current_app.config['S3_MULTIPART_PART_SIZE'],
+                **presign_args)
+        return upload
+
+    def compute_fingerprint(self):
+        """Compute the build's content fingerprint from a listing of its
+        directory in S3 (see `app.s3.fingerprint_directory`).
+
+        The fingerprint is `None` if S3 isn't configured.
+
+        Returns
+        -------
+        fingerprint : str
+            The build's fingerprint.
+        """
+        aws_args = self.product.get_aws_args()
+        if aws_args is None:
+            self.fingerprint = None
+        else:
+            objects = s3.list_directory(self.product.bucket_name,
+                                        self.bucket_root_dirname,
+                                        **aws_args)
+            self.fingerprint = s3.fingerprint_directory(objects)
+        return self.fingerprint
+
+    def get_base_build(self):
+        """Get the latest uploaded build of the same product and Git refs,
+        which an incremental upload of this build can start from.
+
+        Returns
+        -------
+        build : Build
+            The base build, or `None` if there isn't one.
+        """
+        return Build.query.autoflush(False)\
+            .filter(Build.product == self.product)\
+            .filter(Build.git_refs == self.git_refs)\
+            .filter(Build.uploaded == True)\
+            .filter(Build.date_ended == None)\
+            .filter(Build.id != self.id)\
+            .order_by(Build.date_created.desc(), Build.id.desc())\
+            .first()  # NOQA
+
+    def apply_manifest(self, files):
+        """Copy the unchanged files of an upload manifest from the base
+        build (see `get_base_build`), and plan the upload of the rest.
+
+        A file is unchanged if the base build has an object at the same
+        path whose ETag is the file's MD5 hash. Objects uploaded in parts
+        have ETags that aren't MD5 hashes, so they're always re-uploaded.
+
+        Parameters
+        ----------
+        files : list of dict
+            Files of the build, each with a ``path`` relative to the build's
+            directory, and the hex ``md5`` hash of its content.
+
+        Returns
+        -------
+        result : dict
+            The ``base_build_url`` (or `None`), the number of
+            ``objects_copied`` from the base build, and the
+            ``upload_paths`` that still need to be uploaded.
+
+        Raises
+        ------
+        ValidationError
+            Raised if the manifest is invalid, or the build is already
+            uploaded.
+        """
+        if self.uploaded:
+            raise ValidationError('Build is already uploaded')
+        hashes = {}
+        for f in files:
+            try:
+                hashes[normalize_relative_path(f['path'])] = \
+                    f['md5'].lower()
+            except (KeyError, TypeError, AttributeError):
+                raise ValidationError('Invalid manifest file: {0!r}'.format(
+                    f))
+
+        base_build = self.get_base_build()
+        result = {'base_build_url': None,
+                  'objects_copied': 0,
+                  'upload_paths': sorted(hashes)}
+
+        aws_args = self.product.get_aws_args()
+        if base_build is None or aws_args is None:
+            return result
+        result['base_build_url'] = base_build.get_url()
+
+        base_objects = s3.list_directory(self.product.bucket_name,
+                                         base_build.bucket_root_dirname,
+                                         **aws_args)
+        unchanged_paths = [path for path, md5 in sorted(hashes.items())
+                           if path in base_objects
+                           and base_objects[path]['etag'] == md5]
+        if len(unchanged_paths) > 0:
+            result['objects_copied'] = s3.copy_objects(
+                self.product.bucket_name,
+                base_build.bucket_root_dirname,
+                self.bucket_root_dirname,
+                unchanged_paths,
+                surrogate_key=self.surrogate_key,
+                max_workers=current_app.config['S3_MAX_WORKERS'],
+                **aws_args)
+        unchanged_paths = set(unchanged_paths)
+        result['upload_paths'] = [path for path in result['upload_paths']
+                                  if path not in unchanged_paths]
+        return result
+
+    def open_archive(self, filename):
+        """Open a zip archive of the build for download (see
+        `open_directory_archive`).
+
+        Parameters
+        ----------
+        filename : str
+            File name suggested to clients for the archive.
+
+        Returns
+        -------
+        archive : dict
+            See `open_directory_archive`.
+
+        Raises
+        ------
+        ValidationError
+            Raised if S3 isn't configured, or the build isn't uploaded or
+            is deprecated.
+        """
+        if not self.uploaded or self.date_ended is not None:
+            raise ValidationError('Build {0} has no content to '
+                                  'archive'.format(self.slug))
+        return open_directory_archive(self.product, self.bucket_root_dirname,
+                                      self.fingerprint, filename)
+
     def register_uploaded_build(self):
         """Hook for when a build has been uploaded."""
         self.uploaded = True
+        self.compute_fingerprint()
 
         # Rebuild any edition that tracks this build's git refs
         editions = Edition.query.autoflush(False)\
@@ -411,9 +1014,41 @@ class Edition(db.Model):
     date_ended = db.Column(db.DateTime, nullable=True)
     # The surrogate-key header for Fastly (quick purges); 32-char hex
     surrogate_key = db.Column(db.String(32))
+    # Fingerprint of the build that was last copied into the edition's
+    # directory, combined with the cache policy's digest (null if unknown;
+    # see Edition.get_fingerprint)
+    fingerprint = db.Column(db.String(64), nullable=True)
+    # For alias editions, the edition whose content this edition serves
+    alias_of_id = db.Column(db.Integer, db.ForeignKey('editions.id'),
+                            nullable=True)
+    # Soft purge (mark stale) rather than hard purge the edition from Fastly
+    # after rebuilds; null to use the product's setting
+    soft_purge = db.Column(db.Boolean, nullable=True)
 
     # Relationships
     build = db.relationship('Build', uselist=False)  # one-to-one
+    alias_of = db.relationship('Edition', remote_side=[id],
+                               backref=db.backref('aliases', lazy='dynamic'))
+    # Most requested pages, from access logs (see app.accesslogs)
+    hot_paths = db.relationship('HotPath', backref='edition', lazy='dynamic',
+                                order_by='HotPath.rank')
+
+    @classmethod
+    def from_url(cls, edition_url):
+        """Get an edition from its API URL.
+
+        Raises
+        ------
+        ValidationError
+            Raised if the URL doesn't refer to an existing edition.
+        """
+        edition_endpoint, edition_args = split_url(edition_url)
+        if edition_endpoint != 'api.get_edition' or 'id' not in edition_args:
+            raise ValidationError('Invalid edition_url: ' + edition_url)
+        edition = cls.query.get(edition_args['id'])
+        if edition is None:
+            raise ValidationError('Invalid edition_url: ' + edition_url)
+        return edition
 
     @property
     def bucket_root_dirname(self):
@@ -435,6 +1070,38 @@ class Edition(db.Model):
                      '', '', '')
         return urllib.parse.urlunparse(parts)
 
+    def get_published_urls(self, paths):
+        """URLs where objects in the edition's directory are published.
+
+        Parameters
+        ----------
+        paths : list of str
+            Object paths, relative to the edition's directory.
+
+        Returns
+        -------
+        urls : list of str
+            Published URLs of the objects. The directory URL is included
+            for ``index.html`` objects, since Fastly caches directory pages
+            by the directory URL.
+        """
+        urls = []
+        for path in paths:
+            urls.append(self.published_url + '/' + path)
+            if path == 'index.html' or path.endswith('/index.html'):
+                dirname = path[:-len('index.html')]
+                urls.append(self.published_url + '/' + dirname)
+        return urls
+
+    @property
+    def uses_soft_purge(self):
+        """Whether the edition is soft purged from Fastly (the edition's
+        ``soft_purge`` setting, or else the product's).
+        """
+        if self.soft_purge is not None:
+            return self.soft_purge
+        return bool(self.product.soft_purge)
+
     def get_url(self):
         """API URL for this entity."""
         return url_for('api.get_edition', id=self.id, _external=True)
@@ -446,10 +1113,16 @@ class Edition(db.Model):
         else:
             build_url = None
 
+        if self.alias_of is not None:
+            alias_of_url = self.alias_of.get_url()
+        else:
+            alias_of_url = None
+
         return {
             'self_url': self.get_url(),
             'product_url': self.product.get_url(),
             'build_url': build_url,
+            'alias_of_url': alias_of_url,
             'tracked_refs': self.tracked_refs,
             'slug': self.slug,
             'title': self.title,
@@ -457,7 +1130,8 @@ class Edition(db.Model):
             'date_created': format_utc_datetime(self.date_created),
             'date_rebuilt': format_utc_datetime(self.date_rebuilt),
             'date_ended': format_utc_datetime(self.date_ended),
-            'surrogate_key': self.surrogate_key
+            'surrogate_key': self.surrogate_key,
+            'soft_purge': self.soft_purge
         }
 
     def import_data(self, data):
@@ -465,8 +1139,16 @@ class Edition(db.Model):
 
         The Product is set on object initialization.
         """
+        if 'alias_of_url' in data and 'build_url' in data:
+            raise ValidationError('Invalid Edition: an alias edition can\'t '
+                                  'have a build_url')
+
         try:
-            tracked_refs = data['tracked_refs']
+            if 'alias_of_url' in data:
+                # Aliases follow their target rather than tracking refs
+                tracked_refs = None
+            else:
+                tracked_refs = data['tracked_refs']
             self.slug = data['slug']
             self.title = data['title']
         except KeyError as e:
@@ -476,6 +1158,7 @@ class Edition(db.Model):
             raise ValidationError('Invalid Edition: tracked_refs must be an '
                                   'array of strings')
         self.tracked_refs = tracked_refs
+        self.soft_purge = validate_soft_purge(data.get('soft_purge'))
 
         # Validate the slug
         self._validate_slug(data['slug'])
@@ -486,6 +1169,8 @@ class Edition(db.Model):
         # Set initial build pointer
         if 'build_url' in data:
             self.rebuild(data['build_url'])
+        elif 'alias_of_url' in data:
+            self.set_alias(Edition.from_url(data['alias_of_url']))
 
         self.date_created = datetime.now()
 
@@ -493,6 +1178,10 @@ class Edition(db.Model):
 
     def patch_data(self, data):
         """Partial update of the Edition."""
+        if 'alias_of_url' in data and 'build_url' in data:
+            raise ValidationError('Invalid Edition: an alias edition can\'t '
+                                  'have a build_url')
+
         if 'tracked_refs' in data:
             tracked_refs = data['tracked_refs']
             if isinstance(tracked_refs, str):
@@ -503,71 +1192,500 @@ class Edition(db.Model):
         if 'title' in data:
             self.title = data['title']
 
+        if 'soft_purge' in data:
+            soft_purge = validate_soft_purge(data['soft_purge'])
+            if soft_purge != self.soft_purge:
+                # The objects need new Surrogate-Control headers (see
+                # get_cache_policy), so the next rebuild copies all of them
+                self.fingerprint = None
+            self.soft_purge = soft_purge
+
         if 'build_url' in data:
             self.rebuild(data['build_url'])
 
+        if 'alias_of_url' in data:
+            self.set_alias(Edition.from_url(data['alias_of_url']))
+
         if 'slug' in data:
             self.update_slug(data['slug'])
 
     def rebuild(self, build_url):
+        """Modify the build this edition points to, given the build's API
+        URL.
+
+        See `rebuild_from_build` for details.
+        """
+        self.rebuild_from_build(Build.from_url(build_url))
+
+    def rebuild_from_build(self, build):
         """Modify the build this edition points to.
 
         This method accomplishes the following:
 
         1. Gets surrogate key from existing build used by edition
-        2. Gets and validates new build
+        2. Validates new build
         3. Copys new build into edition's directory in S3 bucket
         4. Purge Fastly's cache for this edition.
+
+        If the new build's fingerprint matches the content the edition
+        already serves, with the same cache headers (see
+        `get_fingerprint`), steps 3 and 4 are skipped and only the build
+        pointer is updated.
+
+        If the edition's directory was already copied from its current
+        build, with the same cache headers, only the objects that differ
+        are copied or deleted (see `app.s3.sync_directory`). When the cache
+        policy changed, all the objects are copied again with the new
+        headers. When few enough objects changed (the
+        ``FASTLY_PURGE_URL_THRESHOLD`` configuration), only their URLs are
+        purged from Fastly rather than the edition's whole surrogate key.
+        Purges cascade to the edition's aliases (see `set_alias`).
+
+        The copied and deleted objects are queued for replication to the
+        mirror buckets (see `app.mirrors`).
+
+        Once the edition is purged, a job warms the Fastly cache with its
+        most important pages (see `app.warming`), and another verifies that
+        Fastly serves the new build (see `app.probes`).
+
+        The edition's aliases serve its directory (see `set_alias`), so
+        they don't need any S3 requests.
+
+        Rebuilding an alias edition turns it back into a regular edition
+        with its own copy of the build.
+        """
+        # Create a surrogate-key for the edition if it doesn't have one
+        if self.surrogate_key is None:
+            self.surrogate_key = uuid.uuid4().hex
+
+        self._validate_build(build)
+        previous_build = self.build
+        self.build = build
+        if self.alias_of is not None:
+            # The alias' marker object is replaced by a full copy
+            route_alias(self.bucket_root_dirname, None)
+            self.alias_of = None
+            self.fingerprint = None
+        for alias in self.aliases:
+            alias.build = build
+
+        fingerprint = self.get_fingerprint(build)
+        if fingerprint is not None and fingerprint == self.fingerprint:
+            log.info('Edition {0} already serves the content of build {1}; '
+                     'skipping rebuild'.format(self.slug, build.slug))
+            return
+
+        # Paths of the objects that changed, if known
+        changed_paths = None
+        aws_args = self.product.get_aws_args()
+        if aws_args is not None:
+            aws_args['max_workers'] = current_app.config['S3_MAX_WORKERS']
+            if self.fingerprint is not None and \
+                    self.fingerprint == self.get_fingerprint(previous_build):
+                # The directory has the edition's surrogate key and headers,
+                # so only the objects that differ need to be copied
+                changes = s3.sync_directory(
+                    **dict(self.get_s3_copy_args(), **aws_args))
+                changed_paths = (changes['copied'] + changes['deleted'] +
+                                 changes['redirected'])
+                self.product.replicate(
+                    self.bucket_root_dirname,
+                    copied_paths=changes['copied'] + changes['redirected'],
+                    deleted_paths=changes['deleted'])
+            else:
+                s3.copy_directory(**dict(self.get_s3_copy_args(), **aws_args))
+                self.product.replicate(self.bucket_root_dirname)
+            self.fingerprint = fingerprint
+        else:
+            self.fingerprint = None
+
+        self.purge(changed_paths=changed_paths)
+
+        # Start a job that will warm the Fastly cache with the new edition
+        warming.schedule(self)
+        probes.schedule(self)
+
+        self.date_rebuilt = datetime.now()
+
+    def purge(self, changed_paths=None):
+        """Purge the edition, and its aliases, from Fastly.
+
+        Parameters
+        ----------
+        changed_paths : list of str, optional
+            Paths of the objects that changed, relative to the edition's
+            directory. If set, and there are at most
+            ``FASTLY_PURGE_URL_THRESHOLD`` URLs to purge, only the objects'
+            URLs are purged. Otherwise the surrogate keys are purged. Both
+            are queued for a debounced purge (see `app.purges`), so that
+            editions rebuilt several times in a row are only purged once,
+            and failed purges are retried rather than failing the rebuild.
+
+        Editions that use soft purges (see `uses_soft_purge`) are marked as
+        stale in Fastly instead, so that their pages are served while Fastly
+        refreshes them from S3.
+
+        The product's surrogate key is purged along with the editions, since
+        the product's dashboards list them.
         """
         FASTLY_SERVICE_ID = current_app.config['FASTLY_SERVICE_ID']
         FASTLY_KEY = current_app.config['FASTLY_KEY']
-        AWS_ID = current_app.config['AWS_ID']
-        AWS_SECRET = current_app.config['AWS_SECRET']
-        AWS_REGION_NAME = current_app.config['AWS_REGION']
+        if FASTLY_SERVICE_ID is None or FASTLY_KEY is None:
+            return
+
+        editions = [self]
+        editions.extend(self.aliases.filter(Edition.date_ended == None))  # NOQA
+
+        if changed_paths is not None:
+            urls = {False: [], True: []}
+            for edition in editions:
+                urls[edition.uses_soft_purge].extend(
+                    edition.get_published_urls(changed_paths))
+            if len(urls[False]) + len(urls[True]) <= \
+                    current_app.config['FASTLY_PURGE_URL_THRESHOLD']:
+                for soft in (False, True):
+                    if len(urls[soft]) > 0:
+                        purges.enqueue_urls(urls[soft], soft=soft)
+                self.product.purge()
+                return
+
+        keys = {False: [], True: []}
+        for edition in editions:
+            keys[edition.uses_soft_purge].append(edition.surrogate_key)
+        if self.product.surrogate_key is not None:
+            keys[bool(self.product.soft_purge)].append(
+                self.product.surrogate_key)
+        for soft in (False, True):
+            if len(keys[soft]) > 0:
+                purges.enqueue(keys[soft], soft=soft)
+
+    def set_alias(self, target):
+        """Make this edition an alias of another edition.
+
+        An alias edition serves its target's content without a copy of it.
+        Its directory only has a marker object (see
+        `app.s3.put_alias_marker`), and Fastly routes requests for it to the
+        target's directory (see `route_alias`), so creating or moving an
+        alias takes a few requests whatever the size of the target. The
+        alias follows its target's build, and is purged from Fastly
+        whenever its target is. Renaming the target updates the alias'
+        route, and deprecating the target turns the alias into a regular
+        edition.
+
+        Parameters
+        ----------
+        target : `Edition`
+            The edition whose content is served.
+
+        Raises
+        ------
+        ValidationError
+            Raised if the target is in another product, is deprecated, is
+            this edition, or is itself an alias, or if this edition has
+            aliases.
+        """
+        if target.product != self.product or target is self:
+            raise ValidationError('Invalid alias_of_url: ' + target.get_url())
+        if target.date_ended is not None:
+            raise ValidationError('Edition was deprecated: ' + target.slug)
+        if target.alias_of is not None:
+            raise ValidationError('Edition {0} is an alias itself'.format(
+                target.slug))
+        if self.id is not None and self.aliases.count() > 0:
+            raise ValidationError('Edition {0} has aliases'.format(
+                self.slug))
 
-        # Create a surrogate-key for the edition if it doesn't have one
         if self.surrogate_key is None:
             self.surrogate_key = uuid.uuid4().hex
+        self.alias_of = target
+        self.build = target.build
+        self.tracked_refs = None
+        self.fingerprint = None
 
-        # Get new Build ID from the build resource's URL
-        build_endpoint, build_args = split_url(build_url)
-        if build_endpoint != 'api.get_build' or 'id' not in build_args:
-            raise ValidationError('Invalid build_url: ' +
-                                  'build_url')
-        self.build = Build.query.get(build_args['id'])
+        self._put_alias_marker()
+        self.purge()
+        self.date_rebuilt = datetime.now()
+
+    def _put_alias_marker(self, delete_directory=True):
+        """Replace the edition's directory with an alias marker object, and
+        route it to the target's directory.
+        """
+        aws_args = self.product.get_aws_args()
+        if aws_args is not None:
+            if delete_directory:
+                s3.delete_directory(self.product.bucket_name,
+                                    self.bucket_root_dirname,
+                                    max_workers=current_app.config[
+                                        'S3_MAX_WORKERS'],
+                                    **aws_args)
+            s3.put_alias_marker(self.product.bucket_name,
+                                self.bucket_root_dirname,
+                                self.alias_of.bucket_root_dirname,
+                                surrogate_key=self.surrogate_key,
+                                cache_control='no-cache',
+                                **aws_args)
+            self.product.replicate(self.bucket_root_dirname)
+        route_alias(self.bucket_root_dirname,
+                    self.alias_of.bucket_root_dirname)
+
+    def open_archive(self, filename):
+        """Open a zip archive of the edition's content for download (see
+        `open_directory_archive`).
+
+        The archive is made from the edition's directory (or, for an alias,
+        from the directory of the edition it's an alias of). Since it's
+        cached by content fingerprint, an edition and the build it was
+        copied from share the cached archive.
+
+        Parameters
+        ----------
+        filename : str
+            File name suggested to clients for the archive.
+
+        Returns
+        -------
+        archive : dict
+            See `open_directory_archive`.
+
+        Raises
+        ------
+        ValidationError
+            Raised if S3 isn't configured, or the edition doesn't have a
+            build.
+        """
+        source = self.alias_of if self.alias_of is not None else self
+        if source.build is None:
+            raise ValidationError('Edition {0} has no content to '
+                                  'archive'.format(self.slug))
+        # The fingerprint of the build's content, if the directory is known
+        # to hold it
+        fingerprint = None
+        if source.fingerprint is not None and \
+                source.fingerprint == source.get_fingerprint(source.build):
+            fingerprint = source.build.fingerprint
+        return open_directory_archive(self.product, source.bucket_root_dirname,
+                                      fingerprint, filename)
+
+    def get_cache_policy(self):
+        """Get the cache policy of the edition's objects.
+
+        Returns
+        -------
+        policy : `app.cachepolicy.CachePolicy`
+            The policy configured by ``CACHE_CONTROL_RULES`` (see
+            `app.cachepolicy`), with the edition's default
+            ``cache_control`` and ``surrogate_control`` headers.
+
+        For editions that are soft purged (see `uses_soft_purge`), the
+        default ``surrogate_control`` has ``stale-while-revalidate`` and
+        ``stale-if-error`` directives (the ``FASTLY_STALE_WHILE_REVALIDATE``
+        and ``FASTLY_STALE_IF_ERROR`` configurations), without which Fastly
+        can't serve stale pages after a soft purge.
+        """
+        # Force Fastly to cache the edition for 1 year
+        surrogate_control = 'max-age=31536000'
+        if self.uses_soft_purge:
+            for directive, seconds in (
+                    ('stale-while-revalidate',
+                     current_app.config['FASTLY_STALE_WHILE_REVALIDATE']),
+                    ('stale-if-error',
+                     current_app.config['FASTLY_STALE_IF_ERROR'])):
+                if seconds > 0:
+                    surrogate_control += ', {0}={1:d}'.format(directive,
+                                                              seconds)
+        # Force browsers to revalidate their local cache using ETags.
+        cache_control = 'no-cache'
+        return get_cache_policy(current_app.config,
+                                cache_control=cache_control,
+                                surrogate_control=surrogate_control)
+
+    def get_fingerprint(self, build):
+        """Compute the fingerprint of the edition's directory once it's
+        copied from a build.
+
+        The fingerprint combines the build's content fingerprint (see
+        `Build.compute_fingerprint`) with the digest of the edition's cache
+        policy (see `get_cache_policy`), since the policy sets the headers
+        of the copied objects.
+
+        Parameters
+        ----------
+        build : `Build`
+            The build copied into the edition's directory.
+
+        Returns
+        -------
+        fingerprint : str
+            Hex SHA-256 fingerprint, or `None` if the build or its
+            fingerprint is unknown.
+        """
+        if build is None or build.fingerprint is None:
+            return None
+        data = build.fingerprint + self.get_cache_policy().digest
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get_s3_copy_args(self):
+        """Arguments to `app.s3.copy_directory` that copy the edition's
+        build into the edition's directory.
+
+        Returns
+        -------
+        args : dict
+            The ``bucket_name``, ``src_path``, ``dest_path``,
+            ``surrogate_key``, ``surrogate_control``, ``cache_control``
+            and ``cache_policy`` arguments, with the cache policy and its
+            defaults from `get_cache_policy`.
+        """
+        cache_policy = self.get_cache_policy()
+        return {
+            'bucket_name': self.product.bucket_name,
+            'src_path': self.build.bucket_root_dirname,
+            'dest_path': self.bucket_root_dirname,
+            'surrogate_key': self.surrogate_key,
+            'surrogate_control': cache_policy.surrogate_control,
+            'cache_control': cache_policy.cache_control,
+            'cache_policy': cache_policy
+        }
+
+    def plan_rebuild(self, build):
+        """Plan a rebuild of this edition from `build` without modifying S3
+        or the DB.
+
+        The plan takes the same path as `rebuild_from_build`: if the
+        build's fingerprint matches the content the edition serves, the
+        rebuild makes no S3 requests. Otherwise, the plan is computed from
+        listings of the build's and edition's directories in the S3 bucket,
+        for a sync of the objects that differ if the edition's directory
+        was copied from a known build (see `app.s3.plan_sync_directory`),
+        or else a full copy (see `app.s3.plan_copy_directory`). If S3 isn't
+        configured, the listings are empty.
+
+        Parameters
+        ----------
+        build : `Build`
+            The build that the edition would be rebuilt from.
+
+        Returns
+        -------
+        plan : dict
+            The plan from `app.s3.plan_copy_directory` or
+            `app.s3.plan_sync_directory`, with additional ``edition`` and
+            ``build`` fields naming the edition and build slugs, and a
+            ``strategy`` field (``'skip'``, ``'sync'`` or ``'copy'``). The
+            ``src_objects`` and ``dest_objects`` of skipped rebuilds are
+            `None`, since the directories aren't listed.
+
+        Raises
+        ------
+        ValidationError
+            Raised if the build can't be used by the edition.
+        """
+        self._validate_build(build)
+
+        config = current_app.config
+        # Aliases are rebuilt with a full copy
+        fingerprint = self.fingerprint if self.alias_of is None else None
+        if fingerprint is not None and \
+                fingerprint == self.get_fingerprint(build):
+            plan = {'strategy': 'skip',
+                    'src_objects': None,
+                    'dest_objects': None,
+                    'requests': {'list': 0, 'head': 0, 'copy': 0,
+                                 'delete': 0, 'put': 0},
+                    'bytes_copied': 0,
+                    'bytes_deleted': 0,
+                    'max_workers': config['S3_MAX_WORKERS'],
+                    'estimated_seconds': 0.}
+        else:
+            if fingerprint is not None and \
+                    fingerprint == self.get_fingerprint(self.build):
+                strategy, plan_directory = 'sync', s3.plan_sync_directory
+            else:
+                strategy, plan_directory = 'copy', s3.plan_copy_directory
+            src_objects, dest_objects = self._list_s3_directories(build)
+            plan = plan_directory(
+                src_objects, dest_objects,
+                max_workers=config['S3_MAX_WORKERS'],
+                request_latency=config['S3_REQUEST_LATENCY'],
+                copy_bandwidth=config['S3_COPY_BANDWIDTH'])
+            plan['strategy'] = strategy
+        plan['edition'] = self.slug
+        plan['build'] = build.slug
+        return plan
+
+    def verify(self):
+        """Verify the edition's S3 directory against its build's, by key,
+        size and ETag.
+
+        If S3 isn't configured, the listings are empty and the edition is
+        trivially valid.
+
+        Returns
+        -------
+        diff : dict
+            Paths of ``missing``, ``extra`` and ``mismatched`` objects in
+            the edition, from `app.s3.diff_directories`.
+
+        Raises
+        ------
+        ValidationError
+            Raised if the edition doesn't have a build, or is an alias.
+        """
+        if self.alias_of is not None:
+            raise ValidationError('Edition {0} is an alias'.format(
+                self.slug))
         if self.build is None:
-            raise ValidationError('Invalid build_url: ' + build_url)
-        if self.build.uploaded is False:
-            raise ValidationError('Build has not been uploaded: ' + build_url)
-        if self.build.date_ended is not None:
-            raise ValidationError('Build was deprecated: ' + build_url)
-
-        if AWS_ID is not None and AWS_SECRET is not None:
-            s3.copy_directory(
-                bucket_name=self.product.bucket_name,
-                src_path=self.build.bucket_root_dirname,
-                dest_path=self.bucket_root_dirname,
-                aws_access_key_id=AWS_ID,
-                aws_secret_access_key=AWS_SECRET,
-                aws_region_name=AWS_REGION_NAME,
-                surrogate_key=self.surrogate_key,
-                # Force Fastly to cache the edition for 1 year
-                surrogate_control='max-age=31536000',
-                # Force browsers to revalidate their local cache using ETags.
-                cache_control='no-cache')
+            raise ValidationError('Edition {0} has no build'.format(
+                self.slug))
+        src_objects, dest_objects = self._list_s3_directories(self.build)
+        return s3.diff_directories(src_objects, dest_objects)
 
-        if FASTLY_SERVICE_ID is not None and FASTLY_KEY is not None:
-            fastly_service = fastly.FastlyService(
-                FASTLY_SERVICE_ID,
-                FASTLY_KEY)
-            fastly_service.purge_key(self.surrogate_key)
+    def _list_s3_directories(self, build):
+        """List the S3 directories of a build and of this edition.
 
-        # TODO start a job that will warm the Fastly cache with the new edition
+        Returns
+        -------
+        src_objects : dict
+            Listing of the build's directory (see `app.s3.list_directory`),
+            or an empty dict if S3 isn't configured.
+        dest_objects : dict
+            Listing of the edition's directory, or an empty dict if S3 isn't
+            configured.
+        """
+        aws_args = self.product.get_aws_args()
+        if aws_args is None:
+            return {}, {}
+
+        src_objects = s3.list_directory(
+            self.product.bucket_name,
+            build.bucket_root_dirname,
+            **aws_args)
+        dest_objects = s3.list_directory(
+            self.product.bucket_name,
+            self.bucket_root_dirname,
+            **aws_args)
+        return src_objects, dest_objects
+
+    def _validate_build(self, build):
+        """Ensure that a build can be published by this edition.
 
-        self.date_rebuilt = datetime.now()
+        Raises
+        ------
+        ValidationError
+        """
+        if build.uploaded is False:
+            raise ValidationError('Build has not been uploaded: ' +
+                                  build.slug)
+        if build.date_ended is not None:
+            raise ValidationError('Build was deprecated: ' + build.slug)
+        return True
 
     def update_slug(self, new_slug):
-        """Update the edition's slug by migrating files on S3."""
+        """Update the edition's slug by migrating files on S3.
+
+        The routes of the edition's aliases are updated, and the aliases
+        purged, so that they serve the new directory.
+        """
         # Check that this slug does not already exist
         self._validate_slug(new_slug)
 
@@ -576,20 +1694,32 @@ class Edition(db.Model):
         self.slug = new_slug
         new_bucket_root_dir = self.bucket_root_dirname
 
-        AWS_ID = current_app.config['AWS_ID']
-        AWS_SECRET = current_app.config['AWS_SECRET']
-        AWS_REGION_NAME = current_app.config['AWS_REGION']
-        if AWS_ID is not None and AWS_SECRET is not None \
-                and self.build is not None:
+        aws_args = self.product.get_aws_args()
+        if self.alias_of is not None:
+            # Only the marker object and the route move
+            self._put_alias_marker(delete_directory=False)
+            route_alias(old_bucket_root_dir, None)
+            if aws_args is not None:
+                s3.delete_directory(self.product.bucket_name,
+                                    old_bucket_root_dir,
+                                    **aws_args)
+                self.product.replicate(old_bucket_root_dir)
+        elif aws_args is not None and self.build is not None:
             s3.copy_directory(self.product.bucket_name,
                               old_bucket_root_dir, new_bucket_root_dir,
-                              AWS_ID, AWS_SECRET,
-                              aws_region_name=AWS_REGION_NAME,
-                              surrogate_key=self.surrogate_key)
+                              surrogate_key=self.surrogate_key,
+                              max_workers=current_app.config['S3_MAX_WORKERS'],
+                              **aws_args)
             s3.delete_directory(self.product.bucket_name,
                                 old_bucket_root_dir,
-                                AWS_ID, AWS_SECRET,
-                                aws_region_name=AWS_REGION_NAME)
+                                **aws_args)
+            self.product.replicate(new_bucket_root_dir)
+            self.product.replicate(old_bucket_root_dir)
+
+        aliases = self.aliases.filter(Edition.date_ended == None).all()  # NOQA
+        for alias in aliases:
+            alias._put_alias_marker(delete_directory=False)
+            alias.purge()
 
     def _validate_slug(self, slug):
         """Ensure that the slug is both unique to the product and meets the
@@ -615,5 +1745,46 @@ class Edition(db.Model):
         return True
 
     def deprecate(self):
-        """Deprecate the Edition; sets the `date_ended` field."""
+        """Deprecate the Edition; sets the `date_ended` field.
+
+        The edition's and product's surrogate keys are purged from Fastly,
+        so that dashboards stop listing the edition.
+
+        The edition's aliases are detached: each gets its own copy of the
+        edition's build (see `rebuild_from_build`), since they would serve
+        the deprecated edition. A deprecated alias' route is removed.
+        """
         self.date_ended = datetime.now()
+        if self.alias_of is not None:
+            route_alias(self.bucket_root_dirname, None)
+        for alias in self.aliases.filter(Edition.date_ended == None).all():  # NOQA
+            if self.build is not None:
+                alias.rebuild_from_build(self.build)
+            else:
+                route_alias(alias.bucket_root_dirname, None)
+                alias.alias_of = None
+        keys = [key for key in (self.surrogate_key, self.product.surrogate_key)
+                if key is not None]
+        if len(keys) > 0:
+            purges.enqueue(keys)
+
+
+class HotPath(db.Model):
+    """DB model for the most requested pages of editions, found in CDN
+    access logs (see `app.accesslogs`).
+    """
+
+    __tablename__ = 'hot_paths'
+    id = db.Column(db.Integer, primary_key=True)
+    # Edition that the page belongs to
+    edition_id = db.Column(db.Integer, db.ForeignKey('editions.id'),
+                           index=True, nullable=False)
+    # Path of the page, relative to the edition's URL
+    path = db.Column(db.Unicode(1024), nullable=False)
+    # Estimated number of requests of the page in the analyzed logs
+    hits = db.Column(db.Integer, nullable=False)
+    # Rank of the page in the edition, from 0 for the most requested
+    rank = db.Column(db.Integer, nullable=False)
+    # Date when the logs were analyzed
+    date_analyzed = db.Column(db.DateTime, default=datetime.now,
+                              nullable=False)
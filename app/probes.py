@@ -0,0 +1,233 @@
+"""Verifying that rebuilt editions are fresh in the Fastly cache.
+
+A successful purge request only means that Fastly accepted the purge, not
+that its caches serve the new build. When the ``PURGE_VERIFICATION``
+configuration is set, :func:`schedule` starts a background job (see
+`app.jobs`) after an edition is rebuilt. The job requests a canary page of
+the edition (the ``PURGE_VERIFICATION_CANARY`` path, relative to the
+edition) through Fastly every ``PURGE_VERIFICATION_INTERVAL`` seconds,
+until the response's ``ETag`` matches the ETag of the canary's object in the
+edition's S3 directory, or ``PURGE_VERIFICATION_TIMEOUT`` seconds have
+passed. Each request is a separate job, scheduled with
+`app.jobs.submit_later`, so that verifications don't hold job threads
+between requests.
+
+The time from the rebuild until the canary is fresh includes the debounce
+of the edition's purge (see `app.purges`), Fastly's purge propagation and
+any cached responses, so it's the end-to-end publishing latency of the
+rebuild. It's recorded per edition (see :func:`get_status`), and exported
+as metrics (see `app.metrics`):
+
+``ltd_keeper_time_to_fresh_seconds``
+    Time until the last rebuild of each edition was fresh, labelled with
+    the ``edition``.
+``ltd_keeper_purge_verifications_total``
+    Verified rebuilds, labelled with a ``fresh``, ``stale`` (timed out) or
+    ``error`` ``result``.
+"""
+
+import logging
+import threading
+import time
+
+from flask import current_app
+
+from . import httpclient
+from . import jobs
+from . import metrics
+from . import s3
+
+__all__ = ['schedule', 'get_status']
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# Verification of the last rebuild, keyed by product/edition slugs
+_status = {}
+_status_lock = threading.Lock()
+
+_verifications = metrics.counter(
+    'ltd_keeper_purge_verifications_total',
+    'Rebuilt editions verified to be fresh in the Fastly cache.')
+metrics.gauge(
+    'ltd_keeper_time_to_fresh_seconds',
+    'Time from the last rebuild of an edition until Fastly served it.',
+    callback=lambda: [({'edition': edition}, status['time_to_fresh'])
+                      for edition, status in get_status().items()
+                      if status['time_to_fresh'] is not None])
+
+
+def get_status():
+    """Get the verification status of rebuilt editions.
+
+    Returns
+    -------
+    status : dict
+        Keys are editions (``product/edition`` slugs). Values are the
+        verification of the edition's last rebuild, as dicts with ``url``
+        (the canary URL), ``etag`` (the canary's ETag in S3), ``result``
+        (``'fresh'``, ``'stale'``, ``'error'``, or `None` while
+        verifying), ``requests`` (number of canary requests),
+        ``rebuilt`` and ``finished`` (Unix times, or `None`), and
+        ``time_to_fresh`` (seconds, or `None`) fields.
+    """
+    with _status_lock:
+        return {edition: dict(status) for edition, status in _status.items()}
+
+
+def schedule(edition):
+    """Start a job that verifies that a rebuilt edition is fresh in Fastly.
+
+    This function must be called from within an application context. It
+    does nothing unless ``PURGE_VERIFICATION`` is set and Fastly is
+    configured.
+
+    Parameters
+    ----------
+    edition : `app.models.Edition`
+        The rebuilt edition.
+    """
+    config = current_app.config
+    if not config['PURGE_VERIFICATION'] \
+            or config['FASTLY_SERVICE_ID'] is None \
+            or config['FASTLY_KEY'] is None:
+        return
+    aws_args = edition.product.get_aws_args()
+    if aws_args is None:
+        return
+
+    # Resolve the edition now, so that the job doesn't need the DB
+    canary = config['PURGE_VERIFICATION_CANARY'].lstrip('/')
+    target = {'edition': '/'.join((edition.product.slug, edition.slug)),
+              'url': edition.published_url + '/' + canary,
+              'bucket_name': edition.product.bucket_name,
+              'key': '/'.join((edition.bucket_root_dirname, canary)),
+              'aws_args': aws_args,
+              'rebuilt': time.time()}
+    jobs.submit(verify_edition, target,
+                timeout=config['PURGE_VERIFICATION_TIMEOUT'],
+                interval=config['PURGE_VERIFICATION_INTERVAL'])
+
+
+def verify_edition(target, timeout=600., interval=5.):
+    """Start verifying that an edition is fresh in Fastly (run as a job).
+
+    The job reads the ETag of the edition's canary in S3, and requests the
+    canary through Fastly (see `check_canary`).
+
+    Parameters
+    ----------
+    target : dict
+        The edition, as resolved by `schedule`.
+    timeout : float, optional
+        Seconds from the rebuild after which the edition is stale.
+    interval : float, optional
+        Seconds between canary requests.
+
+    Returns
+    -------
+    status : dict
+        The edition's verification status so far (see `get_status`).
+    """
+    edition = target['edition']
+    status = {'url': target['url'], 'etag': None, 'result': None,
+              'requests': 0, 'rebuilt': target['rebuilt'], 'finished': None,
+              'time_to_fresh': None}
+    with _status_lock:
+        _status[edition] = status
+
+    try:
+        etag = s3.get_object_etag(target['bucket_name'], target['key'],
+                                  **target['aws_args'])
+    except Exception:
+        log.exception('Could not read the canary {0}'.format(target['key']))
+        etag = None
+    if etag is None:
+        return _finish(status, edition, 'error')
+    with _status_lock:
+        status['etag'] = etag
+
+    return check_canary(target, status, timeout=timeout, interval=interval)
+
+
+def check_canary(target, status, timeout=600., interval=5.):
+    """Request an edition's canary through Fastly once (run as a job).
+
+    If the canary is stale and the timeout allows it, another request is
+    scheduled `interval` seconds later (see `app.jobs.submit_later`).
+
+    Parameters
+    ----------
+    target : dict
+        The edition, as resolved by `schedule`.
+    status : dict
+        The edition's verification status, as recorded by `verify_edition`.
+        If the edition was rebuilt again since, the status was replaced and
+        this verification stops.
+    timeout : float, optional
+        Seconds from the rebuild after which the edition is stale.
+    interval : float, optional
+        Seconds between canary requests.
+
+    Returns
+    -------
+    status : dict
+        The edition's verification status so far (see `get_status`).
+    """
+    edition = target['edition']
+    with _status_lock:
+        if _status.get(edition) is not status:
+            log.info('{0} was rebuilt again; stopped verifying the previous '
+                     'rebuild'.format(edition))
+            return dict(status)
+
+    session = httpclient.get_session('probes')
+    fresh = _is_fresh(session, target['url'], status['etag'])
+    now = time.time()
+    with _status_lock:
+        status['requests'] += 1
+    if fresh:
+        with _status_lock:
+            status['time_to_fresh'] = now - target['rebuilt']
+        return _finish(status, edition, 'fresh')
+    if now + interval > target['rebuilt'] + timeout:
+        return _finish(status, edition, 'stale')
+    jobs.submit_later(interval, check_canary, target, status,
+                      timeout=timeout, interval=interval)
+    with _status_lock:
+        return dict(status)
+
+
+def _finish(status, edition, result):
+    """Record the result of a verification."""
+    _verifications.inc(result=result)
+    with _status_lock:
+        status['result'] = result
+        status['finished'] = time.time()
+        if result == 'fresh':
+            log.info('{0} was fresh after {1:.1f}s'.format(
+                edition, status['time_to_fresh']))
+        else:
+            log.warning('{0} verification ended: {1}'.format(edition,
+                                                             result))
+        return dict(status)
+
+
+def _is_fresh(session, url, etag):
+    """Check whether Fastly serves a URL with an ETag."""
+    try:
+        r = session.get(url)
+        # Read the whole response, so that the request completes
+        r.content
+    except Exception as e:
+        log.warning('Canary request {0} failed: {1}'.format(url, e))
+        return False
+    if r.status_code != 200:
+        return False
+    # Compression can turn the ETag into a weak validator
+    response_etag = r.headers.get('ETag', '')
+    if response_etag.startswith('W/'):
+        response_etag = response_etag[len('W/'):]
+    return response_etag.strip('"') == etag
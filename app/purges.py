@@ -0,0 +1,554 @@
+"""Debounced purges of surrogate keys and URLs from Fastly.
+
+Rebuilding an edition purges its surrogate key. When the same edition is
+rebuilt several times in a short period, purging it each time repeatedly
+empties the cache and uses up the Fastly API quota. Instead, purges are
+handed to :func:`enqueue`, which holds each surrogate key for a fixed
+debounce window (the ``FASTLY_PURGE_DEBOUNCE`` configuration, in seconds)
+from the time it's first queued. Keys queued again within their window are
+coalesced into the pending purge. A single background job (see
+`app.jobs`) flushes the keys whose windows have ended in bulk purges (see
+`app.fastly.FastlyService.purge_keys`). The job is scheduled for the end
+of the earliest window with `app.jobs.submit_later`, and reschedules itself
+while keys are pending, so no job thread is held while keys wait.
+
+A key is purged at most once per window, and always after the last time
+it's queued, since a key queued after its purge starts a new window. A key
+can also be queued with its own delay, for a purge that must happen later
+than the debounce window (such as after LTD Dasher uploads dashboards, see
+`app.dasher`); if it's already queued, its purge is postponed rather than
+coalesced into the earlier one. Keys
+can be queued for soft purges (see `app.fastly.FastlyService.purge_keys`);
+a key that's queued for both a soft and a hard purge within its window is
+hard purged.
+
+The URLs of the pages that changed in small incremental rebuilds are
+queued the same way with :func:`enqueue_urls`, and purged by the same job
+(see `app.fastly.FastlyService.purge_url`), so that they're debounced and
+retried like keys, and don't hold up the API request that rebuilt the
+edition.
+
+Keys and URLs that fail to purge in the background job are queued again
+after ``FASTLY_PURGE_RETRY_DELAY`` seconds, a delay that doubles with each
+failure, until they've been retried ``FASTLY_PURGE_RETRIES`` times. The
+queue is only held in memory, so keys that are pending when the process is
+killed aren't purged.
+
+When the window is 0, or ``JOBS_EAGER`` is set (as in the test harness),
+keys and URLs are purged immediately. Failed key purges are raised to the
+caller, while failed URL purges are only logged.
+
+Each purge is planned (see :func:`plan_purge`) against the API rate limit
+that Fastly reports in the headers of its responses (see
+`app.fastly.get_rate_limits`):
+
+- When at least ``FASTLY_PURGE_ALL_THRESHOLD`` keys and URLs are due, the
+  whole service is purged with a single request instead (see
+  `app.fastly.FastlyService.purge_all`).
+- When the bulk purges of the keys, and the purges of the URLs, would
+  leave fewer than ``FASTLY_PURGE_BUDGET_RESERVE`` requests in the rate
+  limit window, only the keys and URLs that fit the budget are purged
+  (keys first), and the others are held until the window resets. Purges
+  of a large set of keys are spread over windows this way, unless the set
+  reaches the purge-all threshold.
+
+Queue activity is exported as metrics (see `app.metrics`):
+
+``ltd_keeper_purge_pending``
+    Number of surrogate keys and URLs waiting to be purged.
+``ltd_keeper_purge_keys_total``
+    Surrogate keys purged.
+``ltd_keeper_purge_urls_total``
+    URLs purged.
+``ltd_keeper_purge_coalesced_total``
+    Purges of surrogate keys and URLs that were already queued.
+``ltd_keeper_purge_failures_total``
+    Surrogate keys and URLs that failed to purge.
+``ltd_keeper_purge_retries_total``
+    Failed purges of surrogate keys and URLs that were queued again.
+``ltd_keeper_purge_decisions_total``
+    Planned purges, labelled with the ``action``: ``keys``, ``purge_all``,
+    ``spread`` or ``defer``.
+``ltd_keeper_fastly_ratelimit_remaining``
+    Fastly API requests left in the rate limit window, by ``service``.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from . import fastly
+from . import jobs
+from . import metrics
+
+__all__ = ['enqueue', 'enqueue_urls', 'get_status', 'is_pending',
+           'plan_purge']
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# Surrogate keys and URLs waiting to be purged, as ('key', surrogate_key)
+# and ('url', url) items, with the end of their windows and whether the
+# purge is soft
+_pending = OrderedDict()
+_lock = threading.Lock()
+# Times for which flush jobs are scheduled
+_scheduled = set()
+# Number of failed purges of items that are being retried
+_attempts = {}
+
+
+def get_status():
+    """Get the status of the purge queue.
+
+    Returns
+    -------
+    status : dict
+        Status with ``pending`` (number of queued surrogate keys and URLs)
+        and ``next_flush`` (Unix time when the next items are purged, or
+        `None`) fields.
+    """
+    with _lock:
+        return {'pending': len(_pending),
+                'next_flush': (min(deadline
+                                   for deadline, _ in _pending.values())
+                               if len(_pending) > 0 else None)}
+
+
+def is_pending(surrogate_key):
+    """Check whether a surrogate key is waiting to be purged."""
+    with _lock:
+        return ('key', surrogate_key) in _pending
+
+
+_keys_purged = metrics.counter(
+    'ltd_keeper_purge_keys_total',
+    'Surrogate keys purged from Fastly.')
+_urls_purged = metrics.counter(
+    'ltd_keeper_purge_urls_total',
+    'URLs purged from Fastly.')
+_coalesced = metrics.counter(
+    'ltd_keeper_purge_coalesced_total',
+    'Purges of surrogate keys and URLs that were already queued.')
+_failures = metrics.counter(
+    'ltd_keeper_purge_failures_total',
+    'Surrogate keys and URLs that failed to purge from Fastly.')
+_retries = metrics.counter(
+    'ltd_keeper_purge_retries_total',
+    'Failed purges of surrogate keys and URLs that were queued again.')
+metrics.gauge(
+    'ltd_keeper_purge_pending',
+    'Surrogate keys and URLs waiting to be purged from Fastly.',
+    callback=lambda: [({}, get_status()['pending'])])
+_decisions = metrics.counter(
+    'ltd_keeper_purge_decisions_total',
+    'Purges planned against the Fastly API budget, by action.')
+metrics.gauge(
+    'ltd_keeper_fastly_ratelimit_remaining',
+    'Fastly API requests left in the current rate limit window.',
+    callback=lambda: [({'service': service_id}, rate_limit['remaining'])
+                      for service_id, rate_limit
+                      in fastly.get_rate_limits().items()])
+
+
+def plan_purge(n_keys, rate_limit, now, purge_all_threshold=0,
+               budget_reserve=0, n_urls=0):
+    """Plan the purge of surrogate keys and URLs against the Fastly API
+    budget.
+
+    Keys are purged in bulk, ``FastlyService.MAX_PURGE_KEYS`` per request,
+    while each URL takes a request of its own.
+
+    Parameters
+    ----------
+    n_keys : int
+        Number of surrogate keys to purge.
+    rate_limit : dict
+        The service's rate limit (see `app.fastly.get_rate_limits`), or
+        `None` if it's unknown.
+    now : float
+        The current Unix time.
+    purge_all_threshold : int, optional
+        Number of keys and URLs from which the whole service is purged
+        instead. If 0, the service is never purged.
+    budget_reserve : int, optional
+        Number of API requests to keep in reserve in the rate limit window.
+    n_urls : int, optional
+        Number of URLs to purge.
+
+    Returns
+    -------
+    action : str
+        One of:
+
+        ``'keys'``
+            Purge all the keys and URLs.
+        ``'purge_all'``
+            Purge the whole service.
+        ``'spread'``
+            Purge ``n_purged`` of the keys and URLs, and hold the others
+            until the rate limit window resets.
+        ``'defer'``
+            Hold all the keys and URLs until the rate limit window resets.
+    n_purged : int
+        Number of keys and URLs to purge now. Keys fit the budget first,
+        so if ``n_purged`` is greater than ``n_keys``, the remainder is the
+        number of URLs to purge.
+    delay : float
+        Seconds to hold the keys and URLs that aren't purged now.
+    """
+    n_items = n_keys + n_urls
+    if purge_all_threshold > 0 and n_items >= purge_all_threshold:
+        return 'purge_all', n_items, 0.
+    if rate_limit is None or rate_limit['reset'] <= now:
+        # A new window has started, or the budget is unknown
+        return 'keys', n_items, 0.
+
+    max_keys = fastly.FastlyService.MAX_PURGE_KEYS
+    key_requests = int(math.ceil(n_keys / max_keys))
+    available = rate_limit['remaining'] - budget_reserve
+    delay = rate_limit['reset'] - now
+    if key_requests + n_urls <= available:
+        return 'keys', n_items, 0.
+    elif available > key_requests:
+        return 'spread', n_keys + available - key_requests, delay
+    elif available > 0:
+        return 'spread', min(available * max_keys, n_keys), delay
+    else:
+        return 'defer', 0, delay
+
+
+def _get_fastly_service(config):
+    """Get a FastlyService, or `None` if Fastly isn't configured."""
+    if config['FASTLY_SERVICE_ID'] is None or config['FASTLY_KEY'] is None:
+        return None
+    return fastly.FastlyService(config['FASTLY_SERVICE_ID'],
+                                config['FASTLY_KEY'],
+                                api_root=config['FASTLY_API_ROOT'])
+
+
+def enqueue(surrogate_keys, soft=False, delay=None):
+    """Queue surrogate keys to be purged from Fastly.
+
+    This function must be called from within an application context. It
+    does nothing if Fastly isn't configured.
+
+    Parameters
+    ----------
+    surrogate_keys : list of str
+        The surrogate keys to purge.
+    soft : bool, optional
+        If `True`, soft purge the keys (mark their content as stale).
+    delay : float, optional
+        Seconds to hold the keys, instead of the ``FASTLY_PURGE_DEBOUNCE``
+        window. Keys that are already queued are held until at least then.
+
+    Raises
+    ------
+    app.exceptions.FastlyError
+        Raised if keys are purged immediately (see the module
+        documentation), and a purge fails.
+    """
+    config = current_app.config
+    fastly_service = _get_fastly_service(config)
+    if fastly_service is None:
+        return
+
+    if _is_immediate(config, delay):
+        # Immediate purges can't be held, so only the purge-all threshold
+        # applies
+        action, _, _ = _plan(len(surrogate_keys), None, config)
+        if action == 'purge_all':
+            results = _purge_all(fastly_service, surrogate_keys)
+        else:
+            results = fastly_service.purge_keys(surrogate_keys, soft=soft)
+        _record_results(results)
+        fastly.raise_for_failed_purges(results)
+        return
+
+    _enqueue([('key', key) for key in surrogate_keys], soft, delay, config)
+
+
+def enqueue_urls(urls, soft=False):
+    """Queue URLs to be purged from Fastly.
+
+    URLs are held for the ``FASTLY_PURGE_DEBOUNCE`` window, like surrogate
+    keys (see `enqueue`). Failed purges are retried, and never raised.
+
+    This function must be called from within an application context. It
+    does nothing if Fastly isn't configured.
+
+    Parameters
+    ----------
+    urls : list of str
+        The URLs to purge.
+    soft : bool, optional
+        If `True`, soft purge the URLs (mark their content as stale).
+    """
+    config = current_app.config
+    fastly_service = _get_fastly_service(config)
+    if fastly_service is None:
+        return
+
+    if _is_immediate(config, None):
+        _purge_urls(fastly_service, urls, soft=soft)
+        return
+
+    _enqueue([('url', url) for url in urls], soft, None, config)
+
+
+def _is_immediate(config, delay):
+    """Check whether purges are made immediately rather than queued."""
+    window = config['FASTLY_PURGE_DEBOUNCE'] if delay is None else delay
+    return window <= 0 or config['JOBS_EAGER']
+
+
+def _enqueue(items, soft, delay, config):
+    """Queue ``('key', surrogate_key)`` and ``('url', url)`` items, and
+    schedule a flush job.
+    """
+    window = config['FASTLY_PURGE_DEBOUNCE'] if delay is None else delay
+    deadline = time.time() + window
+    with _lock:
+        for item in items:
+            if item in _pending:
+                _coalesced.inc()
+                item_deadline, item_soft = _pending[item]
+                if delay is not None:
+                    item_deadline = max(item_deadline, deadline)
+                _pending[item] = (item_deadline, item_soft and soft)
+            else:
+                _pending[item] = (deadline, soft)
+    _schedule_flush()
+
+
+def _schedule_flush(finished=None):
+    """Schedule a flush job for the end of the earliest window, unless one
+    is already scheduled by then.
+
+    Parameters
+    ----------
+    finished : float, optional
+        Time of the flush job that is finishing, if any.
+    """
+    with _lock:
+        _scheduled.discard(finished)
+        if len(_pending) == 0:
+            return
+        next_flush = min(deadline for deadline, _ in _pending.values())
+        if len(_scheduled) > 0 and min(_scheduled) <= next_flush:
+            return
+        _scheduled.add(next_flush)
+    jobs.submit_later(max(0., next_flush - time.time()), _flush_queue,
+                      next_flush)
+
+
+def _flush_queue(scheduled):
+    """Purge the queued keys whose windows have ended, and schedule the
+    next flush (run as a job).
+
+    Parameters
+    ----------
+    scheduled : float
+        Time that the job was scheduled for.
+    """
+    finished = False
+    try:
+        _flush_due(current_app.config)
+        _schedule_flush(finished=scheduled)
+        finished = True
+    finally:
+        if not finished:
+            # Let the next enqueue schedule a flush, rather than leaving
+            # the queue stuck after an unexpected error
+            with _lock:
+                _scheduled.discard(scheduled)
+
+
+def _flush_due(config):
+    """Purge the queued keys and URLs whose windows have ended."""
+    fastly_service = _get_fastly_service(config)
+
+    # Items queued from now on start a new window
+    now = time.time()
+    due = []
+    with _lock:
+        for item, (deadline, soft) in list(_pending.items()):
+            if deadline <= now:
+                due.append((item, soft))
+                del _pending[item]
+    if len(due) == 0 or fastly_service is None:
+        return
+
+    # Keys go first, since they purge more per request, and hard purges
+    # are more urgent, so they fit the budget first
+    due.sort(key=lambda due_item: (due_item[0][0] == 'url', due_item[1]))
+    n_keys = len([item for item, _ in due if item[0] == 'key'])
+    action, n_purged, delay = _plan(n_keys, fastly_service.rate_limit,
+                                    config, n_urls=len(due) - n_keys)
+    if action == 'purge_all':
+        try:
+            fastly_service.purge_all()
+        except Exception:
+            log.exception('Purge of the whole service failed')
+            _failures.inc(len(due))
+            _retry(due, config)
+            return
+        _keys_purged.inc(n_keys)
+        _urls_purged.inc(len(due) - n_keys)
+        with _lock:
+            for item, _ in due:
+                _attempts.pop(item, None)
+        return
+
+    _hold(due[n_purged:], now + delay)
+    for soft in (False, True):
+        keys = [item[1] for item, item_soft in due[:n_purged]
+                if item[0] == 'key' and item_soft == soft]
+        if len(keys) > 0:
+            failed = _purge(fastly_service.purge_keys, keys, soft=soft)
+            _retry([(('key', key), soft) for key in failed], config)
+    for soft in (False, True):
+        urls = [item[1] for item, item_soft in due[:n_purged]
+                if item[0] == 'url' and item_soft == soft]
+        if len(urls) > 0:
+            failed = _purge_urls(fastly_service, urls, soft=soft)
+            _retry([(('url', url), soft) for url in failed], config)
+
+
+def _plan(n_keys, rate_limit, config, n_urls=0):
+    """Plan a purge with `plan_purge`, and log and count the decision."""
+    action, n_purged, delay = plan_purge(
+        n_keys, rate_limit, time.time(),
+        purge_all_threshold=config['FASTLY_PURGE_ALL_THRESHOLD'],
+        budget_reserve=config['FASTLY_PURGE_BUDGET_RESERVE'],
+        n_urls=n_urls)
+    _decisions.inc(action=action)
+    remaining = rate_limit['remaining'] if rate_limit is not None else None
+    message = ('Purge plan for {0:d} keys and {1:d} URLs ({2} API requests '
+               'left): {3}, {4:d} now'.format(n_keys, n_urls, remaining,
+                                              action, n_purged))
+    if action == 'keys':
+        log.info(message)
+    else:
+        log.warning(message + ', {0:d} held {1:.0f}s'.format(
+            n_keys + n_urls - n_purged, delay))
+    return action, n_purged, delay
+
+
+def _hold(items, deadline):
+    """Queue ``(item, soft)`` items again until a deadline, merging them
+    with items that were queued since.
+    """
+    with _lock:
+        for item, soft in items:
+            if item in _pending:
+                item_deadline, item_soft = _pending[item]
+                _pending[item] = (min(deadline, item_deadline),
+                                  item_soft and soft)
+            else:
+                _pending[item] = (deadline, soft)
+
+
+def _purge(purge_func, *args, **kwargs):
+    """Make a purge in the flush job, counting its results.
+
+    Returns
+    -------
+    failed : list of str
+        The keys that failed to purge.
+    """
+    keys = args[-1]
+    try:
+        results = purge_func(*args, **kwargs)
+    except Exception:
+        log.exception('Purge of {0:d} keys failed'.format(len(keys)))
+        _failures.inc(len(keys))
+        return list(keys)
+    return _record_results(results)
+
+
+def _purge_urls(fastly_service, urls, soft=False):
+    """Purge URLs one by one, counting and logging failures.
+
+    Returns
+    -------
+    failed : list of str
+        The URLs that failed to purge.
+    """
+    failed = []
+    for url in urls:
+        try:
+            fastly_service.purge_url(url, soft=soft)
+        except Exception as e:
+            log.warning('Failed to purge URL {0}: {1}'.format(url, e))
+            failed.append(url)
+            continue
+        with _lock:
+            _attempts.pop(('url', url), None)
+    _urls_purged.inc(len(urls) - len(failed))
+    _failures.inc(len(failed))
+    return failed
+
+
+def _retry(items, config):
+    """Queue ``(item, soft)`` items that failed to purge again, with
+    exponential backoff, unless they've been retried
+    ``FASTLY_PURGE_RETRIES`` times.
+    """
+    now = time.time()
+    for item, soft in items:
+        with _lock:
+            attempts = _attempts.pop(item, 0) + 1
+            if attempts <= config['FASTLY_PURGE_RETRIES']:
+                _attempts[item] = attempts
+        if attempts > config['FASTLY_PURGE_RETRIES']:
+            log.error('Gave up purging {0} {1} after {2:d} attempts'.format(
+                'surrogate key' if item[0] == 'key' else 'URL', item[1],
+                attempts))
+            continue
+        _retries.inc()
+        _hold([(item, soft)], now + config['FASTLY_PURGE_RETRY_DELAY'] *
+              2 ** (attempts - 1))
+
+
+def _purge_all(fastly_service, surrogate_keys):
+    """Purge the whole service in place of surrogate keys.
+
+    Returns
+    -------
+    results : `collections.OrderedDict`
+        Results for each key, as from
+        `app.fastly.FastlyService.purge_keys`.
+    """
+    fastly_service.purge_all()
+    return OrderedDict((key, {'purged': True, 'purge_id': None,
+                              'error': None})
+                       for key in surrogate_keys)
+
+
+def _record_results(results):
+    """Count the purged and failed keys of a bulk purge.
+
+    Returns
+    -------
+    failed : list of str
+        The keys that failed to purge.
+    """
+    failed = [key for key, result in results.items() if not result['purged']]
+    _keys_purged.inc(len(results) - len(failed))
+    with _lock:
+        for key, result in results.items():
+            if result['purged']:
+                _attempts.pop(('key', key), None)
+    if len(failed) > 0:
+        log.warning('Failed to purge surrogate keys {0}'.format(
+            ', '.join(failed)))
+        _failures.inc(len(failed))
+    return failed
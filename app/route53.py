@@ -19,7 +19,8 @@ log.addHandler(logging.NullHandler())
 
 
 def create_cname(cname_domain, origin_domain,
-                 aws_access_key_id, aws_secret_access_key):
+                 aws_access_key_id, aws_secret_access_key,
+                 aws_endpoint_url=None):
     """Create a CNAME `cname_domain` that points to resources at
     `origin_domain`.
 
@@ -47,6 +48,9 @@ def create_cname(cname_domain, origin_domain,
         The access key for your AWS account. Also set `aws_secret_access_key`.
     aws_secret_access_key : str
         The secret key for your AWS account.
+    aws_endpoint_url : str, optional
+        URL of the Route 53 endpoint, if not AWS's (e.g. of a stand-in
+        server, see `app.standins`).
 
     Raises
     ------
@@ -60,19 +64,19 @@ def create_cname(cname_domain, origin_domain,
     if origin_domain.endswith('.'):
         origin_domain = origin_domain.lstrip('.')
 
-    session = boto3.session.Session(
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key)
-    client = session.client('route53')
+    client = _get_client(aws_access_key_id, aws_secret_access_key,
+                         aws_endpoint_url)
     zone_id = _get_zone_id(client, cname_domain)
     _upsert_cname_record(client, zone_id, cname_domain, origin_domain)
 
 
-def delete_cname(cname_domain, aws_access_key_id, aws_secret_access_key):
+def delete_cname(cname_domain, aws_access_key_id, aws_secret_access_key,
+                 aws_endpoint_url=None):
     """Delete a CNAME for `cname_domain`
 
     **Note:** This function deletes the first matching CNAME records and
     doesn't yet work with multiple geographically distributed CNAME records.
+    This function is a no-op if no CNAME record exists for `cname_domain`.
 
     Parameters
     ----------
@@ -87,6 +91,9 @@ def delete_cname(cname_domain, aws_access_key_id, aws_secret_access_key):
         The access key for your AWS account. Also set `aws_secret_access_key`.
     aws_secret_access_key : str
         The secret key for your AWS account.
+    aws_endpoint_url : str, optional
+        URL of the Route 53 endpoint, if not AWS's (e.g. of a stand-in
+        server, see `app.standins`).
 
     Raises
     ------
@@ -98,13 +105,14 @@ def delete_cname(cname_domain, aws_access_key_id, aws_secret_access_key):
     if not cname_domain.endswith('.'):
         cname_domain = cname_domain + '.'
 
-    session = boto3.session.Session(
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key)
-    client = session.client('route53')
+    client = _get_client(aws_access_key_id, aws_secret_access_key,
+                         aws_endpoint_url)
 
     zone_id = _get_zone_id(client, cname_domain)
     record = _find_cname_record(client, zone_id, cname_domain)
+    if record is None:
+        # Nothing to delete
+        return
 
     # Build the change set for change_resource_record_sets. This method
     # needs to know the TTL for the specific record to update; although
@@ -138,6 +146,17 @@ def delete_cname(cname_domain, aws_access_key_id, aws_secret_access_key):
         raise Route53Error(msg)
 
 
+def _get_client(aws_access_key_id, aws_secret_access_key, aws_endpoint_url):
+    """Create a Boto3 Route 53 client."""
+    session = boto3.session.Session(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key)
+    # Route 53 is a global service, whose requests are signed for us-east-1;
+    # boto3 only infers this for AWS's own endpoint
+    return session.client('route53', region_name='us-east-1',
+                          endpoint_url=aws_endpoint_url)
+
+
 def _get_zone_id(client, domain):
     """Get the ID of the Hosted Zone that services this `domain`.
 
@@ -5,9 +5,17 @@ resources to S3. ltd-keeper deletes resources and copies builds to editions.
 """
 
 import os
+import math
+import posixpath
+import hashlib
+import mimetypes
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pprint import pformat
 import boto3
+from botocore.client import Config as BotoConfig
+from botocore.exceptions import ClientError
 
 from .exceptions import S3Error
 
@@ -15,13 +23,112 @@ from .exceptions import S3Error
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+# Maximum number of keys returned by a list request, and accepted by a
+# DeleteObjects request.
+MAX_KEYS = 1000
+
+# Maximum number of parts in an S3 multipart upload
+MAX_PARTS = 10000
+
+# Size of the connection pool of each S3 client; at least the number of
+# threads that share a client
+MAX_POOL_CONNECTIONS = 50
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(aws_access_key_id, aws_secret_access_key,
+               aws_region_name=None, aws_endpoint_url=None):
+    """Get an S3 client for a region (and endpoint).
+
+    Clients are created once per set of credentials, region and endpoint,
+    and shared (boto3 clients are thread-safe), so that each region has its
+    own pool of connections that's reused across calls.
+
+    Parameters
+    ----------
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+
+    Returns
+    -------
+    client : ``botocore.client.S3``
+        The S3 client.
+    """
+    key = (aws_access_key_id, aws_secret_access_key, aws_region_name,
+           aws_endpoint_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            session = boto3.session.Session(
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                region_name=aws_region_name)
+            client = session.client(
+                's3',
+                endpoint_url=aws_endpoint_url,
+                config=BotoConfig(max_pool_connections=MAX_POOL_CONNECTIONS))
+            _clients[key] = client
+        return client
+
+
+def get_bucket_region(bucket_name, aws_access_key_id, aws_secret_access_key,
+                      aws_endpoint_url=None):
+    """Discover the region of an S3 bucket.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not AWS's.
+
+    Returns
+    -------
+    region_name : str
+        Name of the bucket's region, e.g. ``'us-east-1'``.
+
+    Raises
+    ------
+    botocore.exceptions.ClientError
+        Raised if the bucket's location can't be read.
+    """
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name='us-east-1',
+                        aws_endpoint_url=aws_endpoint_url)
+    location = client.get_bucket_location(Bucket=bucket_name)
+    # Buckets in us-east-1 have no location constraint, and the oldest
+    # eu-west-1 buckets have the legacy 'EU' constraint
+    constraint = location.get('LocationConstraint')
+    if constraint is None or constraint == '':
+        return 'us-east-1'
+    elif constraint == 'EU':
+        return 'eu-west-1'
+    return constraint
+
 
 def delete_directory(bucket_name, root_path,
                      aws_access_key_id, aws_secret_access_key,
-                     aws_region_name=None):
+                     aws_region_name=None, aws_endpoint_url=None,
+                     max_workers=8):
     """Delete all objects in the S3 bucket named `bucket_name` that are
     found in the `root_path` directory.
 
+    Objects are deleted in batches of up to 1000 keys (the limit of S3's
+    ``DeleteObjects`` API). Batches are deleted in parallel as the listing
+    of the directory is paged in.
+
     Parameters
     ----------
     bucket_name : str
@@ -34,51 +141,94 @@ def delete_directory(bucket_name, root_path,
         The secret key for your AWS account.
     aws_region_name : str, optional
         The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    max_workers : int, optional
+        Maximum number of ``DeleteObjects`` requests to run concurrently.
+
+    Returns
+    -------
+    n_deleted : int
+        Number of objects deleted.
 
     Raises
     ------
     app.exceptions.S3Error
         Thrown by any unexpected faults from the S3 API.
     """
-    session = boto3.session.Session(
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name=aws_region_name)
-    s3 = session.resource('s3')
-    bucket = s3.Bucket(bucket_name)
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
 
     # Normalize directory path for searching patch prefixes of objects
     if not root_path.endswith('/'):
         root_path.rstrip('/')
 
-    key_objects = [{'Key': obj.key}
-                   for obj in bucket.objects.filter(Prefix=root_path)]
-    if len(key_objects) == 0:
+    paginator = client.get_paginator('list_objects')
+    n_deleted = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=root_path):
+            key_objects = [{'Key': obj['Key']}
+                           for obj in page.get('Contents', [])]
+            if len(key_objects) > 0:
+                futures.append(executor.submit(_delete_objects, client,
+                                               bucket_name, key_objects))
+        for future in as_completed(futures):
+            n_deleted += future.result()
+
+    if n_deleted == 0:
         log.info('No objects deleted from bucket {0}:{1}'.format(
             bucket_name, root_path))
-        return
-    delete_keys = {'Objects': []}
-    delete_keys['Objects'] = key_objects
-    log.info('Deleting {0:d} objects from bucket {1}:{2}'.format(
-        len(key_objects), bucket_name, root_path))
+    else:
+        log.info('Deleted {0:d} objects from bucket {1}:{2}'.format(
+            n_deleted, bucket_name, root_path))
+    return n_deleted
+
+
+def _delete_objects(client, bucket_name, key_objects):
+    """Delete a batch of (at most 1000) objects.
+
+    Parameters
+    ----------
+    client :
+        Boto3 S3 client.
+    bucket_name : str
+        Name of an S3 bucket.
+    key_objects : list of dict
+        Objects to delete, formatted for ``DeleteObjects``
+        (``[{'Key': key}, ...]``).
+
+    Returns
+    -------
+    n_deleted : int
+        Number of objects deleted.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown if S3 fails to delete any of the objects.
+    """
     # based on http://stackoverflow.com/a/34888103
-    r = s3.meta.client.delete_objects(Bucket=bucket.name,
-                                      Delete=delete_keys)
-    log.info(pformat(r))
+    r = client.delete_objects(Bucket=bucket_name,
+                              Delete={'Objects': key_objects,
+                                      'Quiet': True})
     status_code = r['ResponseMetadata']['HTTPStatusCode']
-    if status_code >= 300:
-        msg = 'S3 could not delete {0} (status {1:d})'.format(
-            root_path, status_code)
-        log.error(msg)
+    if status_code >= 300 or len(r.get('Errors', [])) > 0:
+        log.error(pformat(r))
+        msg = 'S3 could not delete {0:d} objects in {1} (status {2:d})'.format(
+            len(r.get('Errors', [])), bucket_name, status_code)
         raise S3Error(msg)
+    return len(key_objects)
 
 
 def copy_directory(bucket_name, src_path, dest_path,
                    aws_access_key_id, aws_secret_access_key,
-                   aws_region_name=None,
+                   aws_region_name=None, aws_endpoint_url=None,
                    surrogate_key=None, cache_control=None,
                    surrogate_control=None,
-                   create_directory_redirect_object=True):
+                   create_directory_redirect_object=True,
+                   max_workers=8, cache_policy=None):
     """Copy objects from one directory in a bucket to another directory in
     the same bucket.
 
@@ -88,6 +238,9 @@ def copy_directory(bucket_name, src_path, dest_path,
     - If cache_control and surrogate_control values are provided they
       will replace the old one.
 
+    Objects are copied in parallel, as the listing of the source directory
+    is paged in.
+
     Parameters
     ----------
     bucket_name : str
@@ -105,6 +258,8 @@ def copy_directory(bucket_name, src_path, dest_path,
         The secret key for your AWS account.
     aws_region_name : str, optional
         The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
     surrogate_key : str, optional
         The surrogate key to insert in the header of all objects in the
         ``x-amz-meta-surrogate-key`` field. This key is used to purge
@@ -123,12 +278,28 @@ def copy_directory(bucket_name, src_path, dest_path,
         Fastly to givern it's caching. This caching policy is *not* passed
         to the browser.
     create_directory_redirect_object : bool, optional
-        Create a directory redirect object for the root directory. The
-        directory redirect object is an empty S3 object named after the
-        directory (without a trailing slash) that contains a
-        ``x-amz-meta-dir-redirect=true`` HTTP header. LSST the Docs' Fastly
-        VCL is configured to redirect requests for a directory path to the
-        directory's ``index.html`` (known as *courtesy redirects*).
+        Create directory redirect objects for the root directory, and for
+        every subdirectory with an ``index.html`` (see
+        `directory_redirect_paths`). A directory redirect object is an
+        empty S3 object named after the directory (without a trailing
+        slash) that contains a ``x-amz-meta-dir-redirect=true`` HTTP
+        header. LSST the Docs' Fastly VCL is configured to redirect
+        requests for a directory path to the directory's ``index.html``
+        (known as *courtesy redirects*).
+    max_workers : int, optional
+        Maximum number of objects to copy (or object batches to delete)
+        concurrently.
+    cache_policy : `app.cachepolicy.CachePolicy`, optional
+        Policy that picks the ``Cache-Control`` and ``Surrogate-Control``
+        headers of each object from its path and content type. If set, it
+        is used instead of `cache_control` and `surrogate_control` (except
+        for the directory redirect object).
+
+    Returns
+    -------
+    n_copied : int
+        Number of objects copied (not including the directory redirect
+        object).
 
     Raises
     ------
@@ -148,51 +319,1190 @@ def copy_directory(bucket_name, src_path, dest_path,
     # Delete any existing objects in the destination
     delete_directory(bucket_name, dest_path,
                      aws_access_key_id, aws_secret_access_key,
-                     aws_region_name=aws_region_name)
+                     aws_region_name=aws_region_name,
+                     aws_endpoint_url=aws_endpoint_url,
+                     max_workers=max_workers)
 
-    session = boto3.session.Session(
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name=aws_region_name)
-    s3 = session.resource('s3')
-    bucket = s3.Bucket(bucket_name)
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
 
     # Copy each object from source to destination
-    for src_obj in bucket.objects.filter(Prefix=src_path):
-        src_rel_path = os.path.relpath(src_obj.key, start=src_path)
-        dest_key_path = os.path.join(dest_path, src_rel_path)
-
-        # the src_obj (ObjectSummary) doesn't include headers afaik
-        head = s3.meta.client.head_object(Bucket=bucket_name,
-                                          Key=src_obj.key)
-        metadata = head['Metadata']
-        content_type = head['ContentType']
-
-        # try to use original Cache-Control header if new one is not set
-        if cache_control is None and 'CacheControl' in head:
-            cache_control = head['CacheControl']
-
-        if surrogate_control is not None:
-            metadata['surrogate-control'] = surrogate_control
-
-        if surrogate_key is not None:
-            metadata['surrogate-key'] = surrogate_key
-
-        s3.meta.client.copy_object(
-            Bucket=bucket_name,
-            Key=dest_key_path,
-            CopySource={'Bucket': bucket_name, 'Key': src_obj.key},
-            MetadataDirective='REPLACE',
-            Metadata=metadata,
-            ACL='public-read',
-            CacheControl=cache_control,
-            ContentType=content_type)
+    paginator = client.get_paginator('list_objects')
+    src_rel_paths = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=src_path):
+            for src_obj in page.get('Contents', []):
+                src_rel_path = os.path.relpath(src_obj['Key'],
+                                               start=src_path)
+                src_rel_paths.add(src_rel_path)
+                dest_key_path = os.path.join(dest_path, src_rel_path)
+                futures.append(executor.submit(
+                    _copy_object, client, bucket_name,
+                    src_obj['Key'], dest_key_path,
+                    surrogate_key=surrogate_key,
+                    cache_control=cache_control,
+                    surrogate_control=surrogate_control,
+                    cache_policy=cache_policy, path=src_rel_path))
+        for future in as_completed(futures):
+            future.result()
 
     if create_directory_redirect_object:
-        dest_dirname = dest_path.rstrip('/')
-        obj = bucket.Object(dest_dirname)
-        metadata = {'dir-redirect': 'true'}
-        obj.put(Body='',
-                ACL='public-read',
-                Metadata=metadata,
-                CacheControl=cache_control)
+        # The build may already have redirect objects for subdirectories
+        redirect_keys = [dest_path.rstrip('/')]
+        redirect_keys.extend(
+            dest_path + path
+            for path in directory_redirect_paths(src_rel_paths)
+            if path not in src_rel_paths)
+        _put_directory_redirect_objects(client, bucket_name, redirect_keys,
+                                        surrogate_key=surrogate_key,
+                                        cache_control=cache_control,
+                                        surrogate_control=surrogate_control,
+                                        max_workers=max_workers)
+
+    return len(futures)
+
+
+def copy_objects(bucket_name, src_path, dest_path, paths,
+                 aws_access_key_id, aws_secret_access_key,
+                 aws_region_name=None, aws_endpoint_url=None,
+                 surrogate_key=None, cache_control=None,
+                 surrogate_control=None, max_workers=8, cache_policy=None):
+    """Copy specific objects from one directory in a bucket to another
+    directory in the same bucket.
+
+    Unlike `copy_directory`, existing objects in the destination directory
+    are not deleted first. Use this function to repair individual objects.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    src_path : str
+        Source directory in the S3 bucket.
+    dest_path : str
+        Destination directory in the S3 bucket.
+    paths : list of str
+        Paths of the objects to copy, relative to `src_path` (and
+        `dest_path`).
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    surrogate_key : str, optional
+        See `copy_directory`.
+    cache_control : str, optional
+        See `copy_directory`.
+    surrogate_control : str, optional
+        See `copy_directory`.
+    max_workers : int, optional
+        Maximum number of objects to copy concurrently.
+    cache_policy : `app.cachepolicy.CachePolicy`, optional
+        See `copy_directory`.
+
+    Returns
+    -------
+    n_copied : int
+        Number of objects copied.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    if not src_path.endswith('/'):
+        src_path += '/'
+    if not dest_path.endswith('/'):
+        dest_path += '/'
+
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_copy_object, client, bucket_name,
+                                   src_path + path, dest_path + path,
+                                   surrogate_key=surrogate_key,
+                                   cache_control=cache_control,
+                                   surrogate_control=surrogate_control,
+                                   cache_policy=cache_policy, path=path)
+                   for path in paths]
+        for future in as_completed(futures):
+            future.result()
+
+    log.info('Copied {0:d} objects from {1}:{2} to {3}'.format(
+        len(paths), bucket_name, src_path, dest_path))
+    return len(paths)
+
+
+def delete_objects(bucket_name, root_path, paths,
+                   aws_access_key_id, aws_secret_access_key,
+                   aws_region_name=None, aws_endpoint_url=None, max_workers=8):
+    """Delete specific objects from a directory in an S3 bucket.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    root_path : str
+        Directory in the S3 bucket.
+    paths : list of str
+        Paths of the objects to delete, relative to `root_path`.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    max_workers : int, optional
+        Maximum number of ``DeleteObjects`` requests to run concurrently.
+
+    Returns
+    -------
+    n_deleted : int
+        Number of objects deleted.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    if not root_path.endswith('/'):
+        root_path += '/'
+
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
+
+    key_objects = [{'Key': root_path + path} for path in paths]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_delete_objects, client, bucket_name,
+                                   key_objects[i:i + MAX_KEYS])
+                   for i in range(0, len(key_objects), MAX_KEYS)]
+        n_deleted = sum(future.result() for future in as_completed(futures))
+
+    log.info('Deleted {0:d} objects from bucket {1}:{2}'.format(
+        n_deleted, bucket_name, root_path))
+    return n_deleted
+
+
+def sync_directory(bucket_name, src_path, dest_path,
+                   aws_access_key_id, aws_secret_access_key,
+                   aws_region_name=None, aws_endpoint_url=None,
+                   surrogate_key=None, cache_control=None,
+                   surrogate_control=None, max_workers=8, cache_policy=None):
+    """Synchronize a directory in a bucket with another directory in the
+    same bucket, copying and deleting only the objects that differ.
+
+    Unlike `copy_directory`, objects in the destination that have the same
+    path, size and ETag as in the source (see `diff_directories`) are left
+    as they are. The destination's root directory redirect object isn't
+    changed, but redirect objects are created for new subdirectories with
+    an ``index.html``, and deleted for subdirectories that no longer have
+    one.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    src_path : str
+        Source directory in the S3 bucket.
+    dest_path : str
+        Destination directory in the S3 bucket.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    surrogate_key : str, optional
+        See `copy_directory`.
+    cache_control : str, optional
+        See `copy_directory`.
+    surrogate_control : str, optional
+        See `copy_directory`.
+    max_workers : int, optional
+        Maximum number of objects to copy (or object batches to delete)
+        concurrently.
+    cache_policy : `app.cachepolicy.CachePolicy`, optional
+        See `copy_directory`.
+
+    Returns
+    -------
+    changes : dict
+        The paths, relative to `dest_path`, of the objects that were
+        ``copied`` (missing or mismatched), ``deleted`` (extra, including
+        stale directory redirect objects) and ``redirected`` (new directory
+        redirect objects).
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    aws_args = {'aws_access_key_id': aws_access_key_id,
+                'aws_secret_access_key': aws_secret_access_key,
+                'aws_region_name': aws_region_name,
+                'aws_endpoint_url': aws_endpoint_url}
+    src_objects = list_directory(bucket_name, src_path, **aws_args)
+    dest_objects = list_directory(bucket_name, dest_path, **aws_args)
+    diff = diff_directories(src_objects, dest_objects)
+
+    changes = {'copied': sorted(diff['missing'] + diff['mismatched']),
+               'deleted': diff['extra'],
+               'redirected': _sync_redirect_paths(src_objects, dest_objects)}
+    if len(changes['copied']) > 0:
+        copy_objects(bucket_name, src_path, dest_path, changes['copied'],
+                     surrogate_key=surrogate_key,
+                     cache_control=cache_control,
+                     surrogate_control=surrogate_control,
+                     max_workers=max_workers,
+                     cache_policy=cache_policy,
+                     **aws_args)
+    if len(changes['deleted']) > 0:
+        delete_objects(bucket_name, dest_path, changes['deleted'],
+                       max_workers=max_workers,
+                       **aws_args)
+    if len(changes['redirected']) > 0:
+        put_directory_redirects(bucket_name, dest_path, changes['redirected'],
+                                surrogate_key=surrogate_key,
+                                cache_control=cache_control,
+                                surrogate_control=surrogate_control,
+                                max_workers=max_workers,
+                                **aws_args)
+    log.info('Synced {0} to {1}: {2:d} copied, {3:d} deleted, '
+             '{4:d} redirected'.format(
+                 src_path, dest_path, len(changes['copied']),
+                 len(changes['deleted']), len(changes['redirected'])))
+    return changes
+
+
+def _sync_redirect_paths(src_objects, dest_objects):
+    """Find the directory redirect objects that `sync_directory` creates."""
+    # Directory redirect objects are empty; a non-empty object at a
+    # redirect path is a file from an earlier build that must be replaced
+    return [path for path in directory_redirect_paths(src_objects)
+            if path not in src_objects and
+            dest_objects.get(path, {}).get('size') != 0]
+
+
+def directory_redirect_paths(paths):
+    """Find the subdirectories that need a directory redirect object.
+
+    A subdirectory needs a directory redirect object (see `copy_directory`)
+    if it contains an ``index.html`` object.
+
+    Parameters
+    ----------
+    paths : iterable of str
+        Object paths, relative to a root directory (such as the keys of a
+        `list_directory` listing).
+
+    Returns
+    -------
+    redirect_paths : list of str
+        Sorted paths of the subdirectories, relative to the root directory
+        and without trailing slashes. The root directory isn't included.
+    """
+    redirect_paths = set()
+    for path in paths:
+        dirname, basename = posixpath.split(path)
+        if basename == 'index.html' and dirname != '':
+            redirect_paths.add(dirname)
+    return sorted(redirect_paths)
+
+
+def put_directory_redirects(bucket_name, root_path, paths,
+                            aws_access_key_id, aws_secret_access_key,
+                            aws_region_name=None, aws_endpoint_url=None,
+                            surrogate_key=None, cache_control=None,
+                            surrogate_control=None, max_workers=8):
+    """Create directory redirect objects for subdirectories of a
+    directory in an S3 bucket.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    root_path : str
+        Directory in the S3 bucket.
+    paths : list of str
+        Paths of the subdirectories, relative to `root_path` (see
+        `directory_redirect_paths`).
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    surrogate_key : str, optional
+        Value of the ``x-amz-meta-surrogate-key`` header of the objects.
+    cache_control : str, optional
+        Value of the ``Cache-Control`` header of the objects.
+    surrogate_control : str, optional
+        Value of the ``x-amz-meta-surrogate-control`` header of the objects.
+    max_workers : int, optional
+        Maximum number of objects to create concurrently.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    if not root_path.endswith('/'):
+        root_path += '/'
+
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
+
+    _put_directory_redirect_objects(client, bucket_name,
+                                    [root_path + path for path in paths],
+                                    surrogate_key=surrogate_key,
+                                    cache_control=cache_control,
+                                    surrogate_control=surrogate_control,
+                                    max_workers=max_workers)
+
+
+def _put_directory_redirect_objects(client, bucket_name, keys,
+                                    surrogate_key=None, cache_control=None,
+                                    surrogate_control=None, max_workers=8):
+    """Create directory redirect objects (see `copy_directory`) with the
+    given keys, concurrently.
+
+    The objects get the same surrogate key and cache headers as copied
+    objects (see `_copy_object`), so that they're purged with the edition.
+    """
+    metadata = {'dir-redirect': 'true'}
+    if surrogate_control is not None:
+        metadata['surrogate-control'] = surrogate_control
+    if surrogate_key is not None:
+        metadata['surrogate-key'] = surrogate_key
+    put_args = {}
+    if cache_control is not None:
+        put_args['CacheControl'] = cache_control
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(client.put_object,
+                                   Bucket=bucket_name,
+                                   Key=key,
+                                   Body='',
+                                   ACL='public-read',
+                                   Metadata=metadata,
+                                   **put_args)
+                   for key in keys]
+        for future in as_completed(futures):
+            future.result()
+
+
+def mirror_directory(src_bucket_name, dest_bucket_name, root_path,
+                     aws_access_key_id, aws_secret_access_key,
+                     aws_region_name=None, aws_endpoint_url=None,
+                     copied_paths=None, deleted_paths=None, max_workers=8,
+                     src_aws_region_name=None, src_aws_endpoint_url=None):
+    """Replicate a directory to the same directory of a mirror bucket.
+
+    Objects are copied with all their headers and metadata (including
+    website redirect locations, which S3 doesn't copy by itself).
+
+    Parameters
+    ----------
+    src_bucket_name : str
+        Name of the source S3 bucket.
+    dest_bucket_name : str
+        Name of the mirror S3 bucket.
+    root_path : str
+        Directory in both buckets.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+        The account needs to be able to read the source bucket and write
+        to the mirror bucket.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the mirror bucket's AWS region.
+    aws_endpoint_url : str, optional
+        URL of the mirror bucket's S3 endpoint, if not the region's default
+        endpoint.
+    copied_paths : list of str, optional
+        Paths of the objects that changed in the source directory, relative
+        to `root_path`. If `None`, the whole directory is synchronized: the
+        directories are compared (see `diff_directories`), and the
+        directory redirect object (see `copy_directory`) is also
+        replicated.
+    deleted_paths : list of str, optional
+        Paths of the objects that were deleted from the source directory,
+        relative to `root_path`. Ignored if `copied_paths` is `None`.
+    max_workers : int, optional
+        Maximum number of objects to copy (or object batches to delete)
+        concurrently.
+    src_aws_region_name : str, optional
+        The name of the source bucket's AWS region, if not
+        `aws_region_name`.
+    src_aws_endpoint_url : str, optional
+        URL of the source bucket's S3 endpoint, if not `aws_endpoint_url`.
+
+    Returns
+    -------
+    changes : dict
+        The paths, relative to `root_path`, of the objects that were
+        ``copied`` to and ``deleted`` from the mirror bucket.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    if not root_path.endswith('/'):
+        root_path += '/'
+    if src_aws_region_name is None:
+        src_aws_region_name = aws_region_name
+    if src_aws_endpoint_url is None:
+        src_aws_endpoint_url = aws_endpoint_url
+    aws_args = {'aws_access_key_id': aws_access_key_id,
+                'aws_secret_access_key': aws_secret_access_key,
+                'aws_region_name': aws_region_name,
+                'aws_endpoint_url': aws_endpoint_url}
+    src_aws_args = dict(aws_args,
+                        aws_region_name=src_aws_region_name,
+                        aws_endpoint_url=src_aws_endpoint_url)
+
+    # Objects are read from the source's region and copied by the mirror's
+    src_client = get_client(**src_aws_args)
+    client = get_client(**aws_args)
+
+    if copied_paths is None:
+        src_objects = list_directory(src_bucket_name, root_path,
+                                     **src_aws_args)
+        dest_objects = list_directory(dest_bucket_name, root_path,
+                                      **aws_args)
+        diff = diff_directories(src_objects, dest_objects)
+        copied_paths = diff['missing'] + diff['mismatched']
+        # Redirect objects need to be deleted explicitly from the mirror
+        deleted_paths = sorted(path for path in dest_objects
+                               if path not in src_objects)
+        _mirror_root_object(src_client, client, src_bucket_name,
+                            dest_bucket_name, root_path.rstrip('/'))
+    elif deleted_paths is None:
+        deleted_paths = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_mirror_object, src_client, client,
+                                   src_bucket_name, dest_bucket_name,
+                                   root_path + path)
+                   for path in copied_paths]
+        for future in as_completed(futures):
+            future.result()
+    if len(deleted_paths) > 0:
+        delete_objects(dest_bucket_name, root_path, deleted_paths,
+                       max_workers=max_workers, **aws_args)
+
+    log.info('Mirrored {0}:{1} to {2}: {3:d} copied, {4:d} deleted'.format(
+        src_bucket_name, root_path, dest_bucket_name, len(copied_paths),
+        len(deleted_paths)))
+    return {'copied': sorted(copied_paths), 'deleted': sorted(deleted_paths)}
+
+
+def _mirror_root_object(src_client, client, src_bucket_name,
+                        dest_bucket_name, key):
+    """Replicate (or delete) the object named after a directory, which
+    isn't part of the directory's listing.
+    """
+    try:
+        _mirror_object(src_client, client, src_bucket_name,
+                       dest_bucket_name, key)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+        client.delete_object(Bucket=dest_bucket_name, Key=key)
+
+
+def _mirror_object(src_client, client, src_bucket_name, dest_bucket_name,
+                   key):
+    """Copy an object to another bucket, with all its headers."""
+    head = src_client.head_object(Bucket=src_bucket_name, Key=key)
+    copy_args = {}
+    if 'CacheControl' in head:
+        copy_args['CacheControl'] = head['CacheControl']
+    if 'WebsiteRedirectLocation' in head:
+        copy_args['WebsiteRedirectLocation'] = head['WebsiteRedirectLocation']
+    client.copy_object(
+        Bucket=dest_bucket_name,
+        Key=key,
+        CopySource={'Bucket': src_bucket_name, 'Key': key},
+        MetadataDirective='REPLACE',
+        Metadata=head['Metadata'],
+        ACL='public-read',
+        ContentType=head['ContentType'],
+        **copy_args)
+
+
+def put_alias_marker(bucket_name, root_path, target_path,
+                     aws_access_key_id, aws_secret_access_key,
+                     aws_region_name=None, aws_endpoint_url=None,
+                     surrogate_key=None, cache_control=None):
+    """Mark a directory as an alias of another directory in the same
+    bucket.
+
+    Rather than copying the target directory, a single empty object is
+    created, named after the alias directory (without a trailing slash,
+    like the directory redirect object of `copy_directory`). It has a
+    ``x-amz-meta-alias-of`` header with `target_path`, and a
+    ``x-amz-meta-dir-redirect=true`` header so that requests for the
+    alias' root are redirected to its directory path.
+
+    The alias' pages aren't served from S3: Fastly routes requests for the
+    alias directory to the target directory (see ``docs/editions.rst``).
+    Since the target's objects are served, they keep the target's
+    surrogate key, and purges of the target cascade to the alias.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    root_path : str
+        Directory in the S3 bucket of the alias.
+    target_path : str
+        Directory in the S3 bucket that the alias refers to.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    surrogate_key : str, optional
+        Value of the ``x-amz-meta-surrogate-key`` header of the object.
+    cache_control : str, optional
+        Value of the ``Cache-Control`` header of the object.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
+
+    metadata = {'alias-of': target_path.rstrip('/'),
+                'dir-redirect': 'true'}
+    if surrogate_key is not None:
+        metadata['surrogate-key'] = surrogate_key
+    put_args = {}
+    if cache_control is not None:
+        put_args['CacheControl'] = cache_control
+    client.put_object(Bucket=bucket_name,
+                      Key=root_path.rstrip('/'),
+                      Body='',
+                      ACL='public-read',
+                      Metadata=metadata,
+                      **put_args)
+
+
+def _copy_object(client, bucket_name, src_key, dest_key,
+                 surrogate_key=None, cache_control=None,
+                 surrogate_control=None, cache_policy=None, path=None):
+    """Copy a single object within a bucket, replacing its metadata.
+
+    See `copy_directory` for a description of the metadata parameters.
+    `path` is the object's path that the `cache_policy` is matched against.
+    """
+    # the listing doesn't include headers
+    head = client.head_object(Bucket=bucket_name, Key=src_key)
+    metadata = head['Metadata']
+    content_type = head['ContentType']
+
+    if cache_policy is not None:
+        cache_control, surrogate_control = cache_policy.get_headers(
+            path, content_type)
+
+    # try to use original Cache-Control header if new one is not set
+    if cache_control is None and 'CacheControl' in head:
+        cache_control = head['CacheControl']
+
+    if surrogate_control is not None:
+        metadata['surrogate-control'] = surrogate_control
+
+    if surrogate_key is not None:
+        metadata['surrogate-key'] = surrogate_key
+
+    copy_args = {}
+    if cache_control is not None:
+        copy_args['CacheControl'] = cache_control
+
+    client.copy_object(
+        Bucket=bucket_name,
+        Key=dest_key,
+        CopySource={'Bucket': bucket_name, 'Key': src_key},
+        MetadataDirective='REPLACE',
+        Metadata=metadata,
+        ACL='public-read',
+        ContentType=content_type,
+        **copy_args)
+
+
+def list_directory(bucket_name, root_path,
+                   aws_access_key_id, aws_secret_access_key,
+                   aws_region_name=None, aws_endpoint_url=None):
+    """List the objects in a directory of an S3 bucket.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    root_path : str
+        Directory in the S3 bucket that will be listed.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+
+    Returns
+    -------
+    objects : dict
+        Objects in the directory. Keys are object paths relative to
+        `root_path`. Values are dicts with ``size`` (bytes) and ``etag``
+        fields.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    if not root_path.endswith('/'):
+        root_path += '/'
+
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
+
+    objects = {}
+    paginator = client.get_paginator('list_objects')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=root_path):
+        for obj in page.get('Contents', []):
+            rel_path = os.path.relpath(obj['Key'], start=root_path)
+            objects[rel_path] = {'size': obj['Size'],
+                                 'etag': obj['ETag'].strip('"')}
+    return objects
+
+
+def get_object_etag(bucket_name, key,
+                    aws_access_key_id, aws_secret_access_key,
+                    aws_region_name=None, aws_endpoint_url=None):
+    """Get the ETag of an object in an S3 bucket.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    key : str
+        Key of the object.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+
+    Returns
+    -------
+    etag : str
+        The object's ETag, without quotes, or `None` if the object doesn't
+        exist.
+    """
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
+    try:
+        head = client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+    return head['ETag'].strip('"')
+
+
+def diff_directories(src_objects, dest_objects):
+    """Compare the listings of two directories by key, size and ETag.
+
+    Objects uploaded in multiple parts have ETags that aren't MD5 digests
+    of their content (they contain a ``-``), and objects copied from them
+    get new ETags, so equal sizes don't show that such objects have the
+    same content. Unless their ETags are identical, they're mismatched
+    (repairing the directory copies them again).
+
+    Parameters
+    ----------
+    src_objects : dict
+        Listing of the source directory, from `list_directory`.
+    dest_objects : dict
+        Listing of the destination directory, from `list_directory`.
+
+    Returns
+    -------
+    diff : dict
+        Sorted lists of relative paths, with fields:
+
+        ``missing``
+            Objects in the source that aren't in the destination.
+        ``extra``
+            Objects in the destination that aren't in the source, except
+            for the directory redirect objects of the source's
+            subdirectories (see `directory_redirect_paths`).
+        ``mismatched``
+            Objects in both directories whose sizes or ETags differ.
+    """
+    missing = []
+    mismatched = []
+    for path, src_obj in src_objects.items():
+        dest_obj = dest_objects.get(path)
+        if dest_obj is None:
+            missing.append(path)
+        elif src_obj['size'] != dest_obj['size'] \
+                or src_obj['etag'] != dest_obj['etag']:
+            mismatched.append(path)
+    redirect_paths = set(directory_redirect_paths(src_objects))
+    extra = [path for path in dest_objects
+             if path not in src_objects and path not in redirect_paths]
+    return {'missing': sorted(missing),
+            'extra': sorted(extra),
+            'mismatched': sorted(mismatched)}
+
+
+def fingerprint_directory(objects):
+    """Compute a content fingerprint of a directory listing.
+
+    The fingerprint is a SHA-256 hash over the sorted object paths and
+    ETags, so two directories with the same fingerprint have the same
+    objects with the same content.
+
+    Parameters
+    ----------
+    objects : dict
+        Listing of a directory, from `list_directory`.
+
+    Returns
+    -------
+    fingerprint : str
+        Hex SHA-256 fingerprint.
+    """
+    h = hashlib.sha256()
+    for path in sorted(objects):
+        h.update(path.encode('utf-8'))
+        h.update(b'\0')
+        h.update(objects[path]['etag'].encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def plan_copy_directory(src_objects, dest_objects, max_workers=8,
+                        request_latency=0.05, copy_bandwidth=50e6):
+    """Plan the S3 requests made by `copy_directory`, without making them.
+
+    Parameters
+    ----------
+    src_objects : dict
+        Listing of the source directory, from `list_directory`.
+    dest_objects : dict
+        Listing of the destination directory, from `list_directory`.
+    max_workers : int, optional
+        Number of concurrent requests made by parallelized stages.
+    request_latency : float, optional
+        Typical round-trip time of a single S3 request, in seconds.
+    copy_bandwidth : float, optional
+        Server-side copy bandwidth of a single copy request, in bytes per
+        second.
+
+    Returns
+    -------
+    plan : dict
+        The plan, with fields:
+
+        ``src_objects``, ``dest_objects``
+            Number of objects in the source and destination directories.
+        ``requests``
+            Dict with the number of ``list``, ``head``, ``copy``, ``delete``
+            and ``put`` requests.
+        ``bytes_copied``, ``bytes_deleted``
+            Size of the objects that are copied and deleted.
+        ``max_workers``
+            The concurrency used in the wall time estimate.
+        ``estimated_seconds``
+            Estimated wall time of the copy.
+    """
+    n_src = len(src_objects)
+    n_dest = len(dest_objects)
+    bytes_copied = sum(obj['size'] for obj in src_objects.values())
+    bytes_deleted = sum(obj['size'] for obj in dest_objects.values())
+
+    # A listing always takes at least one request, even if empty
+    n_src_pages = max(1, int(math.ceil(n_src / MAX_KEYS)))
+    n_dest_pages = max(1, int(math.ceil(n_dest / MAX_KEYS)))
+    n_delete_batches = int(math.ceil(n_dest / MAX_KEYS))
+    # The root directory's redirect object, and those of subdirectories
+    # that the build doesn't already have
+    n_redirects = 1 + len([path for path
+                           in directory_redirect_paths(src_objects)
+                           if path not in src_objects])
+
+    # Each stage of copy_directory, in order, as
+    # (number of requests, concurrency, bytes transferred server-side)
+    stages = [
+        # delete_directory: list the destination, delete batches in parallel
+        (n_dest_pages, 1, 0),
+        (n_delete_batches, max_workers, 0),
+        # list the source, then head and copy objects in parallel
+        (n_src_pages, 1, 0),
+        (2 * n_src, max_workers, bytes_copied),
+        # directory redirect objects, in parallel
+        (n_redirects, max_workers, 0),
+    ]
+    return {
+        'src_objects': n_src,
+        'dest_objects': n_dest,
+        'requests': {
+            'list': n_src_pages + n_dest_pages,
+            'head': n_src,
+            'copy': n_src,
+            'delete': n_delete_batches,
+            'put': n_redirects,
+        },
+        'bytes_copied': bytes_copied,
+        'bytes_deleted': bytes_deleted,
+        'max_workers': max_workers,
+        'estimated_seconds': _estimate_seconds(stages, request_latency,
+                                               copy_bandwidth),
+    }
+
+
+def plan_sync_directory(src_objects, dest_objects, max_workers=8,
+                        request_latency=0.05, copy_bandwidth=50e6):
+    """Plan the S3 requests made by `sync_directory`, without making them.
+
+    Only the objects that differ (see `diff_directories`) are copied or
+    deleted, so a sync of identical directories only lists them.
+
+    Parameters
+    ----------
+    src_objects : dict
+        Listing of the source directory, from `list_directory`.
+    dest_objects : dict
+        Listing of the destination directory, from `list_directory`.
+    max_workers : int, optional
+        Number of concurrent requests made by parallelized stages.
+    request_latency : float, optional
+        Typical round-trip time of a single S3 request, in seconds.
+    copy_bandwidth : float, optional
+        Server-side copy bandwidth of a single copy request, in bytes per
+        second.
+
+    Returns
+    -------
+    plan : dict
+        The plan, with the same fields as `plan_copy_directory`.
+    """
+    diff = diff_directories(src_objects, dest_objects)
+    copied = diff['missing'] + diff['mismatched']
+    n_redirects = len(_sync_redirect_paths(src_objects, dest_objects))
+    bytes_copied = sum(src_objects[path]['size'] for path in copied)
+    bytes_deleted = sum(dest_objects[path]['size'] for path in diff['extra'])
+
+    n_src_pages = max(1, int(math.ceil(len(src_objects) / MAX_KEYS)))
+    n_dest_pages = max(1, int(math.ceil(len(dest_objects) / MAX_KEYS)))
+    n_delete_batches = int(math.ceil(len(diff['extra']) / MAX_KEYS))
+
+    # Each stage of sync_directory, in order (see plan_copy_directory)
+    stages = [
+        # list the source and destination
+        (n_src_pages + n_dest_pages, 1, 0),
+        # copy_objects: head and copy objects in parallel
+        (2 * len(copied), max_workers, bytes_copied),
+        # delete_objects: delete batches in parallel
+        (n_delete_batches, max_workers, 0),
+        # directory redirect objects of new subdirectories, in parallel
+        (n_redirects, max_workers, 0),
+    ]
+    return {
+        'src_objects': len(src_objects),
+        'dest_objects': len(dest_objects),
+        'requests': {
+            'list': n_src_pages + n_dest_pages,
+            'head': len(copied),
+            'copy': len(copied),
+            'delete': n_delete_batches,
+            'put': n_redirects,
+        },
+        'bytes_copied': bytes_copied,
+        'bytes_deleted': bytes_deleted,
+        'max_workers': max_workers,
+        'estimated_seconds': _estimate_seconds(stages, request_latency,
+                                               copy_bandwidth),
+    }
+
+
+def _estimate_seconds(stages, request_latency, copy_bandwidth):
+    """Estimate the wall time of the stages of a plan, given as
+    ``(number of requests, concurrency, bytes transferred server-side)``
+    tuples.
+    """
+    estimated_seconds = 0.
+    for n_requests, concurrency, n_bytes in stages:
+        estimated_seconds += math.ceil(n_requests / concurrency) \
+            * request_latency
+        estimated_seconds += n_bytes / (copy_bandwidth * concurrency)
+    return estimated_seconds
+
+
+def presign_post(bucket_name, root_path,
+                 aws_access_key_id, aws_secret_access_key,
+                 aws_region_name=None, aws_endpoint_url=None,
+                 surrogate_key=None, cache_control=None,
+                 surrogate_control=None, expires_in=3600):
+    """Create a presigned POST policy for uploading objects to a directory
+    of an S3 bucket.
+
+    The policy lets a client without AWS credentials upload any number of
+    objects with browser-style form POSTs, as long as their keys are in
+    the `root_path` directory. The ACL and metadata fields are fixed by the
+    policy; the ``Content-Type`` field can be set freely.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    root_path : str
+        Directory in the S3 bucket that uploads are restricted to.
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    surrogate_key : str, optional
+        Value of the ``x-amz-meta-surrogate-key`` field of the objects.
+    cache_control : str, optional
+        Value of the ``Cache-Control`` field of the objects.
+    surrogate_control : str, optional
+        Value of the ``x-amz-meta-surrogate-control`` field of the objects.
+    expires_in : int, optional
+        Number of seconds the policy is valid for.
+
+    Returns
+    -------
+    post : dict
+        The ``url`` to POST to, and the form ``fields`` to include. Clients
+        replace ``${filename}`` in the ``key`` field with the object's path
+        relative to `root_path`.
+    """
+    if not root_path.endswith('/'):
+        root_path += '/'
+
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
+
+    fields = {'acl': 'public-read'}
+    if surrogate_key is not None:
+        fields['x-amz-meta-surrogate-key'] = surrogate_key
+    if cache_control is not None:
+        fields['Cache-Control'] = cache_control
+    if surrogate_control is not None:
+        fields['x-amz-meta-surrogate-control'] = surrogate_control
+    conditions = [{k: v} for k, v in sorted(fields.items())]
+    conditions.append(['starts-with', '$key', root_path])
+    conditions.append(['starts-with', '$Content-Type', ''])
+
+    return client.generate_presigned_post(
+        Bucket=bucket_name,
+        Key=root_path + '${filename}',
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=expires_in)
+
+
+def presign_uploads(bucket_name, root_path, files,
+                    aws_access_key_id, aws_secret_access_key,
+                    aws_region_name=None, aws_endpoint_url=None,
+                    surrogate_key=None, cache_control=None,
+                    surrogate_control=None,
+                    expires_in=3600, multipart_threshold=64 * 1024 ** 2,
+                    part_size=16 * 1024 ** 2):
+    """Create presigned upload URLs for files in a directory of an S3 bucket.
+
+    Files smaller than `multipart_threshold` get a single presigned ``PUT``
+    URL. Larger files get a multipart upload, with a presigned URL for
+    each part, and for completing and aborting the upload. If presigning
+    fails, the multipart uploads that were already created are aborted.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of an S3 bucket.
+    root_path : str
+        Directory in the S3 bucket where files are uploaded.
+    files : list of dict
+        Files to upload. Each file has a ``path`` relative to `root_path`,
+        a ``size`` in bytes, and an optional ``content_type`` (guessed from
+        the path by default).
+    aws_access_key_id : str
+        The access key for your AWS account. Also set `aws_secret_access_key`.
+    aws_secret_access_key : str
+        The secret key for your AWS account.
+    aws_region_name : str, optional
+        The name of the AWS region.
+    aws_endpoint_url : str, optional
+        URL of the S3 endpoint, if not the region's default endpoint.
+    surrogate_key : str, optional
+        Value of the ``x-amz-meta-surrogate-key`` header of the objects.
+    cache_control : str, optional
+        Value of the ``Cache-Control`` header of the objects.
+    surrogate_control : str, optional
+        Value of the ``x-amz-meta-surrogate-control`` header of the objects.
+    expires_in : int, optional
+        Number of seconds the URLs are valid for.
+    multipart_threshold : int, optional
+        Size, in bytes, from which files are uploaded in parts.
+    part_size : int, optional
+        Size, in bytes, of each part of a multipart upload. This is
+        increased if a file would need more than `MAX_PARTS` parts.
+
+    Returns
+    -------
+    uploads : list of dict
+        An upload for each file, with the file's ``path``, its ``key`` in
+        the bucket, and an upload ``method``. If the ``method`` is ``PUT``,
+        the upload has a presigned ``url`` and the ``headers`` that must be
+        sent with it. If the ``method`` is ``multipart``, the upload has the
+        ``upload_id``, the ``part_size``, the ``parts`` (each with a
+        ``part_number`` and a presigned ``PUT`` ``url``), a ``complete_url``
+        to ``POST`` the list of uploaded parts to, and an ``abort_url`` to
+        ``DELETE``.
+
+    Raises
+    ------
+    app.exceptions.S3Error
+        Thrown by any unexpected faults from the S3 API.
+    """
+    if not root_path.endswith('/'):
+        root_path += '/'
+
+    client = get_client(aws_access_key_id, aws_secret_access_key,
+                        aws_region_name=aws_region_name,
+                        aws_endpoint_url=aws_endpoint_url)
+
+    object_args = {'ACL': 'public-read'}
+    metadata = {}
+    if surrogate_key is not None:
+        metadata['surrogate-key'] = surrogate_key
+    if surrogate_control is not None:
+        metadata['surrogate-control'] = surrogate_control
+    if len(metadata) > 0:
+        object_args['Metadata'] = metadata
+    if cache_control is not None:
+        object_args['CacheControl'] = cache_control
+
+    uploads = []
+    try:
+        for f in files:
+            uploads.append(_presign_upload(client, bucket_name, root_path, f,
+                                           object_args, expires_in,
+                                           multipart_threshold, part_size))
+    except Exception:
+        _abort_multipart_uploads(client, bucket_name, uploads)
+        raise
+    return uploads
+
+
+def _abort_multipart_uploads(client, bucket_name, uploads):
+    """Abort the multipart uploads among presigned uploads (see
+    `presign_uploads`), logging any failures.
+    """
+    for upload in uploads:
+        if upload['method'] != 'multipart':
+            continue
+        try:
+            client.abort_multipart_upload(Bucket=bucket_name,
+                                          Key=upload['key'],
+                                          UploadId=upload['upload_id'])
+        except Exception:
+            log.exception('Could not abort the multipart upload of '
+                          '{0}'.format(upload['key']))
+
+
+def _presign_upload(client, bucket_name, root_path, file_info, object_args,
+                    expires_in, multipart_threshold, part_size):
+    """Presign the upload of a single file (see `presign_uploads`)."""
+    key = root_path + file_info['path']
+    content_type = file_info.get('content_type') \
+        or mimetypes.guess_type(file_info['path'])[0] \
+        or 'application/octet-stream'
+    object_args = dict(object_args, ContentType=content_type)
+    upload = {'path': file_info['path'], 'key': key}
+
+    if file_info['size'] < multipart_threshold:
+        upload['method'] = 'PUT'
+        upload['url'] = client.generate_presigned_url(
+            'put_object',
+            Params=dict(object_args, Bucket=bucket_name, Key=key),
+            ExpiresIn=expires_in)
+        headers = {'Content-Type': content_type,
+                   'x-amz-acl': object_args['ACL']}
+        for k, v in object_args.get('Metadata', {}).items():
+            headers['x-amz-meta-' + k] = v
+        if 'CacheControl' in object_args:
+            headers['Cache-Control'] = object_args['CacheControl']
+        upload['headers'] = headers
+        return upload
+
+    part_size = max(part_size,
+                    int(math.ceil(file_info['size'] / MAX_PARTS)))
+    n_parts = int(math.ceil(file_info['size'] / part_size))
+    r = client.create_multipart_upload(Bucket=bucket_name, Key=key,
+                                       **object_args)
+    if 'UploadId' not in r:
+        raise S3Error('create_multipart_upload failed for {0}:\n{1}'.format(
+            key, pformat(r)))
+    upload_args = {'Bucket': bucket_name, 'Key': key,
+                   'UploadId': r['UploadId']}
+
+    upload['method'] = 'multipart'
+    upload['upload_id'] = r['UploadId']
+    upload['part_size'] = part_size
+    upload['parts'] = [
+        {'part_number': n,
+         'url': client.generate_presigned_url(
+             'upload_part',
+             Params=dict(upload_args, PartNumber=n),
+             ExpiresIn=expires_in)}
+        for n in range(1, n_parts + 1)]
+    upload['complete_url'] = client.generate_presigned_url(
+        'complete_multipart_upload',
+        Params=upload_args,
+        ExpiresIn=expires_in,
+        HttpMethod='POST')
+    upload['abort_url'] = client.generate_presigned_url(
+        'abort_multipart_upload',
+        Params=upload_args,
+        ExpiresIn=expires_in,
+        HttpMethod='DELETE')
+    return upload
@@ -0,0 +1,467 @@
+"""Stand-in HTTP servers for the external services of LTD Keeper.
+
+The stand-ins mimic the parts of the Fastly API, the Route 53 API and LTD
+Dasher that LTD Keeper uses, so that the publishing path can be exercised
+and benchmarked offline:
+
+:class:`FastlyStandin`
+    Purges by surrogate key (single and bulk), by URL, and of the whole
+    service, and edge dictionary items, with ``Fastly-RateLimit-*``
+    headers.
+:class:`Route53Standin`
+    Hosted zone listings, and CNAME record set listings and changes.
+:class:`DasherStandin`
+    The ``POST /build`` endpoint.
+
+Each stand-in runs a threaded HTTP server in a background thread, adds a
+configurable ``latency`` to each response, fails a configurable
+``failure_rate`` fraction of requests with a 500 status, and records the
+requests it receives. Point LTD Keeper at them with the
+``FASTLY_API_ROOT``, ``ROUTE53_ENDPOINT_URL`` and ``LTD_DASHER_URL``
+configuration. The stand-ins are started by ``run.py standins``, and by the
+``fastly_standin``, ``route53_standin`` and ``dasher_standin`` test
+fixtures.
+"""
+
+import json
+import logging
+import random
+import socketserver
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ElementTree
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+__all__ = ['StandinServer', 'FastlyStandin', 'Route53Standin',
+           'DasherStandin']
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class StandinServer(object):
+    """Base class of stand-in HTTP servers.
+
+    Subclasses implement :meth:`handle`.
+
+    Parameters
+    ----------
+    host : str, optional
+        Host name or address to listen on.
+    port : int, optional
+        Port to listen on. If 0, a free port is chosen when the server
+        starts.
+    latency : float, optional
+        Seconds added to each response.
+    failure_rate : float, optional
+        Fraction (0 to 1) of requests that fail with a 500 status.
+    seed : int, optional
+        Seed of the failure pseudo-random number generator.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.,
+                 failure_rate=0., seed=None):
+        super(StandinServer, self).__init__()
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = []
+        """Requests received, as dicts with ``method``, ``path``,
+        ``headers`` and ``body`` fields.
+        """
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """Root URL of the server."""
+        return 'http://{0}:{1:d}'.format(self.host, self.port)
+
+    def start(self):
+        """Start the server in a background thread.
+
+        Returns
+        -------
+        server : `StandinServer`
+            This server.
+        """
+        self._httpd = _ThreadingHTTPServer((self.host, self.port),
+                                           _RequestHandler)
+        self._httpd.standin = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        kwargs={'poll_interval': 0.05},
+                                        name=type(self).__name__,
+                                        daemon=True)
+        self._thread.start()
+        log.info('{0} listening on {1}'.format(type(self).__name__,
+                                               self.url))
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        if self._httpd is None:
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        self._httpd = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, method, path, headers, body):
+        """Respond to a request.
+
+        Parameters
+        ----------
+        method : str
+            HTTP method.
+        path : str
+            Request path, with any query string.
+        headers : `email.message.Message`
+            Request headers.
+        body : bytes
+            Request body.
+
+        Returns
+        -------
+        status : int
+            Response status.
+        headers : dict
+            Response headers.
+        body : bytes
+            Response body.
+        """
+        raise NotImplementedError
+
+    def failure(self):
+        """Get the response to a request that fails (see `handle`)."""
+        return 500, {'Content-Type': 'text/plain'}, b'Stand-in failure'
+
+    def _respond(self, method, path, headers, body):
+        with self._lock:
+            self.requests.append({'method': method, 'path': path,
+                                  'headers': dict(headers.items()),
+                                  'body': body})
+            failed = self._random.random() < self.failure_rate
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if failed:
+            return self.failure()
+        try:
+            return self.handle(method, path, headers, body)
+        except Exception:
+            log.exception('{0} failed on {1} {2}'.format(
+                type(self).__name__, method, path))
+            return self.failure()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server that handles each request in a thread."""
+
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Dispatch requests to the server's `StandinServer`."""
+
+    # Keep connections alive, as Fastly and AWS do
+    protocol_version = 'HTTP/1.1'
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else b''
+        status, headers, content = self.server.standin._respond(
+            self.command, self.path, self.headers, body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class FastlyStandin(StandinServer):
+    """Stand-in for the Fastly purge and edge dictionary item APIs.
+
+    Requests must have a ``Fastly-Key`` header. Responses have
+    ``Fastly-RateLimit-Remaining`` and ``Fastly-RateLimit-Reset`` headers,
+    counted down from `rate_limit` requests per `rate_limit_window`
+    seconds; requests beyond the limit fail with a 429 status.
+
+    Parameters
+    ----------
+    rate_limit : int, optional
+        Number of purge requests per rate limit window.
+    rate_limit_window : float, optional
+        Duration of rate limit windows, in seconds.
+    **kwargs
+        Arguments of `StandinServer`.
+    """
+
+    def __init__(self, rate_limit=1000, rate_limit_window=3600., **kwargs):
+        super(FastlyStandin, self).__init__(**kwargs)
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.purged_keys = []
+        """Surrogate keys purged, in order."""
+        self.purged_urls = []
+        """URLs purged, in order."""
+        self.purge_alls = 0
+        """Number of purges of the whole service."""
+        self.dictionaries = {}
+        """Items of the edge dictionaries, keyed by dictionary ID."""
+        self._window_reset = 0.
+        self._remaining = rate_limit
+
+    def failure(self):
+        return (500, {'Content-Type': 'application/json'},
+                json.dumps({'msg': 'Stand-in failure'}).encode('utf-8'))
+
+    def _use_rate_limit(self):
+        with self._lock:
+            now = time.time()
+            if now >= self._window_reset:
+                self._window_reset = now + self.rate_limit_window
+                self._remaining = self.rate_limit
+            self._remaining = max(self._remaining - 1, -1)
+            return self._remaining, self._window_reset
+
+    def handle(self, method, path, headers, body):
+        if 'Fastly-Key' not in headers:
+            return (401, {'Content-Type': 'application/json'},
+                    json.dumps({'msg': 'Provided credentials are missing '
+                                       'or invalid'}).encode('utf-8'))
+        remaining, reset = self._use_rate_limit()
+        response_headers = {
+            'Content-Type': 'application/json',
+            'Fastly-RateLimit-Remaining': str(max(remaining, 0)),
+            'Fastly-RateLimit-Reset': '{0:d}'.format(int(reset))}
+        if remaining < 0:
+            return (429, response_headers,
+                    json.dumps({'msg': 'Rate limit exceeded'})
+                    .encode('utf-8'))
+
+        parts = urlsplit(path).path.strip('/').split('/')
+        if parts[0] == 'service' and len(parts) == 6 \
+                and parts[2] == 'dictionary' and parts[4] == 'item':
+            data = self._dictionary_item(method, parts[3], unquote(parts[5]),
+                                         body)
+        elif method != 'POST':
+            data = None
+        elif parts[0] == 'purge' and len(parts) > 1:
+            url = '/'.join(parts[1:])
+            with self._lock:
+                self.purged_urls.append(url)
+            data = {'status': 'ok', 'id': uuid.uuid4().hex}
+        elif parts[0] == 'service' and len(parts) == 4 \
+                and parts[2] == 'purge':
+            with self._lock:
+                self.purged_keys.append(parts[3])
+            data = {'status': 'ok', 'id': uuid.uuid4().hex}
+        elif parts[0] == 'service' and len(parts) == 3 \
+                and parts[2] == 'purge':
+            keys = headers.get('Surrogate-Key', '').split()
+            with self._lock:
+                self.purged_keys.extend(keys)
+            data = {key: uuid.uuid4().hex for key in keys}
+        elif parts[0] == 'service' and len(parts) == 3 \
+                and parts[2] == 'purge_all':
+            with self._lock:
+                self.purge_alls += 1
+            data = {'status': 'ok'}
+        else:
+            data = None
+        if data is None:
+            return (404, response_headers,
+                    json.dumps({'msg': 'Record not found'}).encode('utf-8'))
+        return 200, response_headers, json.dumps(data).encode('utf-8')
+
+    def _dictionary_item(self, method, dictionary_id, key, body):
+        """Set (PUT) or delete (DELETE) an edge dictionary item."""
+        with self._lock:
+            items = self.dictionaries.setdefault(dictionary_id, {})
+            if method == 'PUT':
+                form = parse_qs(body.decode('utf-8'))
+                items[key] = form.get('item_value', [''])[0]
+                return {'dictionary_id': dictionary_id, 'item_key': key,
+                        'item_value': items[key]}
+            elif method == 'DELETE' and key in items:
+                del items[key]
+                return {'status': 'ok'}
+        return None
+
+
+class Route53Standin(StandinServer):
+    """Stand-in for the Route 53 API.
+
+    Supports the ``ListHostedZones``, ``ListResourceRecordSets`` and
+    ``ChangeResourceRecordSets`` actions.
+
+    Parameters
+    ----------
+    zones : list of str, optional
+        Names of the hosted zones, as fully qualified domains (e.g.
+        ``'lsst.io.'``).
+    **kwargs
+        Arguments of `StandinServer`.
+    """
+
+    XMLNS = 'https://route53.amazonaws.com/doc/2013-04-01/'
+
+    def __init__(self, zones=('lsst.io.',), **kwargs):
+        super(Route53Standin, self).__init__(**kwargs)
+        self.zones = {'Z{0:d}'.format(i + 1): name
+                      for i, name in enumerate(zones)}
+        self.records = {zone_id: {} for zone_id in self.zones}
+        """Record sets of each zone, keyed by zone ID, then by
+        ``(name, type)``, as dicts with ``Name``, ``Type``, ``TTL`` and
+        ``ResourceRecords`` fields.
+        """
+
+    def failure(self):
+        return self._error(500, 'InternalFailure', 'Stand-in failure')
+
+    def _error(self, status, code, message):
+        root = ElementTree.Element('ErrorResponse', xmlns=self.XMLNS)
+        error = ElementTree.SubElement(root, 'Error')
+        ElementTree.SubElement(error, 'Type').text = 'Sender'
+        ElementTree.SubElement(error, 'Code').text = code
+        ElementTree.SubElement(error, 'Message').text = message
+        return self._xml(root, status=status)
+
+    def _xml(self, root, status=200):
+        content = ElementTree.tostring(root, encoding='utf-8')
+        return status, {'Content-Type': 'text/xml'}, content
+
+    def handle(self, method, path, headers, body):
+        parts = urlsplit(path).path.strip('/').split('/')
+        if parts[:2] != ['2013-04-01', 'hostedzone']:
+            return self._error(404, 'NotFound', 'Unknown path')
+        if len(parts) == 2 and method == 'GET':
+            return self._list_hosted_zones()
+        if len(parts) == 4 and parts[3] == 'rrset':
+            zone_id = parts[2]
+            if zone_id not in self.zones:
+                return self._error(404, 'NoSuchHostedZone', zone_id)
+            if method == 'GET':
+                return self._list_record_sets(zone_id)
+            if method == 'POST':
+                return self._change_record_sets(zone_id, body)
+        return self._error(404, 'NotFound', 'Unknown path')
+
+    def _list_hosted_zones(self):
+        root = ElementTree.Element('ListHostedZonesResponse',
+                                   xmlns=self.XMLNS)
+        zones = ElementTree.SubElement(root, 'HostedZones')
+        for zone_id, name in sorted(self.zones.items()):
+            zone = ElementTree.SubElement(zones, 'HostedZone')
+            ElementTree.SubElement(zone, 'Id').text = \
+                '/hostedzone/' + zone_id
+            ElementTree.SubElement(zone, 'Name').text = name
+            ElementTree.SubElement(zone, 'CallerReference').text = zone_id
+            with self._lock:
+                count = len(self.records[zone_id])
+            ElementTree.SubElement(zone, 'ResourceRecordSetCount').text = \
+                str(count)
+        ElementTree.SubElement(root, 'IsTruncated').text = 'false'
+        ElementTree.SubElement(root, 'MaxItems').text = '100'
+        return self._xml(root)
+
+    def _list_record_sets(self, zone_id):
+        root = ElementTree.Element('ListResourceRecordSetsResponse',
+                                   xmlns=self.XMLNS)
+        record_sets = ElementTree.SubElement(root, 'ResourceRecordSets')
+        with self._lock:
+            records = [self.records[zone_id][k]
+                       for k in sorted(self.records[zone_id])]
+        for record in records:
+            record_set = ElementTree.SubElement(record_sets,
+                                                'ResourceRecordSet')
+            ElementTree.SubElement(record_set, 'Name').text = record['Name']
+            ElementTree.SubElement(record_set, 'Type').text = record['Type']
+            ElementTree.SubElement(record_set, 'TTL').text = \
+                str(record['TTL'])
+            values = ElementTree.SubElement(record_set, 'ResourceRecords')
+            for value in record['ResourceRecords']:
+                resource_record = ElementTree.SubElement(values,
+                                                         'ResourceRecord')
+                ElementTree.SubElement(resource_record, 'Value').text = \
+                    value['Value']
+        ElementTree.SubElement(root, 'IsTruncated').text = 'false'
+        ElementTree.SubElement(root, 'MaxItems').text = '100'
+        return self._xml(root)
+
+    def _change_record_sets(self, zone_id, body):
+        request = ElementTree.fromstring(body)
+        ns = {'r': self.XMLNS}
+        with self._lock:
+            records = self.records[zone_id]
+            for change in request.iterfind('.//r:Change', ns):
+                action = change.findtext('r:Action', namespaces=ns)
+                record_set = change.find('r:ResourceRecordSet', ns)
+                record = {
+                    'Name': record_set.findtext('r:Name', namespaces=ns),
+                    'Type': record_set.findtext('r:Type', namespaces=ns),
+                    'TTL': int(record_set.findtext('r:TTL', default='300',
+                                                   namespaces=ns)),
+                    'ResourceRecords': [
+                        {'Value': value.text} for value in
+                        record_set.iterfind('.//r:Value', ns)]}
+                key = (record['Name'], record['Type'])
+                if action == 'DELETE':
+                    if key not in records:
+                        return self._error(400, 'InvalidChangeBatch',
+                                           'No record {0}'.format(key[0]))
+                    del records[key]
+                else:
+                    records[key] = record
+
+        root = ElementTree.Element('ChangeResourceRecordSetsResponse',
+                                   xmlns=self.XMLNS)
+        change_info = ElementTree.SubElement(root, 'ChangeInfo')
+        ElementTree.SubElement(change_info, 'Id').text = \
+            '/change/' + uuid.uuid4().hex
+        ElementTree.SubElement(change_info, 'Status').text = 'INSYNC'
+        ElementTree.SubElement(change_info, 'SubmittedAt').text = \
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        return self._xml(root)
+
+
+class DasherStandin(StandinServer):
+    """Stand-in for LTD Dasher's ``POST /build`` endpoint.
+
+    Parameters
+    ----------
+    **kwargs
+        Arguments of `StandinServer`.
+    """
+
+    def __init__(self, **kwargs):
+        super(DasherStandin, self).__init__(**kwargs)
+        self.product_urls = []
+        """Product URLs of dashboard builds, in order."""
+
+    def handle(self, method, path, headers, body):
+        if method != 'POST' or urlsplit(path).path != '/build':
+            return 404, {'Content-Type': 'text/plain'}, b'Not found'
+        data = json.loads(body.decode('utf-8'))
+        with self._lock:
+            self.product_urls.extend(data['product_urls'])
+        return 202, {'Content-Type': 'application/json'}, b'{}'
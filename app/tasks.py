@@ -0,0 +1,424 @@
+"""Background jobs and maintenance tasks.
+
+Jobs are run through :func:`app.jobs.submit`. Since jobs run in their own
+application context, they receive entity IDs rather than DB model instances.
+Maintenance tasks are run by ``run.py`` commands.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import current_app
+
+from . import db
+from . import mirrors
+from . import s3
+from . import purges
+from .models import Product, Edition
+
+__all__ = ['teardown_product', 'resync_editions', 'verify_editions',
+           'repair_edition']
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def teardown_product(product_id):
+    """Delete a product and all of its resources.
+
+    See `app.models.Product.teardown`.
+
+    Parameters
+    ----------
+    product_id : int
+        ID of the `~app.models.Product` to delete.
+    """
+    product = Product.query.get(product_id)
+    if product is None:
+        log.warning('Product {0:d} is already deleted'.format(product_id))
+        return
+
+    log.info('Tearing down product {0}'.format(product.slug))
+    product.teardown()
+    db.session.commit()
+    log.info('Finished tearing down product {0}'.format(product.slug))
+
+
+def resync_editions(max_workers=4, dry_run=False, product_slug=None,
+                    progress=None):
+    """Re-synchronize the S3 directories of editions with their builds.
+
+    Every edition that isn't deprecated or an alias, and has a build, is
+    compared with its build by key, size and ETag (see
+    `app.s3.diff_directories`). Editions whose content doesn't match are
+    re-copied from their build, purged from Fastly, and replicated to the
+    mirror buckets (see `app.mirrors`). Editions are processed in
+    parallel.
+
+    This function must be called from within an application context.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Number of editions to process concurrently. Each edition's copy is
+        itself parallelized over ``S3_MAX_WORKERS`` threads.
+    dry_run : bool, optional
+        If `True`, plan the copies of editions that don't match (see
+        `app.s3.plan_copy_directory`) rather than making them.
+    product_slug : str, optional
+        Only resync the editions of this product.
+    progress : callable, optional
+        Function called with the result of each edition (see below) as it
+        completes.
+
+    Returns
+    -------
+    summary : dict
+        Summary of the resync, with fields:
+
+        ``editions``
+            Number of editions processed.
+        ``matched``, ``resynced``, ``planned``, ``failed``
+            Number of editions with each result status.
+        ``objects_copied``, ``bytes_copied``
+            Number and size of objects copied (or planned to be copied).
+        ``elapsed_seconds``
+            Wall time of the resync.
+        ``results``
+            Results of each edition. Each result is a dict with the
+            ``edition`` (``product/edition`` slugs), ``status``, the
+            ``missing``, ``extra`` and ``mismatched`` object counts, the
+            ``objects_copied`` and ``bytes_copied``, and ``error`` message
+            (if the status is ``failed``). Planned results also have a
+            ``plan``.
+    """
+    return _map_editions(_resync_edition, max_workers, product_slug,
+                         progress, dry_run=dry_run)
+
+
+def verify_editions(max_workers=4, repair=False, product_slug=None,
+                    progress=None):
+    """Verify the S3 directories of editions against their builds.
+
+    Every edition that isn't deprecated or an alias, and has a build, is
+    compared with its build by key, size and ETag (see
+    `app.s3.diff_directories`). Editions are processed in parallel.
+    Optionally, broken editions are repaired by copying only their missing
+    and mismatched objects, and deleting their extra objects (see
+    `repair_edition`).
+
+    This function must be called from within an application context.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Number of editions to process concurrently.
+    repair : bool, optional
+        If `True`, repair editions that don't match their builds.
+    product_slug : str, optional
+        Only verify the editions of this product.
+    progress : callable, optional
+        Function called with the result of each edition (see below) as it
+        completes.
+
+    Returns
+    -------
+    summary : dict
+        Summary of the verification. The fields are the same as those
+        returned by `resync_editions`, except that the ``resynced`` and
+        ``planned`` statuses are replaced by ``mismatched`` and
+        ``repaired``. Each result also includes the ``diff`` from
+        `app.s3.diff_directories`.
+    """
+    return _map_editions(_verify_edition, max_workers, product_slug,
+                         progress, repair=repair)
+
+
+def repair_edition(edition_id):
+    """Repair an edition whose S3 directory doesn't match its build.
+
+    Only the edition's missing and mismatched objects are copied from
+    the build, and only its extra objects are deleted. The edition is
+    re-verified first, so repairs can be queued with stale reports.
+
+    Parameters
+    ----------
+    edition_id : int
+        ID of the `~app.models.Edition` to repair.
+
+    Returns
+    -------
+    result : dict
+        The repair result (see `verify_editions`).
+    """
+    edition = Edition.query.get(edition_id)
+    if edition is None or edition.build is None \
+            or edition.alias_of is not None:
+        log.warning('Edition {0:d} cannot be repaired'.format(edition_id))
+        return None
+
+    config = current_app.config
+    _check_aws_credentials(config)
+    target = _get_edition_target(edition)
+    db.session.commit()
+    result = _verify_edition(target, target['aws_args'], config, repair=True)
+    _purge_editions([(target, result)])
+    _replicate_editions([(target, result)])
+    log.info('Repair {edition}: {status}'.format(**result))
+    return result
+
+
+def _check_aws_credentials(config):
+    """Ensure that AWS credentials are configured."""
+    if config['AWS_ID'] is None or config['AWS_SECRET'] is None:
+        raise RuntimeError('AWS credentials are not configured')
+
+
+def _purge_editions(completed):
+    """Queue purges of the resynced and repaired editions (see
+    `app.purges`), so that large runs are planned against the Fastly API
+    budget.
+
+    Parameters
+    ----------
+    completed : list of tuple
+        ``(target, result)`` tuples of processed editions.
+    """
+    keys = {False: [], True: []}
+    for target, result in completed:
+        if result['status'] in ('resynced', 'repaired'):
+            keys[target['soft_purge']].append(
+                target['copy_args']['surrogate_key'])
+    for soft, surrogate_keys in keys.items():
+        if len(surrogate_keys) > 0:
+            purges.enqueue(surrogate_keys, soft=soft)
+
+
+def _replicate_editions(completed):
+    """Queue the replication of the resynced and repaired editions to the
+    mirror buckets (see `app.mirrors`).
+
+    Resynced editions are fully synchronized, while only the objects that
+    repairs copied and deleted are replicated.
+
+    Parameters
+    ----------
+    completed : list of tuple
+        ``(target, result)`` tuples of processed editions.
+    """
+    if len(current_app.config['S3_MIRROR_BUCKETS']) == 0:
+        return
+    for target, result in completed:
+        copied_paths = None
+        deleted_paths = None
+        if result['status'] == 'repaired':
+            diff = result['diff']
+            copied_paths = diff['missing'] + diff['mismatched']
+            deleted_paths = diff['extra']
+        elif result['status'] != 'resynced':
+            continue
+        copy_args = target['copy_args']
+        mirrors.replicate(
+            copy_args['bucket_name'], copy_args['dest_path'],
+            copied_paths=copied_paths, deleted_paths=deleted_paths,
+            aws_region_name=target['aws_args']['aws_region_name'],
+            aws_endpoint_url=target['aws_args']['aws_endpoint_url'])
+
+
+def _get_edition_target(edition):
+    """Resolve everything a worker thread needs to know about an edition,
+    so that workers don't need to use the DB.
+    """
+    return {'edition': '/'.join((edition.product.slug, edition.slug)),
+            'copy_args': edition.get_s3_copy_args(),
+            'aws_args': edition.product.get_aws_args(),
+            'soft_purge': edition.uses_soft_purge}
+
+
+def _map_editions(worker, max_workers, product_slug, progress, **kwargs):
+    """Run a worker function over editions in a thread pool.
+
+    Parameters
+    ----------
+    worker : callable
+        Function called as ``worker(target, aws_args, config, **kwargs)``
+        for each edition that isn't deprecated and has a build, where
+        ``aws_args`` are the `app.s3` arguments for the region and endpoint
+        of the edition's bucket. It returns a result dict. Resynced and
+        repaired editions are then queued for purges and for replication
+        to the mirror buckets.
+    max_workers : int
+        Number of editions to process concurrently.
+    product_slug : str
+        If not `None`, only process the editions of this product.
+    progress : callable
+        If not `None`, called with each result as it completes.
+    **kwargs
+        Additional keyword arguments passed to `worker`.
+
+    Returns
+    -------
+    summary : dict
+        Summary of results (see `resync_editions`).
+    """
+    config = current_app.config
+    _check_aws_credentials(config)
+
+    query = Edition.query\
+        .filter(Edition.date_ended == None)\
+        .filter(Edition.alias_of_id == None)\
+        .filter(Edition.build_id != None)  # NOQA
+    if product_slug is not None:
+        query = query.join(Product).filter(Product.slug == product_slug)
+    targets = [_get_edition_target(edition) for edition in query.all()]
+    # Save any bucket regions discovered while resolving the targets
+    db.session.commit()
+
+    start_time = time.time()
+    results = []
+    completed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(worker, target, target['aws_args'],
+                                   config, **kwargs): target
+                   for target in targets}
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            completed.append((futures[future], result))
+            log.info('{0} {edition}: {status}'.format(worker.__name__,
+                                                      **result))
+            if progress is not None:
+                progress(result)
+    _purge_editions(completed)
+    _replicate_editions(completed)
+
+    summary = {
+        'editions': len(results),
+        'objects_copied': sum(r['objects_copied'] for r in results),
+        'bytes_copied': sum(r['bytes_copied'] for r in results),
+        'elapsed_seconds': time.time() - start_time,
+        'results': results
+    }
+    statuses = ('matched', 'resynced', 'planned', 'mismatched', 'repaired',
+                'failed')
+    for status in statuses:
+        summary[status] = len([r for r in results if r['status'] == status])
+    return summary
+
+
+def _diff_edition(target, aws_args):
+    """List and compare an edition's directory with its build's.
+
+    Returns
+    -------
+    src_objects : dict
+        Listing of the build's directory.
+    dest_objects : dict
+        Listing of the edition's directory.
+    diff : dict
+        Diff from `app.s3.diff_directories`.
+    """
+    copy_args = target['copy_args']
+    src_objects = s3.list_directory(copy_args['bucket_name'],
+                                    copy_args['src_path'],
+                                    **aws_args)
+    dest_objects = s3.list_directory(copy_args['bucket_name'],
+                                     copy_args['dest_path'],
+                                     **aws_args)
+    diff = s3.diff_directories(src_objects, dest_objects)
+    return src_objects, dest_objects, diff
+
+
+def _new_result(target):
+    """Create an edition result dict with a ``matched`` status."""
+    return {'edition': target['edition'],
+            'status': 'matched',
+            'missing': 0,
+            'extra': 0,
+            'mismatched': 0,
+            'objects_copied': 0,
+            'bytes_copied': 0,
+            'error': None}
+
+
+def _resync_edition(target, aws_args, config, dry_run=False):
+    """Resync a single edition (run in a worker thread by
+    `resync_editions`).
+    """
+    copy_args = target['copy_args']
+    result = _new_result(target)
+    try:
+        src_objects, dest_objects, diff = _diff_edition(target, aws_args)
+        for k in ('missing', 'extra', 'mismatched'):
+            result[k] = len(diff[k])
+        if sum(len(paths) for paths in diff.values()) == 0:
+            return result
+
+        if dry_run:
+            result['status'] = 'planned'
+            result['plan'] = s3.plan_copy_directory(
+                src_objects, dest_objects,
+                max_workers=config['S3_MAX_WORKERS'],
+                request_latency=config['S3_REQUEST_LATENCY'],
+                copy_bandwidth=config['S3_COPY_BANDWIDTH'])
+        else:
+            result['status'] = 'resynced'
+            s3.copy_directory(max_workers=config['S3_MAX_WORKERS'],
+                              **dict(copy_args, **aws_args))
+        result['objects_copied'] = len(src_objects)
+        result['bytes_copied'] = sum(obj['size']
+                                     for obj in src_objects.values())
+    except Exception as e:
+        log.exception('Failed to resync {0}'.format(target['edition']))
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    return result
+
+
+def _verify_edition(target, aws_args, config, repair=False):
+    """Verify, and optionally repair, a single edition (run in a worker
+    thread by `verify_editions`).
+    """
+    copy_args = target['copy_args']
+    result = _new_result(target)
+    try:
+        src_objects, dest_objects, diff = _diff_edition(target, aws_args)
+        result['diff'] = diff
+        for k in ('missing', 'extra', 'mismatched'):
+            result[k] = len(diff[k])
+        if sum(len(paths) for paths in diff.values()) == 0:
+            return result
+
+        if not repair:
+            result['status'] = 'mismatched'
+            return result
+
+        broken_paths = diff['missing'] + diff['mismatched']
+        s3.copy_objects(
+            copy_args['bucket_name'],
+            copy_args['src_path'],
+            copy_args['dest_path'],
+            broken_paths,
+            surrogate_key=copy_args['surrogate_key'],
+            cache_control=copy_args['cache_control'],
+            surrogate_control=copy_args['surrogate_control'],
+            cache_policy=copy_args['cache_policy'],
+            max_workers=config['S3_MAX_WORKERS'],
+            **aws_args)
+        s3.delete_objects(
+            copy_args['bucket_name'],
+            copy_args['dest_path'],
+            diff['extra'],
+            max_workers=config['S3_MAX_WORKERS'],
+            **aws_args)
+        result['status'] = 'repaired'
+        result['objects_copied'] = len(broken_paths)
+        result['bytes_copied'] = sum(src_objects[path]['size']
+                                     for path in broken_paths)
+    except Exception as e:
+        log.exception('Failed to verify {0}'.format(target['edition']))
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    return result
@@ -4,6 +4,7 @@ Copyright 2016 AURA/LSST.
 Copyright 2014 Miguel Grinberg.
 """
 
+import posixpath
 import re
 from dateutil import parser as datetime_parser
 from dateutil.tz import tzutc
@@ -77,6 +78,26 @@ def validate_path_slug(slug):
     return True
 
 
+def validate_soft_purge(value, nullable=True):
+    """Validate a ``soft_purge`` setting, which must be a boolean (or
+    `None`, if `nullable`)."""
+    if value is None and nullable:
+        return value
+    if not isinstance(value, bool):
+        raise ValidationError('Invalid soft_purge: {0!r}'.format(value))
+    return value
+
+
+def normalize_relative_path(path):
+    """Normalize a file path relative to a build's directory, rejecting
+    absolute paths and paths that escape the directory."""
+    norm_path = posixpath.normpath(path)
+    if norm_path.startswith('/') or norm_path == '..' \
+            or norm_path.startswith('../') or norm_path == '.':
+        raise ValidationError('Invalid path: ' + path)
+    return norm_path
+
+
 def auto_slugify_edition(git_refs):
     """Given a list of Git refs, build a reasonable URL-safe slug."""
     slug = '-'.join(git_refs)
@@ -0,0 +1,280 @@
+"""Warming the Fastly cache with rebuilt editions.
+
+After an edition is rebuilt and purged, the first readers of each page wait
+for Fastly to fetch it from S3. When the ``CACHE_WARMING`` configuration is
+set, :func:`schedule` starts a background job (see `app.jobs`) that requests
+the edition's most important URLs through Fastly instead, with at most
+``CACHE_WARMING_MAX_WORKERS`` concurrent requests. The URLs are, in order
+and up to ``CACHE_WARMING_MAX_URLS`` of them:
+
+1. The ``CACHE_WARMING_PATHS`` configuration, a hot list of paths relative
+   to the edition (the edition's root by default).
+2. The edition's most requested pages in the CDN access logs, if they've
+   been analyzed (see `app.accesslogs`).
+3. The edition's directory pages (``index.html`` objects), shallowest
+   first.
+4. The URLs in the edition's ``sitemap.xml``, if it has one.
+
+The job waits for the edition's pending debounced purges (see
+`app.purges`) before requesting URLs, so that it doesn't warm content that
+is about to be purged. While the purge is pending, the job reschedules
+itself (see `app.jobs.submit_later`) rather than holding a job thread.
+
+Progress is recorded per edition (see :func:`get_status`), and exported as
+metrics (see `app.metrics`):
+
+``ltd_keeper_warming_requests_total``
+    Requests made, labelled with a ``hit``, ``miss`` or ``error``
+    ``result``. A request is a hit if Fastly's ``X-Cache`` header reports
+    that the edge cache served it.
+``ltd_keeper_warming_urls``
+    Number of URLs to request in the last warming job of each
+    ``edition`` (a ``product/edition`` label).
+``ltd_keeper_warming_warmed``
+    Number of those URLs that were requested successfully.
+``ltd_keeper_warming_failed``
+    Number of those URLs whose requests failed.
+"""
+
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from . import httpclient
+from . import jobs
+from . import metrics
+from . import purges
+from . import s3
+
+__all__ = ['schedule', 'get_status']
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+# Warming progress, keyed by product/edition slugs
+_status = {}
+_status_lock = threading.Lock()
+
+# Longest wait, in seconds, for an edition's debounced purges
+MAX_PURGE_WAIT = 300.
+# Seconds between checks of an edition's debounced purges
+PURGE_POLL_INTERVAL = 1.
+
+_requests = metrics.counter(
+    'ltd_keeper_warming_requests_total',
+    'Requests made to warm the Fastly cache with rebuilt editions.')
+metrics.gauge(
+    'ltd_keeper_warming_urls',
+    'URLs to request in the last warming job of editions.',
+    callback=lambda: [({'edition': edition}, status['urls'])
+                      for edition, status in get_status().items()])
+metrics.gauge(
+    'ltd_keeper_warming_warmed',
+    'URLs requested successfully in the last warming job of editions.',
+    callback=lambda: [({'edition': edition},
+                       status['hits'] + status['misses'])
+                      for edition, status in get_status().items()])
+metrics.gauge(
+    'ltd_keeper_warming_failed',
+    'URLs whose requests failed in the last warming job of editions.',
+    callback=lambda: [({'edition': edition}, status['errors'])
+                      for edition, status in get_status().items()])
+
+
+def get_status():
+    """Get the progress of cache warming jobs.
+
+    Returns
+    -------
+    status : dict
+        Keys are editions (``product/edition`` slugs). Values are the
+        progress of the edition's last warming job, as dicts with ``urls``
+        (number of URLs to request), ``done``, ``hits``, ``misses`` and
+        ``errors`` (numbers of requests), and ``started`` and ``finished``
+        (Unix times, or `None`) fields.
+    """
+    with _status_lock:
+        return {edition: dict(status) for edition, status in _status.items()}
+
+
+def schedule(edition):
+    """Start a job that warms the Fastly cache with an edition.
+
+    This function must be called from within an application context. It
+    does nothing unless ``CACHE_WARMING`` is set and Fastly is configured.
+
+    Parameters
+    ----------
+    edition : `app.models.Edition`
+        The rebuilt edition.
+    """
+    config = current_app.config
+    if not config['CACHE_WARMING'] or config['FASTLY_SERVICE_ID'] is None \
+            or config['FASTLY_KEY'] is None:
+        return
+
+    # Resolve the edition now, so that the job doesn't need the DB
+    target = {'edition': '/'.join((edition.product.slug, edition.slug)),
+              'published_url': edition.published_url,
+              'surrogate_key': edition.surrogate_key,
+              'bucket_name': edition.product.bucket_name,
+              'root_path': edition.bucket_root_dirname,
+              'aws_args': edition.product.get_aws_args(),
+              'scheduled': time.time()}
+    paths = list(config['CACHE_WARMING_PATHS'])
+    paths.extend(hot_path.path for hot_path in
+                 edition.hot_paths.limit(config['CACHE_WARMING_MAX_URLS']))
+    jobs.submit(warm_edition, target,
+                paths=paths,
+                max_urls=config['CACHE_WARMING_MAX_URLS'],
+                max_workers=config['CACHE_WARMING_MAX_WORKERS'])
+
+
+def warm_edition(target, paths=('',), max_urls=100, max_workers=4):
+    """Request an edition's URLs through Fastly (run as a job).
+
+    If the edition's surrogate key is queued for a purge, the job is
+    scheduled again `PURGE_POLL_INTERVAL` seconds later instead, for up to
+    `MAX_PURGE_WAIT` seconds after the edition was rebuilt.
+
+    Parameters
+    ----------
+    target : dict
+        The edition, as resolved by `schedule`.
+    paths : list of str, optional
+        Hot list of paths, relative to the edition's URL.
+    max_urls : int, optional
+        Maximum number of URLs to request.
+    max_workers : int, optional
+        Maximum number of concurrent requests.
+
+    Returns
+    -------
+    status : dict
+        The edition's warming progress (see `get_status`), or `None` if
+        the job was scheduled again.
+    """
+    if purges.is_pending(target['surrogate_key']) \
+            and time.time() < target['scheduled'] + MAX_PURGE_WAIT:
+        jobs.submit_later(PURGE_POLL_INTERVAL, warm_edition, target,
+                          paths=paths, max_urls=max_urls,
+                          max_workers=max_workers)
+        return None
+
+    edition = target['edition']
+    status = {'urls': 0, 'done': 0, 'hits': 0, 'misses': 0, 'errors': 0,
+              'started': time.time(), 'finished': None}
+    with _status_lock:
+        _status[edition] = status
+
+    session = httpclient.get_session('warming')
+    urls = collect_urls(target, session, paths=paths, max_urls=max_urls)
+    with _status_lock:
+        status['urls'] = len(urls)
+    log.info('Warming {0} with {1:d} URLs'.format(edition, len(urls)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(lambda url: _warm_url(session, url),
+                                   urls):
+            _requests.inc(result=result)
+            with _status_lock:
+                status['done'] += 1
+                status[{'hit': 'hits', 'miss': 'misses',
+                        'error': 'errors'}[result]] += 1
+
+    with _status_lock:
+        status['finished'] = time.time()
+        log.info('Warmed {0}: {1[hits]:d} hits, {1[misses]:d} misses, '
+                 '{1[errors]:d} errors'.format(edition, status))
+        return dict(status)
+
+
+def collect_urls(target, session, paths=('',), max_urls=100):
+    """Collect the URLs of an edition to warm, in order of importance (see
+    the module documentation).
+
+    Parameters
+    ----------
+    target : dict
+        The edition, as resolved by `schedule`.
+    session : `requests.Session`
+        Session used to request the edition's sitemap.
+    paths : list of str, optional
+        Hot list of paths, relative to the edition's URL.
+    max_urls : int, optional
+        Maximum number of URLs.
+
+    Returns
+    -------
+    urls : list of str
+        The URLs.
+    """
+    base_url = target['published_url'] + '/'
+    urls = [base_url + path.lstrip('/') for path in paths]
+
+    if target['aws_args'] is not None:
+        try:
+            objects = s3.list_directory(target['bucket_name'],
+                                        target['root_path'],
+                                        **target['aws_args'])
+        except Exception:
+            log.exception('Could not list {0}'.format(target['root_path']))
+        else:
+            dirnames = [path[:-len('index.html')] for path in objects
+                        if path == 'index.html'
+                        or path.endswith('/index.html')]
+            dirnames.sort(key=lambda dirname: (dirname.count('/'), dirname))
+            urls.extend(base_url + dirname for dirname in dirnames)
+
+    if len(urls) < max_urls:
+        urls.extend(_get_sitemap_urls(session, base_url))
+
+    # Remove duplicates, keeping the most important ones
+    unique_urls = []
+    for url in urls:
+        if url not in unique_urls:
+            unique_urls.append(url)
+    return unique_urls[:max_urls]
+
+
+def _get_sitemap_urls(session, base_url):
+    """Get the URLs of an edition's sitemap that are in the edition."""
+    try:
+        r = session.get(base_url + 'sitemap.xml')
+        if r.status_code != 200:
+            return []
+        root = ElementTree.fromstring(r.content)
+    except Exception:
+        log.warning('Could not read the sitemap of {0}'.format(base_url))
+        return []
+    urls = []
+    for element in root.iter():
+        if element.tag.endswith('loc') and element.text is not None:
+            url = element.text.strip()
+            if url.startswith(base_url):
+                urls.append(url)
+    return urls
+
+
+def _warm_url(session, url):
+    """Request a URL, and classify the result as a cache ``'hit'``,
+    ``'miss'`` or ``'error'``.
+    """
+    try:
+        r = session.get(url)
+        # Read the whole response, so that the request completes
+        r.content
+    except Exception as e:
+        log.warning('Warming {0} failed: {1}'.format(url, e))
+        return 'error'
+    if r.status_code >= 400:
+        return 'error'
+    # With shielding, X-Cache is a list of results; the last is the edge's
+    x_cache = r.headers.get('X-Cache', '').split(',')[-1].strip().upper()
+    return 'hit' if x_cache.startswith('HIT') else 'miss'
@@ -1,6 +1,7 @@
 """ltd-keeper configuration and environment profiles."""
 
 import abc
+import json
 import os
 
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
@@ -19,9 +20,120 @@ class Config(object):
     AWS_SECRET = os.environ.get('LTD_KEEPER_AWS_SECRET')
     AWS_REGION = os.environ.get('LTD_KEEPER_AWS_REGION', None)
     DISABLE_ROUTE53 = os.environ.get('LTD_KEEPER_DISABLE_ROUTE53', False)
+    # Route 53 endpoint, if not AWS's (e.g. a stand-in server; see
+    # app.standins)
+    ROUTE53_ENDPOINT_URL = os.getenv('LTD_KEEPER_ROUTE53_ENDPOINT_URL', None)
     FASTLY_KEY = os.environ.get('LTD_KEEPER_FASTLY_KEY')
     FASTLY_SERVICE_ID = os.environ.get('LTD_KEEPER_FASTLY_ID')
+    # Root URL of the Fastly API (e.g. a stand-in server; see app.standins)
+    FASTLY_API_ROOT = os.getenv('LTD_KEEPER_FASTLY_API_ROOT',
+                                'https://api.fastly.com')
+    # ID of the Fastly edge dictionary that routes the directories of alias
+    # editions to their targets' directories (see docs/editions.rst)
+    FASTLY_ALIAS_DICTIONARY_ID = os.getenv(
+        'LTD_KEEPER_FASTLY_ALIAS_DICTIONARY_ID', None)
+    # Maximum number of changed URLs that a rebuild purges individually from
+    # Fastly; rebuilds that change more purge the edition's surrogate key
+    FASTLY_PURGE_URL_THRESHOLD = int(
+        os.getenv('LTD_KEEPER_FASTLY_PURGE_URL_THRESHOLD', 50))
+    # Seconds that surrogate key and URL purges are held to coalesce repeated
+    # purges of the same key or URL (see app.purges); 0 purges immediately
+    FASTLY_PURGE_DEBOUNCE = float(
+        os.getenv('LTD_KEEPER_FASTLY_PURGE_DEBOUNCE', 10))
+    # Number of due surrogate keys and URLs from which the whole Fastly
+    # service is purged instead (see app.purges); 0 never purges the whole
+    # service
+    FASTLY_PURGE_ALL_THRESHOLD = int(
+        os.getenv('LTD_KEEPER_FASTLY_PURGE_ALL_THRESHOLD', 1000))
+    # Fastly API requests per rate limit window kept for other uses; purges
+    # that don't fit the rest of the budget are held until the window resets
+    FASTLY_PURGE_BUDGET_RESERVE = int(
+        os.getenv('LTD_KEEPER_FASTLY_PURGE_BUDGET_RESERVE', 10))
+    # Surrogate keys and URLs that fail to purge are queued again after
+    # FASTLY_PURGE_RETRY_DELAY seconds, doubling with each failure, up to
+    # FASTLY_PURGE_RETRIES times (see app.purges)
+    FASTLY_PURGE_RETRIES = int(
+        os.getenv('LTD_KEEPER_FASTLY_PURGE_RETRIES', 5))
+    FASTLY_PURGE_RETRY_DELAY = float(
+        os.getenv('LTD_KEEPER_FASTLY_PURGE_RETRY_DELAY', 10))
+    # Seconds that Fastly may serve stale pages of soft purged editions
+    # while it refreshes them (stale-while-revalidate), and while S3 fails
+    # (stale-if-error); 0 leaves the directive out
+    FASTLY_STALE_WHILE_REVALIDATE = int(
+        os.getenv('LTD_KEEPER_FASTLY_STALE_WHILE_REVALIDATE', 60))
+    FASTLY_STALE_IF_ERROR = int(
+        os.getenv('LTD_KEEPER_FASTLY_STALE_IF_ERROR', 86400))
     LTD_DASHER_URL = os.getenv('LTD_DASHER_URL', None)
+    # Seconds after triggering an LTD Dasher build that the product's
+    # surrogate key is purged, so that Fastly serves the new dashboards
+    LTD_DASHER_PURGE_DELAY = float(
+        os.getenv('LTD_KEEPER_DASHER_PURGE_DELAY', 60))
+    # Warm the Fastly cache after edition rebuilds by requesting up to
+    # CACHE_WARMING_MAX_URLS of the edition's pages (see app.warming),
+    # starting with the comma-separated CACHE_WARMING_PATHS
+    CACHE_WARMING = bool(int(os.getenv('LTD_KEEPER_CACHE_WARMING', 0)))
+    CACHE_WARMING_PATHS = [
+        path.strip()
+        for path in os.getenv('LTD_KEEPER_CACHE_WARMING_PATHS', '').split(',')]
+    CACHE_WARMING_MAX_URLS = int(
+        os.getenv('LTD_KEEPER_CACHE_WARMING_MAX_URLS', 100))
+    CACHE_WARMING_MAX_WORKERS = int(
+        os.getenv('LTD_KEEPER_CACHE_WARMING_MAX_WORKERS', 4))
+    # Verify that rebuilt editions are fresh in Fastly by requesting their
+    # PURGE_VERIFICATION_CANARY page every PURGE_VERIFICATION_INTERVAL
+    # seconds until it matches S3, for up to PURGE_VERIFICATION_TIMEOUT
+    # seconds (see app.probes)
+    PURGE_VERIFICATION = bool(
+        int(os.getenv('LTD_KEEPER_PURGE_VERIFICATION', 0)))
+    PURGE_VERIFICATION_CANARY = os.getenv(
+        'LTD_KEEPER_PURGE_VERIFICATION_CANARY', 'index.html')
+    PURGE_VERIFICATION_INTERVAL = float(
+        os.getenv('LTD_KEEPER_PURGE_VERIFICATION_INTERVAL', 5))
+    PURGE_VERIFICATION_TIMEOUT = float(
+        os.getenv('LTD_KEEPER_PURGE_VERIFICATION_TIMEOUT', 600))
+    # Connection pool size (per host) and timeouts (seconds) of the shared
+    # HTTP sessions used for the Fastly and LTD Dasher APIs
+    HTTP_POOL_MAXSIZE = int(os.getenv('LTD_KEEPER_HTTP_POOL_MAXSIZE', 10))
+    HTTP_CONNECT_TIMEOUT = float(
+        os.getenv('LTD_KEEPER_HTTP_CONNECT_TIMEOUT', 3.05))
+    HTTP_READ_TIMEOUT = float(os.getenv('LTD_KEEPER_HTTP_READ_TIMEOUT', 30))
+    # Number of threads used for parallel S3 requests (deletes and copies)
+    S3_MAX_WORKERS = int(os.getenv('LTD_KEEPER_S3_MAX_WORKERS', 16))
+    # Typical round-trip time of an S3 request, in seconds, and the
+    # server-side copy bandwidth of a single request, in bytes per second.
+    # These are used to estimate the wall time of planned rebuilds.
+    S3_REQUEST_LATENCY = float(
+        os.getenv('LTD_KEEPER_S3_REQUEST_LATENCY', 0.05))
+    S3_COPY_BANDWIDTH = float(
+        os.getenv('LTD_KEEPER_S3_COPY_BANDWIDTH', 50e6))
+    # Lifetime (seconds) of presigned upload URLs and POST policies, and the
+    # file size (bytes) from which presigned uploads are split into parts
+    S3_PRESIGN_EXPIRES = int(os.getenv('LTD_KEEPER_S3_PRESIGN_EXPIRES', 3600))
+    S3_MULTIPART_THRESHOLD = int(
+        os.getenv('LTD_KEEPER_S3_MULTIPART_THRESHOLD', 64 * 1024 ** 2))
+    S3_MULTIPART_PART_SIZE = int(
+        os.getenv('LTD_KEEPER_S3_MULTIPART_PART_SIZE', 16 * 1024 ** 2))
+    # JSON array of rules that pick the Cache-Control and Surrogate-Control
+    # headers of edition objects (see app.cachepolicy); None for defaults
+    CACHE_CONTROL_RULES = json.loads(
+        os.getenv('LTD_KEEPER_CACHE_CONTROL_RULES', 'null'))
+    # Default S3 endpoint URL, for S3-compatible stores (None for AWS)
+    S3_ENDPOINT_URL = os.getenv('LTD_KEEPER_S3_ENDPOINT_URL', None)
+    # JSON object mapping bucket names to their AWS regions; the regions of
+    # other buckets are discovered from S3 (if S3_DISCOVER_BUCKET_REGIONS)
+    S3_BUCKET_REGIONS = json.loads(
+        os.getenv('LTD_KEEPER_S3_BUCKET_REGIONS', '{}'))
+    S3_DISCOVER_BUCKET_REGIONS = bool(int(
+        os.getenv('LTD_KEEPER_S3_DISCOVER_BUCKET_REGIONS', 1)))
+    # Comma-separated names of buckets that editions are replicated to
+    S3_MIRROR_BUCKETS = [
+        name.strip()
+        for name in os.getenv('LTD_KEEPER_S3_MIRROR_BUCKETS', '').split(',')
+        if name.strip() != '']
+    # Number of background jobs (e.g., product teardowns) run at once
+    JOBS_MAX_WORKERS = int(os.getenv('LTD_KEEPER_JOBS_MAX_WORKERS', 4))
+    # Run background jobs synchronously, inside the request (for testing)
+    JOBS_EAGER = False
 
     # Suppresses a warning until Flask-SQLAlchemy 3
     # See http://stackoverflow.com/a/33790196
@@ -54,6 +166,8 @@ class TestConfig(Config):
     SERVER_NAME = 'example.test'
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' \
         + os.path.join(BASEDIR, 'ltd-keeper-test.sqlite')
+    JOBS_EAGER = True
+    S3_DISCOVER_BUCKET_REGIONS = False
 
     @classmethod
     def init_app(cls, app):
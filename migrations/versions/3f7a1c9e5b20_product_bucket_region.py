@@ -0,0 +1,30 @@
+"""Add bucket_region and bucket_endpoint_url to products
+
+Revision ID: 3f7a1c9e5b20
+Revises: 8e2b4c7a9d13
+Create Date: 2026-10-19 14:21:08.513604
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f7a1c9e5b20'
+down_revision = '8e2b4c7a9d13'
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bucket_region',
+                                      sa.String(length=64),
+                                      nullable=True))
+        batch_op.add_column(sa.Column('bucket_endpoint_url',
+                                      sa.Unicode(length=255),
+                                      nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('bucket_endpoint_url')
+        batch_op.drop_column('bucket_region')
@@ -0,0 +1,34 @@
+"""Add fingerprint to builds and editions
+
+Revision ID: 5c6f0f8d4b1a
+Revises: ffdd80058eed
+Create Date: 2026-10-19 10:12:31.204518
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c6f0f8d4b1a'
+down_revision = 'ffdd80058eed'
+
+
+def upgrade():
+    with op.batch_alter_table('builds', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fingerprint',
+                                      sa.String(length=64),
+                                      nullable=True))
+
+    with op.batch_alter_table('editions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fingerprint',
+                                      sa.String(length=64),
+                                      nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('editions', schema=None) as batch_op:
+        batch_op.drop_column('fingerprint')
+
+    with op.batch_alter_table('builds', schema=None) as batch_op:
+        batch_op.drop_column('fingerprint')
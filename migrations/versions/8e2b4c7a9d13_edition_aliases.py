@@ -0,0 +1,30 @@
+"""Add alias_of_id to editions
+
+Revision ID: 8e2b4c7a9d13
+Revises: 5c6f0f8d4b1a
+Create Date: 2026-10-19 11:02:47.381920
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2b4c7a9d13'
+down_revision = '5c6f0f8d4b1a'
+
+
+def upgrade():
+    with op.batch_alter_table('editions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('alias_of_id',
+                                      sa.Integer(),
+                                      nullable=True))
+        batch_op.create_foreign_key('fk_editions_alias_of_id_editions',
+                                    'editions', ['alias_of_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('editions', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_editions_alias_of_id_editions',
+                                 type_='foreignkey')
+        batch_op.drop_column('alias_of_id')
@@ -0,0 +1,33 @@
+"""Add soft_purge to products and editions
+
+Revision ID: b61e04d2a8f5
+Revises: 3f7a1c9e5b20
+Create Date: 2026-10-19 15:02:44.207716
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b61e04d2a8f5'
+down_revision = '3f7a1c9e5b20'
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('soft_purge',
+                                      sa.Boolean(),
+                                      nullable=False,
+                                      server_default=sa.false()))
+    with op.batch_alter_table('editions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('soft_purge',
+                                      sa.Boolean(),
+                                      nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('editions', schema=None) as batch_op:
+        batch_op.drop_column('soft_purge')
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('soft_purge')
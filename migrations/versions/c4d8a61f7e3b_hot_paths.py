@@ -0,0 +1,36 @@
+"""Add hot_paths table
+
+Revision ID: c4d8a61f7e3b
+Revises: b61e04d2a8f5
+Create Date: 2026-10-19 17:48:15.602318
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8a61f7e3b'
+down_revision = 'b61e04d2a8f5'
+
+
+def upgrade():
+    op.create_table('hot_paths',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('edition_id', sa.Integer(), nullable=False),
+                    sa.Column('path', sa.Unicode(length=1024),
+                              nullable=False),
+                    sa.Column('hits', sa.Integer(), nullable=False),
+                    sa.Column('rank', sa.Integer(), nullable=False),
+                    sa.Column('date_analyzed', sa.DateTime(),
+                              nullable=False),
+                    sa.ForeignKeyConstraint(['edition_id'],
+                                            ['editions.id'], ),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_hot_paths_edition_id'), 'hot_paths',
+                    ['edition_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_hot_paths_edition_id'), table_name='hot_paths')
+    op.drop_table('hot_paths')
@@ -35,16 +35,36 @@ Other commands
 ./run.py db upgrade
    Run a DB migration to the current DB scheme.
 
+./run.py rebuild_edition -p {product} -e {edition} [-b {build}] [--dry-run]
+   Rebuild an edition from a build. With --dry-run, print the S3 requests
+   that the rebuild would make instead.
+
+./run.py resync_editions [-j {jobs}] [-p {product}] [--dry-run]
+   Re-copy every edition whose S3 content doesn't match its build.
+
+./run.py verify_editions [-j {jobs}] [-p {product}] [--repair]
+   Report editions whose S3 objects don't match their build, and optionally
+   repair only the broken objects.
+
+./run.py standins [--latency {seconds}] [--failure-rate {fraction}]
+   Run stand-in Fastly, Route 53 and LTD Dasher servers for offline tests.
+
+./run.py analyze_logs [-k {top}] [--dry-run] {log files}
+   Find the most requested pages of editions in CDN access logs (gzip JSON
+   lines), and save them for cache warming.
+
 See config.py for associated configuration.
 """
 
+import json
 import os
+import time
 
 from flask.ext.script import Manager
 from flask.ext.migrate import Migrate, MigrateCommand
 
 from app import create_app, db, models
-from app.models import User, Permission
+from app.models import User, Permission, Product, Edition, Build
 
 environment = os.getenv('LTD_KEEPER_PROFILE', 'development')
 keeper_app = create_app(profile=environment)
@@ -153,5 +173,226 @@ def initkeys():
                         product.slug))
 
 
+@manager.option('--dry-run', dest='dry_run', action='store_true',
+                default=False)
+@manager.option('-b', '--build', dest='build_slug', default=None)
+@manager.option('-e', '--edition', dest='edition_slug', required=True)
+@manager.option('-p', '--product', dest='product_slug', required=True)
+def rebuild_edition(product_slug, edition_slug, build_slug, dry_run):
+    """Rebuild an edition from a build.
+
+    ::
+        run.py rebuild_edition -p pipelines -e main -b 42
+
+    If the build slug is omitted, the edition is rebuilt from its current
+    build. With ``--dry-run``, the S3 requests, bytes moved and estimated
+    wall time of the rebuild are printed, and nothing is modified.
+    """
+    with keeper_app.app_context():
+        product = Product.query.filter_by(slug=product_slug).first()
+        if product is None:
+            raise SystemExit('No product {0}'.format(product_slug))
+        edition = product.editions\
+            .filter(Edition.slug == edition_slug).first()
+        if edition is None:
+            raise SystemExit('No edition {0}'.format(edition_slug))
+        if build_slug is None:
+            build = edition.build
+        else:
+            build = product.builds.filter(Build.slug == build_slug).first()
+        if build is None:
+            raise SystemExit('No build to rebuild edition from')
+
+        if dry_run:
+            plan = edition.plan_rebuild(build)
+            print(json.dumps(plan, indent=2, sort_keys=True))
+            return
+
+        edition.rebuild_from_build(build)
+        db.session.add(edition)
+        db.session.commit()
+        print('Rebuilt {0}/{1} from build {2}'.format(
+            product.slug, edition.slug, build.slug))
+
+
+@manager.option('--dry-run', dest='dry_run', action='store_true',
+                default=False)
+@manager.option('-p', '--product', dest='product_slug', default=None,
+                help='Only resync editions of this product')
+@manager.option('-j', '--jobs', dest='max_workers', type=int, default=4,
+                help='Number of editions to resync concurrently')
+def resync_editions(max_workers, product_slug, dry_run):
+    """Re-synchronize the S3 content of editions with their builds.
+
+    ::
+        run.py resync_editions -j 8
+
+    Use this command to repair editions after the bucket is restored from
+    a backup, for example. Editions whose content already matches their
+    build are skipped. With ``--dry-run``, editions are only verified, and
+    the cost of re-copying them is estimated.
+    """
+    from app import tasks
+
+    def print_progress(result):
+        print_progress.n += 1
+        line = '[{n:d}] {edition}: {status} ({missing:d} missing, ' \
+            '{extra:d} extra, {mismatched:d} mismatched)'.format(
+                n=print_progress.n, **result)
+        if result['status'] == 'failed':
+            line += ' ' + result['error']
+        elif result['status'] == 'planned':
+            line += ' ~{0:.0f} s'.format(result['plan']['estimated_seconds'])
+        print(line)
+    print_progress.n = 0
+
+    with keeper_app.app_context():
+        summary = tasks.resync_editions(max_workers=max_workers,
+                                        dry_run=dry_run,
+                                        product_slug=product_slug,
+                                        progress=print_progress)
+
+    elapsed = max(summary['elapsed_seconds'], 1e-6)
+    print('{editions:d} editions: {matched:d} matched, '
+          '{resynced:d} resynced, {planned:d} planned, '
+          '{failed:d} failed'.format(**summary))
+    print('{0:d} objects ({1:.1f} MB) in {2:.1f} s: {3:.1f} objects/s, '
+          '{4:.2f} MB/s'.format(
+              summary['objects_copied'],
+              summary['bytes_copied'] / 1e6,
+              elapsed,
+              summary['objects_copied'] / elapsed,
+              summary['bytes_copied'] / 1e6 / elapsed))
+
+
+@manager.option('--repair', dest='repair', action='store_true',
+                default=False)
+@manager.option('-p', '--product', dest='product_slug', default=None,
+                help='Only verify editions of this product')
+@manager.option('-j', '--jobs', dest='max_workers', type=int, default=4,
+                help='Number of editions to verify concurrently')
+def verify_editions(max_workers, product_slug, repair):
+    """Verify the S3 content of editions against their builds.
+
+    ::
+        run.py verify_editions -j 8 --repair
+
+    Editions are compared with their builds by key, size and ETag. With
+    ``--repair``, only the missing and mismatched objects are copied, and
+    extra objects are deleted.
+    """
+    from app import tasks
+
+    def print_progress(result):
+        print('{edition}: {status}'.format(**result))
+        if result['status'] == 'failed':
+            print('  ' + result['error'])
+            return
+        for k in ('missing', 'extra', 'mismatched'):
+            for path in result['diff'][k]:
+                print('  {0} {1}'.format(k, path))
+
+    with keeper_app.app_context():
+        summary = tasks.verify_editions(max_workers=max_workers,
+                                        repair=repair,
+                                        product_slug=product_slug,
+                                        progress=print_progress)
+
+    print('{editions:d} editions: {matched:d} matched, '
+          '{mismatched:d} mismatched, {repaired:d} repaired, '
+          '{failed:d} failed in {elapsed_seconds:.1f} s'.format(**summary))
+
+
+@manager.option('--fastly-rate-limit', dest='rate_limit', type=int,
+                default=1000, help='Fastly API requests per hour')
+@manager.option('--failure-rate', dest='failure_rate', type=float,
+                default=0., help='Fraction of requests that fail')
+@manager.option('--latency', dest='latency', type=float, default=0.,
+                help='Seconds added to each response')
+@manager.option('--zone', dest='zones', action='append', default=None,
+                help='Route 53 hosted zone (repeatable; default lsst.io.)')
+@manager.option('--dasher-port', dest='dasher_port', type=int, default=8903)
+@manager.option('--route53-port', dest='route53_port', type=int,
+                default=8902)
+@manager.option('--fastly-port', dest='fastly_port', type=int, default=8901)
+@manager.option('--host', dest='host', default='127.0.0.1')
+def standins(host, fastly_port, route53_port, dasher_port, zones, latency,
+             failure_rate, rate_limit):
+    """Run stand-in servers for Fastly, Route 53 and LTD Dasher.
+
+    ::
+        run.py standins --latency 0.05 --failure-rate 0.01
+
+    The servers run until interrupted. Point another LTD Keeper at them with
+    the printed environment variables to exercise the publishing path
+    offline (see `app.standins`).
+    """
+    from app.standins import FastlyStandin, Route53Standin, DasherStandin
+
+    kwargs = {'host': host, 'latency': latency, 'failure_rate': failure_rate}
+    servers = [
+        FastlyStandin(port=fastly_port, rate_limit=rate_limit, **kwargs),
+        Route53Standin(port=route53_port, zones=zones or ['lsst.io.'],
+                       **kwargs),
+        DasherStandin(port=dasher_port, **kwargs)]
+    for server in servers:
+        server.start()
+    fastly, route53, dasher = servers
+    print('export LTD_KEEPER_FASTLY_API_ROOT={0}'.format(fastly.url))
+    print('export LTD_KEEPER_ROUTE53_ENDPOINT_URL={0}'.format(route53.url))
+    print('export LTD_DASHER_URL={0}'.format(dasher.url))
+    try:
+        while True:
+            time.sleep(60.)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.stop()
+    print('Fastly: {0:d} requests, Route 53: {1:d} requests, '
+          'LTD Dasher: {2:d} requests'.format(
+              *[len(server.requests) for server in servers]))
+
+
+@manager.option('--dry-run', dest='dry_run', action='store_true',
+                default=False)
+@manager.option('--depth', dest='depth', type=int, default=4,
+                help='Rows of the count-min sketch')
+@manager.option('--width', dest='width', type=int, default=2 ** 16,
+                help='Counters per row of the count-min sketch')
+@manager.option('-k', '--top', dest='top_k', type=int, default=100,
+                help='Number of pages to keep per edition')
+@manager.option('filenames', nargs='+', help='Access log files')
+def analyze_logs(filenames, top_k, width, depth, dry_run):
+    """Find the most requested pages of editions in CDN access logs.
+
+    ::
+        run.py analyze_logs -k 50 logs/2017-06-*.json.gz
+
+    Logs are JSON lines files, optionally gzip-compressed, with a record per
+    request. Requests are counted in bounded memory with a count-min sketch
+    (see `app.accesslogs`), and the ``top`` pages of each edition are saved
+    as its hot paths, which are warmed after the edition is rebuilt. With
+    ``--dry-run``, the hot paths are printed and not saved.
+    """
+    from app import accesslogs
+
+    with keeper_app.app_context():
+        summary = accesslogs.analyze_logs(filenames, top_k=top_k,
+                                          width=width, depth=depth,
+                                          dry_run=dry_run)
+
+    for edition, items in sorted(summary['editions'].items()):
+        print(edition)
+        if dry_run:
+            for path, hits in items:
+                print('  {0:8d} /{1}'.format(hits, path))
+    print('{requests:d} requests counted, {skipped:d} skipped; hot paths '
+          'of {0:d} editions {1}'.format(
+              len(summary['editions']),
+              'found' if dry_run else 'saved',
+              **summary))
+
+
 if __name__ == '__main__':
     manager.run()
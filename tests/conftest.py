@@ -120,3 +120,35 @@ def deprecate_build_client(empty_app):
     r = _c.get('/token')
     client = TestClient(empty_app, r.json['token'])
     return client
+
+
+@pytest.fixture
+def fastly_standin(request):
+    """A running stand-in for the Fastly API (see `app.standins`)."""
+    from app.standins import FastlyStandin
+
+    server = FastlyStandin().start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+@pytest.fixture
+def route53_standin(request):
+    """A running stand-in for the Route 53 API, serving the
+    ``ltdtest.local.`` zone (see `app.standins`).
+    """
+    from app.standins import Route53Standin
+
+    server = Route53Standin(zones=['ltdtest.local.']).start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+@pytest.fixture
+def dasher_standin(request):
+    """A running stand-in for LTD Dasher (see `app.standins`)."""
+    from app.standins import DasherStandin
+
+    server = DasherStandin().start()
+    request.addfinalizer(server.stop)
+    return server
@@ -0,0 +1,82 @@
+"""Tests for the accesslogs module (CDN access log analysis)."""
+
+import gzip
+import json
+
+from app import accesslogs
+from app.models import Edition, HotPath
+
+
+def test_count_min_sketch():
+    sketch = accesslogs.CountMinSketch(width=64, depth=4)
+    for i in range(100):
+        sketch.add('key{0:d}'.format(i % 10))
+    assert sketch.add('key0', count=5) >= 15
+    # Estimates never undercount
+    for i in range(1, 10):
+        assert sketch.estimate('key{0:d}'.format(i)) >= 10
+    assert sketch.total == 105
+
+
+def test_top_k():
+    top = accesslogs.TopK(2)
+    top.update('a', 1)
+    top.update('b', 1)
+    top.update('c', 1)
+    assert top.items() == [('a', 1), ('b', 1)]
+    top.update('c', 3)
+    top.update('b', 2)
+    assert top.items() == [('c', 3), ('b', 2)]
+
+
+def test_resolve():
+    analyzer = accesslogs.LogAnalyzer({'pipelines.lsst.io': 'pipelines'},
+                                      {('pipelines', 'main'),
+                                       ('pipelines', '1')})
+    assert analyzer.resolve('pipelines.lsst.io', '/') \
+        == ('pipelines', 'main', '')
+    assert analyzer.resolve('pipelines.lsst.io', '/a/index.html') \
+        == ('pipelines', 'main', 'a/index.html')
+    assert analyzer.resolve('pipelines.lsst.io', '/v/1/a/') \
+        == ('pipelines', '1', 'a/')
+    assert analyzer.resolve('pipelines.lsst.io', '/builds/1/') is None
+    # Untracked editions aren't counted
+    assert analyzer.resolve('pipelines.lsst.io', '/v/2/a/') is None
+    assert analyzer.resolve('other.lsst.io', '/') is None
+
+
+def test_analyze_logs(client, tmpdir):
+    r = client.post('/products/',
+                    {'slug': 'pipelines',
+                     'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+                     'title': 'LSST Science Pipelines',
+                     'root_domain': 'lsst.io',
+                     'root_fastly_domain': 'global.ssl.fastly.net',
+                     'bucket_name': 'bucket-name'})
+    assert r.status == 201
+
+    records = [{'host': 'pipelines.lsst.io', 'url': '/a.html'}] * 3
+    records += [{'host': 'pipelines.lsst.io', 'url': '/?q=1'}] * 2
+    records += [{'host': 'pipelines.lsst.io', 'url': '/b.html',
+                 'status': 404}]
+    records += [{'host': 'pipelines.lsst.io', 'url': '/v/1/a.html'}]
+    records += [{'host': 'other.lsst.io', 'url': '/a.html'}]
+    filename = str(tmpdir.join('access.json.gz'))
+    with gzip.open(filename, 'wt') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.write('not json\n')
+
+    summary = accesslogs.analyze_logs([filename], top_k=10, dry_run=True)
+    # Edition 1 doesn't exist, so its request isn't counted
+    assert summary['requests'] == 5
+    assert summary['skipped'] == 3
+    assert summary['editions'] == {'pipelines/main': [('a.html', 3),
+                                                      ('', 2)]}
+    assert HotPath.query.count() == 0
+
+    accesslogs.analyze_logs([filename], top_k=1)
+    accesslogs.analyze_logs([filename], top_k=1)
+    edition = Edition.query.filter(Edition.slug == 'main').one()
+    assert [(h.path, h.hits, h.rank) for h in edition.hot_paths] \
+        == [('a.html', 3, 0)]
@@ -0,0 +1,384 @@
+"""Tests for app.archives and archive uploads of builds."""
+
+from datetime import datetime
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from app import archives, s3
+from app.exceptions import S3Error, ValidationError
+
+
+class FakeS3Client(object):
+    """Records put_object calls and multipart uploads, and serves
+    get_object calls.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.parts = []
+        self.calls = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        self.objects[Key] = dict(kwargs, Body=Body)
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key]['Body']),
+                'LastModified': datetime(2017, 1, 2, 3, 4, 6)}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.calls.append('create')
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts.append(Body)
+        return {'ETag': 'etag-{0:d}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        self.calls.append('complete')
+        self.objects[Key] = {'Body': b''.join(self.parts)}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append('abort')
+
+
+def _make_tar(files, mode='w:gz'):
+    fileobj = io.BytesIO()
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    fileobj.seek(0)
+    return fileobj
+
+
+def _make_zip(files):
+    fileobj = io.BytesIO()
+    with zipfile.ZipFile(fileobj, 'w') as zf:
+        zf.writestr('subdir/', b'')
+        for name, content in files.items():
+            zf.writestr(name, content)
+    fileobj.seek(0)
+    return fileobj
+
+
+FILES = {'index.html': b'<html></html>',
+         './subdir/index.html': b'<html>sub</html>',
+         '_static/style.css': b'body {}'}
+
+
+def test_guess_archive_format():
+    assert archives.guess_archive_format('build.zip') == 'zip'
+    assert archives.guess_archive_format('build.tar') == 'tar'
+    assert archives.guess_archive_format('uploads/b1.TAR.GZ') == 'tar'
+    assert archives.guess_archive_format('build.tgz') == 'tar'
+    with pytest.raises(ValidationError):
+        archives.guess_archive_format('build.rar')
+
+
+@pytest.mark.parametrize('archive_format,fileobj', [
+    ('tar', _make_tar(FILES)),
+    ('zip', _make_zip(FILES))])
+def test_iter_archive_members(archive_format, fileobj):
+    members = {path: (member.read(), size)
+               for path, member, size
+               in archives.iter_archive_members(fileobj, archive_format)}
+    assert members == {'index.html': (b'<html></html>', 13),
+                       'subdir/index.html': (b'<html>sub</html>', 16),
+                       '_static/style.css': (b'body {}', 7)}
+
+
+@pytest.mark.parametrize('name', ['../escape.html', '/etc/passwd',
+                                  'a/../../escape.html'])
+def test_iter_archive_members_rejects_paths(name):
+    fileobj = _make_tar({name: b'x'})
+    with pytest.raises(ValidationError):
+        list(archives.iter_archive_members(fileobj, 'tar'))
+
+
+def test_iter_invalid_archive():
+    with pytest.raises(ValidationError):
+        list(archives.iter_archive_members(io.BytesIO(b'not a zip'), 'zip'))
+    with pytest.raises(ValidationError):
+        list(archives.iter_archive_members(io.BytesIO(b'not a tar'), 'tar'))
+
+
+def test_upload_members():
+    client = FakeS3Client()
+    n_objects, n_bytes = archives._upload_members(
+        client, _make_tar(FILES, mode='w|'), 'tar', 'bucket', 'prod/builds/1',
+        {'surrogate-key': 'abc'}, 'no-cache', 2)
+    assert n_objects == 3
+    assert n_bytes == 36
+    assert set(client.objects) == {'prod/builds/1/index.html',
+                                   'prod/builds/1/subdir/index.html',
+                                   'prod/builds/1/_static/style.css'}
+    obj = client.objects['prod/builds/1/_static/style.css']
+    assert obj['Body'] == b'body {}'
+    assert obj['ContentType'] == 'text/css'
+    assert obj['ACL'] == 'public-read'
+    assert obj['CacheControl'] == 'no-cache'
+    assert obj['Metadata'] == {'surrogate-key': 'abc'}
+    assert client.objects['prod/builds/1/index.html']['ContentType'] \
+        == 'text/html'
+
+
+def test_new_build_with_archive(client, monkeypatch):
+    uploads = []
+
+    def upload_archive(fileobj, archive_format, bucket_name, root_path,
+                       **kwargs):
+        uploads.append((fileobj.read(), archive_format, bucket_name,
+                        root_path, kwargs['surrogate_key']))
+        return 1, 10
+
+    def upload_bucket_archive(archive_key, bucket_name, root_path, **kwargs):
+        uploads.append((archive_key, bucket_name, root_path))
+        return 1, 10
+
+    monkeypatch.setattr(archives, 'upload_archive', upload_archive)
+    monkeypatch.setattr(archives, 'upload_bucket_archive',
+                        upload_bucket_archive)
+    # the auto-created edition is rebuilt from the uploaded builds
+    monkeypatch.setattr(s3, 'copy_directory', lambda *args, **kwargs: 0)
+    monkeypatch.setattr(s3, 'list_directory', lambda *args, **kwargs: {})
+
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    assert r.status == 201
+
+    # Archive uploads need S3
+    b0 = {'slug': 'b0',
+          'git_refs': ['master'],
+          'archive_key': 'uploads/b0.tar.gz'}
+    with pytest.raises(ValidationError):
+        client.post('/products/pipelines/builds/', b0)
+    # The build is removed rather than left without its files
+    r = client.get('/products/pipelines/builds/')
+    assert len(r.json['builds']) == 0
+
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+
+    # Reference an archive in the bucket
+    b1 = {'slug': 'b1',
+          'git_refs': ['master'],
+          'archive_key': 'uploads/b1.tar.gz'}
+    r = client.post('/products/pipelines/builds/', b1)
+    assert r.status == 201
+    assert r.json['uploaded'] is True
+    assert uploads[-1] == ('uploads/b1.tar.gz', 'bucket-name',
+                           'pipelines/builds/b1')
+
+    # Upload an archive as multipart form data
+    b2 = {'slug': 'b2', 'git_refs': ['master']}
+    data = {'build': json.dumps(b2),
+            'archive': (io.BytesIO(b'archive'), 'b2.zip')}
+    headers = {'Authorization': client.auth}
+    with client.app.test_request_context('/products/pipelines/builds/',
+                                         method='POST', data=data,
+                                         headers=headers):
+        rv = client.app.make_response(client.app.full_dispatch_request())
+    assert rv.status_code == 201
+    assert json.loads(rv.data.decode('utf-8'))['uploaded'] is True
+    assert uploads[-1][:4] == (b'archive', 'zip', 'bucket-name',
+                               'pipelines/builds/b2')
+
+    # A failed upload deletes the build and its uploaded objects
+    deletes = []
+
+    def failing_upload_bucket_archive(archive_key, bucket_name, root_path,
+                                      **kwargs):
+        raise ValidationError('Invalid archive')
+
+    monkeypatch.setattr(archives, 'upload_bucket_archive',
+                        failing_upload_bucket_archive)
+    monkeypatch.setattr(s3, 'delete_directory',
+                        lambda bucket_name, root_path, **kwargs:
+                        deletes.append((bucket_name, root_path)))
+    b3 = {'slug': 'b3',
+          'git_refs': ['master'],
+          'archive_key': 'uploads/b3.tar.gz'}
+    with pytest.raises(ValidationError):
+        client.post('/products/pipelines/builds/', b3)
+    assert deletes == [('bucket-name', 'pipelines/builds/b3')]
+    r = client.get('/products/pipelines/builds/')
+    assert len(r.json['builds']) == 2
+
+    # A failed rebuild of the editions after the archive is ingested keeps
+    # the build, and PATCH retries the rebuilds
+    del deletes[:]
+    monkeypatch.setattr(archives, 'upload_bucket_archive',
+                        upload_bucket_archive)
+
+    def failing_copy_directory(*args, **kwargs):
+        raise S3Error('Copy failed')
+
+    monkeypatch.setattr(s3, 'copy_directory', failing_copy_directory)
+    monkeypatch.setattr(s3, 'sync_directory', failing_copy_directory)
+    # b4 has new content, so the edition is rebuilt
+    monkeypatch.setattr(s3, 'list_directory',
+                        lambda bucket_name, root_path, **kwargs:
+                        {'index.html': {'size': 1, 'etag': root_path}})
+    b4 = {'slug': 'b4',
+          'git_refs': ['master'],
+          'archive_key': 'uploads/b4.tar.gz'}
+    with pytest.raises(S3Error):
+        client.post('/products/pipelines/builds/', b4)
+    assert deletes == []
+    r = client.get('/products/pipelines/builds/')
+    assert len(r.json['builds']) == 3
+    b4_url = r.json['builds'][-1]
+    assert client.get(b4_url).json['uploaded'] is False
+
+    monkeypatch.setattr(s3, 'copy_directory', lambda *args, **kwargs: 0)
+    monkeypatch.setattr(s3, 'sync_directory',
+                        lambda *args, **kwargs: {'copied': [], 'deleted': [],
+                                                 'redirected': []})
+    r = client.patch(b4_url, {'uploaded': True})
+    assert r.status == 200
+    assert client.get(b4_url).json['uploaded'] is True
+
+
+@pytest.mark.parametrize('part_size', [10 ** 6, 100])
+def test_iter_zip_archive(part_size):
+    client = FakeS3Client()
+    for path, content in FILES.items():
+        client.put_object('bucket', 'prod/v/main/' + path,
+                          io.BytesIO(content))
+    uploader = archives._MultipartUpload(client, 'bucket', 'archive.zip',
+                                         part_size)
+
+    chunks = archives._iter_zip_archive(client, 'bucket', 'prod/v/main/',
+                                        sorted(FILES), uploader, 2)
+    data = b''.join(chunks)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert sorted(zf.namelist()) == sorted(FILES)
+        for path, content in FILES.items():
+            assert zf.read(path) == content
+        assert zf.getinfo('index.html').date_time == (2017, 1, 2, 3, 4, 6)
+
+    # The archive is saved as it's streamed
+    assert client.objects['archive.zip']['Body'] == data
+    if part_size == 100:
+        assert client.calls == ['create', 'complete']
+        assert len(client.parts) > 1
+    else:
+        assert client.calls == []
+
+
+@pytest.mark.parametrize('zip64_limit', [archives._ZIP64_LIMIT, 0])
+def test_zip_stream_writer(monkeypatch, zip64_limit):
+    # With a limit of 0, every record needs ZIP64 fields
+    monkeypatch.setattr(archives, '_ZIP64_LIMIT', zip64_limit)
+    output = archives._ZipOutput()
+    writer = archives._ZipStreamWriter(output)
+    contents = {'a.html': b'a' * 1000, 'd/\u00e9.txt': b'', 'b.bin': b'b'}
+    for name, content in sorted(contents.items()):
+        writer.start_member(name, (2017, 1, 2, 3, 4, 5))
+        writer.write(content[:10])
+        writer.write(content[10:])
+        writer.end_member()
+    writer.close()
+
+    with zipfile.ZipFile(io.BytesIO(output.drain())) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == sorted(contents)
+        for name, content in contents.items():
+            assert zf.read(name) == content
+        assert zf.getinfo('a.html').date_time == (2017, 1, 2, 3, 4, 4)
+
+
+def test_iter_zip_archive_abort():
+    client = FakeS3Client()
+    content = os.urandom(300000)
+    for path in ('a.bin', 'b.bin'):
+        client.put_object('bucket', 'prod/v/main/' + path,
+                          io.BytesIO(content))
+    uploader = archives._MultipartUpload(client, 'bucket', 'archive.zip',
+                                         1024)
+
+    chunks = archives._iter_zip_archive(client, 'bucket', 'prod/v/main/',
+                                        ['a.bin', 'b.bin'], uploader, 2)
+    next(chunks)
+    chunks.close()
+    assert client.calls == ['create', 'abort']
+    assert 'archive.zip' not in client.objects
+
+
+def test_get_archives(client, monkeypatch):
+    streams = []
+    saved_archives = {}
+
+    def stream_zip_archive(bucket_name, root_path, *args, archive_key=None,
+                           **kwargs):
+        streams.append((root_path, archive_key))
+        saved_archives[archive_key] = 'https://example.com/' + archive_key
+        return iter([b'PK', b'zip'])
+
+    monkeypatch.setattr(archives, 'stream_zip_archive', stream_zip_archive)
+    monkeypatch.setattr(archives, 'get_archive_url',
+                        lambda bucket_name, archive_key, *args, **kwargs:
+                        saved_archives.get(archive_key))
+    monkeypatch.setattr(s3, 'copy_directory', lambda *args, **kwargs: 0)
+    monkeypatch.setattr(s3, 'list_directory',
+                        lambda *args, **kwargs:
+                        {'index.html': {'size': 1, 'etag': 'a'}})
+
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    assert r.status == 201
+    r = client.post('/products/pipelines/builds/',
+                    {'slug': 'b1', 'git_refs': ['master']})
+    build_url = r.json['self_url']
+    build_id = build_url.rsplit('/', 1)[-1]
+
+    def get(url):
+        with client.app.test_request_context(url):
+            return client.app.make_response(
+                client.app.full_dispatch_request())
+
+    # Archives need S3 and an uploaded build
+    assert get('/builds/{0}/archive'.format(build_id)).status_code == 400
+
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+    assert get('/builds/{0}/archive'.format(build_id)).status_code == 400
+    client.patch(build_url, {'uploaded': True})
+
+    # The first download is streamed, and saved by fingerprint
+    rv = get('/builds/{0}/archive'.format(build_id))
+    assert rv.status_code == 200
+    assert rv.data == b'PKzip'
+    assert rv.headers['Content-Type'] == 'application/zip'
+    assert rv.headers['Content-Disposition'] \
+        == 'attachment; filename="pipelines-b1.zip"'
+    root_path, archive_key = streams[-1]
+    assert root_path == 'pipelines/builds/b1'
+    assert archive_key.startswith('pipelines/_archives/')
+
+    # The edition serves the same content, so it reuses the saved archive
+    r = client.get('/products/pipelines/editions/')
+    edition_id = r.json['editions'][0].rsplit('/', 1)[-1]
+    rv = get('/editions/{0}/archive'.format(edition_id))
+    assert rv.status_code == 302
+    assert rv.headers['Location'] == 'https://example.com/' + archive_key
+    assert len(streams) == 1
@@ -2,7 +2,7 @@
 
 import pytest
 from werkzeug.exceptions import NotFound
-from app.exceptions import ValidationError
+from app.exceptions import ValidationError, S3Error
 
 
 def test_builds(client):
@@ -204,3 +204,163 @@ def test_delete_build_auth_builduploader_client(upload_build_client):
 def test_delete_build_auth_builddeprecator_client(deprecate_build_client):
     with pytest.raises(NotFound):
         deprecate_build_client.delete('/builds/1', {'foo': 'bar'})
+
+
+def test_new_build_presigned_uploads(client, monkeypatch):
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    assert r.status == 201
+
+    # Presigned uploads need S3
+    b1 = {'slug': 'b1',
+          'git_refs': ['master'],
+          'presigned_post': True,
+          'upload_files': [{'path': 'index.html', 'size': 10}]}
+    with pytest.raises(ValidationError):
+        client.post('/products/pipelines/builds/', b1)
+
+    # Presigning is offline, so fake credentials work
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+    monkeypatch.setitem(client.app.config, 'AWS_REGION', 'us-east-1')
+
+    r = client.post('/products/pipelines/builds/', b1)
+    assert r.status == 201
+    assert r.json['upload']['expires_in'] == 3600
+    assert r.json['upload']['post']['fields']['key'] == \
+        'pipelines/builds/b1/${filename}'
+    assert len(r.json['upload']['files']) == 1
+    assert r.json['upload']['files'][0]['key'] == \
+        'pipelines/builds/b1/index.html'
+
+    # Paths outside the build's directory are rejected
+    b2 = {'slug': 'b2',
+          'git_refs': ['master'],
+          'upload_files': [{'path': '../b1/index.html', 'size': 10}]}
+    with pytest.raises(ValidationError):
+        client.post('/products/pipelines/builds/', b2)
+    r = client.get('/products/pipelines/builds/')
+    assert len(r.json['builds']) == 1
+
+    # Builds are removed if their uploads can't be created
+    def presign_uploads(*args, **kwargs):
+        raise S3Error('presigning failed')
+
+    with monkeypatch.context() as m:
+        m.setattr('app.s3.presign_uploads', presign_uploads)
+        with pytest.raises(S3Error):
+            client.post('/products/pipelines/builds/',
+                        {'slug': 'b2', 'git_refs': ['master'],
+                         'upload_files': [{'path': 'index.html',
+                                           'size': 10}]})
+    r = client.get('/products/pipelines/builds/')
+    assert len(r.json['builds']) == 1
+
+    # Builds without presigned uploads don't have an upload field
+    r = client.post('/products/pipelines/builds/',
+                    {'slug': 'b3', 'git_refs': ['master']})
+    assert 'upload' not in r.json
+
+
+def test_build_manifest(client, monkeypatch):
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    assert r.status == 201
+
+    copies = []
+
+    def list_directory(bucket_name, root_path, **kwargs):
+        assert root_path == 'pipelines/builds/b1'
+        return {'index.html': {'size': 1, 'etag': 'aaa'},
+                'changed.html': {'size': 1, 'etag': 'bbb'},
+                'removed.html': {'size': 1, 'etag': 'ccc'}}
+
+    def copy_objects(bucket_name, src_path, dest_path, paths, **kwargs):
+        copies.append((src_path, dest_path, paths, kwargs['surrogate_key']))
+        return len(paths)
+
+    monkeypatch.setattr('app.s3.list_directory', list_directory)
+    monkeypatch.setattr('app.s3.copy_objects', copy_objects)
+    monkeypatch.setattr('app.s3.copy_directory', lambda *a, **k: 0)
+
+    files = [{'path': 'index.html', 'md5': 'AAA'},
+             {'path': 'changed.html', 'md5': 'xxx'},
+             {'path': 'new.html', 'md5': 'yyy'}]
+
+    # Without a base build, everything is uploaded
+    r = client.post('/products/pipelines/builds/',
+                    {'slug': 'b1', 'git_refs': ['master']})
+    b1_url = r.headers['Location']
+    r = client.post(b1_url + '/manifest', {'files': files})
+    assert r.status == 200
+    assert r.json == {'base_build_url': None,
+                      'objects_copied': 0,
+                      'upload_paths': ['changed.html', 'index.html',
+                                       'new.html']}
+    client.patch(b1_url, {'uploaded': True})
+
+    # Manifests can't be applied to uploaded builds
+    with pytest.raises(ValidationError):
+        client.post(b1_url + '/manifest', {'files': files})
+
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+
+    # Builds of other refs don't have a base build
+    r = client.post('/products/pipelines/builds/',
+                    {'slug': 'other', 'git_refs': ['other']})
+    r = client.post(r.headers['Location'] + '/manifest', {'files': files})
+    assert r.json['base_build_url'] is None
+    assert len(copies) == 0
+
+    # Unchanged files are copied from the previous build of the same refs
+    r = client.post('/products/pipelines/builds/',
+                    {'slug': 'b2', 'git_refs': ['master']})
+    surrogate_key = r.json['surrogate_key']
+    r = client.post(r.headers['Location'] + '/manifest', {'files': files})
+    assert r.status == 200
+    assert r.json == {'base_build_url': b1_url,
+                      'objects_copied': 1,
+                      'upload_paths': ['changed.html', 'new.html']}
+    assert copies == [('pipelines/builds/b1', 'pipelines/builds/b2',
+                       ['index.html'], surrogate_key)]
+
+    # Invalid manifests
+    with pytest.raises(ValidationError):
+        client.post('/builds/3/manifest', None)
+    with pytest.raises(ValidationError):
+        client.post('/builds/3/manifest', [{'path': 'index.html'}])
+    with pytest.raises(ValidationError):
+        client.post('/builds/3/manifest', {'foo': 'bar'})
+    with pytest.raises(ValidationError):
+        client.post('/builds/3/manifest',
+                    {'files': [{'path': '../b1/index.html', 'md5': 'a'}]})
+
+
+# Authorizion tests: POST /builds/<id>/manifest ==============================
+# Only the build-upload auth'd client should get in
+
+
+def test_post_build_manifest_auth_anon(anon_client):
+    r = anon_client.post('/builds/1/manifest', {'files': []})
+    assert r.status == 401
+
+
+def test_post_build_manifest_auth_product_client(product_client):
+    r = product_client.post('/builds/1/manifest', {'files': []})
+    assert r.status == 403
+
+
+def test_post_build_manifest_auth_builduploader_client(upload_build_client):
+    with pytest.raises(NotFound):
+        upload_build_client.post('/builds/1/manifest', {'files': []})
@@ -0,0 +1,72 @@
+"""Tests for the app.cachepolicy module."""
+
+import pytest
+
+from app.cachepolicy import CachePolicy, DEFAULT_RULES, get_cache_policy
+
+
+@pytest.mark.parametrize('path,content_type,expected', [
+    ('index.html', 'text/html', ('max-age=60', 'max-age=31536000')),
+    ('api/index.html', 'text/html; charset=utf-8',
+     ('max-age=60', 'max-age=31536000')),
+    ('_static/app.css', 'text/css', ('no-cache', 'max-age=86400')),
+    ('_static/img/logo.png', 'image/png', ('no-cache', 'max-age=86400')),
+    ('data.csv', 'text/csv', ('no-cache', 'max-age=31536000')),
+])
+def test_cache_policy(path, content_type, expected):
+    policy = CachePolicy(
+        [{'content_type': 'text/html', 'cache_control': 'max-age=60'},
+         {'path': '_static/*', 'surrogate_control': 'max-age=86400'}],
+        cache_control='no-cache',
+        surrogate_control='max-age=31536000')
+    assert policy.get_headers(path, content_type) == expected
+
+
+def test_cache_policy_all_fields_match():
+    policy = CachePolicy(
+        [{'path': '*.js', 'content_type': 'text/*',
+          'cache_control': 'max-age=60'}],
+        cache_control='no-cache')
+    assert policy.get_headers('app.js', 'text/javascript') \
+        == ('max-age=60', None)
+    assert policy.get_headers('app.js', 'application/javascript') \
+        == ('no-cache', None)
+    assert policy.get_headers('app.js') == ('no-cache', None)
+
+
+def test_default_rules():
+    policy = CachePolicy(DEFAULT_RULES, cache_control='no-cache')
+    immutable = 'public, max-age=31536000, immutable'
+    assert policy.get_headers('_static/main.3f2a9c1d.js')[0] == immutable
+    assert policy.get_headers('fonts/icons-0123456789abcdef.woff2')[0] \
+        == immutable
+    assert policy.get_headers('_static/main.js')[0] == 'no-cache'
+    assert policy.get_headers('figures/plot-20190401.png')[0] == 'no-cache'
+    assert policy.get_headers('_static/v-12345678.js')[0] == 'no-cache'
+    assert policy.get_headers('index.html')[0] == 'no-cache'
+    assert policy.get_headers('index.html', 'text/html')[0] \
+        == 'public, max-age=60'
+
+
+def test_cache_policy_digest():
+    rules = [{'path': '*.html', 'cache_control': 'max-age=60'}]
+    policy = CachePolicy(rules, cache_control='no-cache')
+    assert policy.digest == CachePolicy(list(rules),
+                                        cache_control='no-cache').digest
+    assert policy.digest != CachePolicy(rules).digest
+    assert policy.digest != CachePolicy(DEFAULT_RULES,
+                                        cache_control='no-cache').digest
+
+
+def test_get_cache_policy():
+    policy = get_cache_policy({'CACHE_CONTROL_RULES': None},
+                              cache_control='no-cache')
+    assert policy.get_headers('main.3f2a9c1d.css')[0] \
+        == 'public, max-age=31536000, immutable'
+
+    policy = get_cache_policy(
+        {'CACHE_CONTROL_RULES': [{'path_regex': r'\.html$',
+                                  'cache_control': 'max-age=60'}]},
+        cache_control='no-cache')
+    assert policy.get_headers('main.3f2a9c1d.css')[0] == 'no-cache'
+    assert policy.get_headers('a/b.html')[0] == 'max-age=60'
@@ -2,7 +2,8 @@
 
 import pytest
 from werkzeug.exceptions import NotFound
-from app.exceptions import ValidationError
+from app.exceptions import FastlyError, ValidationError
+from app.models import Edition
 
 
 def test_editions(client):
@@ -85,6 +86,472 @@ def test_editions(client):
                          'title': 'Main'})
 
 
+def test_edition_rebuild_dry_run(client, monkeypatch):
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    assert r.status == 201
+
+    r = client.post('/products/pipelines/builds/', {'git_refs': ['master']})
+    b1_url = r.json['self_url']
+    client.patch(b1_url, {'uploaded': True})
+    r = client.post('/products/pipelines/builds/', {'git_refs': ['v1']})
+    b2_url = r.json['self_url']
+    client.patch(b2_url, {'uploaded': True})
+
+    r = client.get('/products/pipelines/editions/')
+    e1_url = r.json['editions'][0]
+    r = client.get(e1_url)
+    assert r.json['build_url'] == b1_url
+    date_rebuilt = r.json['date_rebuilt']
+
+    # Fake the S3 listings
+    listings = {
+        'pipelines/builds/2': {'index.html': {'size': 100, 'etag': 'a'},
+                               'a/index.html': {'size': 50, 'etag': 'b'}},
+        'pipelines/v/main': {'index.html': {'size': 10, 'etag': 'c'}},
+    }
+
+    def list_directory(bucket_name, root_path, *args, **kwargs):
+        assert bucket_name == 'bucket-name'
+        return listings[root_path]
+
+    monkeypatch.setattr('app.s3.list_directory', list_directory)
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+
+    r = client.patch(e1_url + '?dry_run=true', {'build_url': b2_url})
+    assert r.status == 200
+    assert r.json['dry_run'] is True
+    plan = r.json['rebuild']
+    assert plan['edition'] == 'main'
+    assert plan['build'] == '2'
+    assert plan['strategy'] == 'copy'
+    assert plan['requests']['copy'] == 2
+    assert plan['requests']['delete'] == 1
+    assert plan['bytes_copied'] == 150
+    assert plan['bytes_deleted'] == 10
+    assert plan['estimated_seconds'] > 0
+
+    # Nothing was changed
+    r = client.get(e1_url)
+    assert r.json['build_url'] == b1_url
+    assert r.json['date_rebuilt'] == date_rebuilt
+
+    # Dry runs without a build change have no rebuild plan
+    r = client.patch(e1_url + '?dry_run=true', {'title': 'New title'})
+    assert r.json['rebuild'] is None
+    r = client.get(e1_url)
+    assert r.json['title'] == 'Latest'
+
+    # Patches need a JSON object body
+    with pytest.raises(ValidationError):
+        client.patch(e1_url + '?dry_run=true', None)
+    with pytest.raises(ValidationError):
+        client.patch(e1_url, None)
+    with pytest.raises(ValidationError):
+        client.patch(e1_url, ['title'])
+
+
+def test_edition_rebuild_same_fingerprint(client, monkeypatch):
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    assert r.status == 201
+
+    listings = {
+        'pipelines/builds/1': {'index.html': {'size': 100, 'etag': 'a'}},
+        'pipelines/builds/2': {'index.html': {'size': 100, 'etag': 'a'}},
+        'pipelines/builds/3': {'index.html': {'size': 100, 'etag': 'b'}},
+        'pipelines/builds/4': {'index.html': {'size': 100, 'etag': 'c'}},
+        'pipelines/v/main': {'index.html': {'size': 100, 'etag': 'b'},
+                             'c.html': {'size': 10, 'etag': 'd'}},
+    }
+    copies = []
+    purges = []
+
+    def list_directory(bucket_name, root_path, *args, **kwargs):
+        return listings[root_path]
+
+    def copy_directory(bucket_name, src_path, dest_path, **kwargs):
+        copies.append(('copy', src_path))
+
+    def sync_directory(bucket_name, src_path, dest_path, **kwargs):
+        copies.append(('sync', src_path))
+        return {'copied': ['index.html', 'a/index.html', 'a/b.css'],
+                'deleted': ['c.html'],
+                'redirected': ['d']}
+
+    monkeypatch.setattr('app.s3.list_directory', list_directory)
+    monkeypatch.setattr('app.s3.copy_directory', copy_directory)
+    monkeypatch.setattr('app.s3.sync_directory', sync_directory)
+    monkeypatch.setattr('app.fastly.FastlyService.purge_keys',
+                        lambda self, keys, soft=False:
+                        purges.extend(keys) or {})
+    monkeypatch.setattr('app.fastly.FastlyService.purge_url',
+                        lambda self, url, soft=False: purges.append(url))
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+    monkeypatch.setitem(client.app.config, 'FASTLY_SERVICE_ID', 'service')
+    monkeypatch.setitem(client.app.config, 'FASTLY_KEY', 'key')
+
+    build_urls = []
+    for _ in range(4):
+        r = client.post('/products/pipelines/builds/',
+                        {'git_refs': ['master']})
+        build_urls.append(r.json['self_url'])
+    r = client.get('/products/pipelines/editions/')
+    e1_url = r.json['editions'][0]
+    surrogate_key = client.get(e1_url).json['surrogate_key']
+    product_key = client.get('/products/pipelines').json['surrogate_key']
+
+    # The first rebuild is a full copy and surrogate key purge, batched
+    # with the product's key
+    client.patch(build_urls[0], {'uploaded': True})
+    assert copies == [('copy', 'pipelines/builds/1')]
+    assert purges == [surrogate_key, product_key]
+
+    # A re-run of the same build only updates the build pointer
+    client.patch(build_urls[1], {'uploaded': True})
+    assert copies == [('copy', 'pipelines/builds/1')]
+    assert len(purges) == 2
+    r = client.get(e1_url)
+    assert r.json['build_url'] == build_urls[1]
+
+    # Dry runs plan the same path: no requests for the same content
+    r = client.patch(e1_url + '?dry_run=true', {'build_url': build_urls[0]})
+    plan = r.json['rebuild']
+    assert plan['strategy'] == 'skip'
+    assert sum(plan['requests'].values()) == 0
+    assert plan['estimated_seconds'] == 0.
+
+    # Changed content is synced, and only the changed URLs are purged
+    client.patch(build_urls[2], {'uploaded': True})
+    assert copies[-1] == ('sync', 'pipelines/builds/3')
+
+    # Dry runs of changed content plan a sync of the objects that differ
+    r = client.patch(e1_url + '?dry_run=true', {'build_url': build_urls[0]})
+    plan = r.json['rebuild']
+    assert plan['strategy'] == 'sync'
+    assert plan['requests'] == {'list': 2, 'head': 1, 'copy': 1,
+                                'delete': 1, 'put': 0}
+    assert plan['bytes_copied'] == 100
+    assert plan['bytes_deleted'] == 10
+    assert purges[2:] == ['https://pipelines.lsst.io/index.html',
+                          'https://pipelines.lsst.io/',
+                          'https://pipelines.lsst.io/a/index.html',
+                          'https://pipelines.lsst.io/a/',
+                          'https://pipelines.lsst.io/a/b.css',
+                          'https://pipelines.lsst.io/c.html',
+                          'https://pipelines.lsst.io/d',
+                          product_key]
+
+    # Failed URL purges are logged, and don't fail the rebuild
+    def failing_purge_url(self, url, soft=False):
+        raise FastlyError('error')
+
+    monkeypatch.setattr('app.fastly.FastlyService.purge_url',
+                        failing_purge_url)
+    r = client.patch(e1_url, {'build_url': build_urls[0]})
+    assert r.status == 200
+    assert client.get(e1_url).json['build_url'] == build_urls[0]
+    assert purges[-1] == product_key
+
+    # Above the threshold, the surrogate key is purged instead
+    monkeypatch.setitem(client.app.config, 'FASTLY_PURGE_URL_THRESHOLD', 5)
+    del purges[:]
+    client.patch(build_urls[3], {'uploaded': True})
+    assert copies[-1] == ('sync', 'pipelines/builds/4')
+    assert purges == [surrogate_key, product_key]
+
+    # Changed cache rules set new headers, so even the same content is
+    # copied again rather than skipped or synced
+    monkeypatch.setitem(client.app.config, 'CACHE_CONTROL_RULES', [])
+    r = client.patch(e1_url + '?dry_run=true', {'build_url': build_urls[3]})
+    assert r.json['rebuild']['strategy'] == 'copy'
+    client.patch(e1_url, {'build_url': build_urls[3]})
+    assert copies[-1] == ('copy', 'pipelines/builds/4')
+    client.patch(e1_url, {'build_url': build_urls[3]})
+    assert len([c for c in copies if c[1] == 'pipelines/builds/4']) == 2
+
+
+def test_edition_soft_purge(client, monkeypatch):
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name',
+         'soft_purge': True}
+    r = client.post('/products/', p)
+    assert r.status == 201
+    r = client.get(r.headers['Location'])
+    assert r.json['soft_purge'] is True
+    product_key = r.json['surrogate_key']
+
+    purges = []
+    monkeypatch.setattr('app.fastly.FastlyService.purge_keys',
+                        lambda self, keys, soft=False:
+                        purges.append((keys, soft)) or {})
+    monkeypatch.setitem(client.app.config, 'FASTLY_SERVICE_ID', 'service')
+    monkeypatch.setitem(client.app.config, 'FASTLY_KEY', 'key')
+
+    r = client.post('/products/pipelines/builds/', {'git_refs': ['master']})
+    b1_url = r.json['self_url']
+    r = client.post('/products/pipelines/builds/', {'git_refs': ['master']})
+    b2_url = r.json['self_url']
+    r = client.get('/products/pipelines/editions/')
+    e1_url = r.json['editions'][0]
+
+    # Editions use their product's setting by default
+    client.patch(b1_url, {'uploaded': True})
+    r = client.get(e1_url)
+    assert r.json['soft_purge'] is None
+    assert purges == [([r.json['surrogate_key'], product_key], True)]
+
+    # ... unless they override it
+    del purges[:]
+    client.patch(b2_url, {'uploaded': True})
+    client.patch(e1_url, {'soft_purge': False, 'build_url': b1_url})
+    assert purges[-2:] == [([r.json['surrogate_key']], False),
+                           ([product_key], True)]
+
+    # Soft purged editions can be served stale while Fastly refreshes them
+    edition = Edition.query.filter(Edition.slug == 'main').one()
+    assert edition.get_s3_copy_args()['surrogate_control'] == \
+        'max-age=31536000'
+    client.patch(e1_url, {'soft_purge': None})
+    assert edition.get_s3_copy_args()['surrogate_control'] == \
+        'max-age=31536000, stale-while-revalidate=60, stale-if-error=86400'
+    client.patch(e1_url, {'soft_purge': False})
+
+    # Deprecating an edition purges it along with the product's dashboards
+    del purges[:]
+    client.delete(e1_url)
+    assert purges == [([r.json['surrogate_key'], product_key], False)]
+
+    with pytest.raises(ValidationError):
+        client.patch(e1_url, {'soft_purge': 'yes'})
+
+
+def test_edition_aliases(client, monkeypatch):
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    assert r.status == 201
+
+    listings = {
+        'pipelines/builds/1': {'index.html': {'size': 100, 'etag': 'a'}},
+        'pipelines/builds/2': {'index.html': {'size': 100, 'etag': 'b'}},
+    }
+    calls = []
+    purges = []
+
+    monkeypatch.setattr('app.s3.list_directory',
+                        lambda bucket, root_path, *args, **kwargs:
+                        listings[root_path])
+    monkeypatch.setattr('app.s3.copy_directory',
+                        lambda bucket_name, src_path, dest_path, **kwargs:
+                        calls.append(('copy', src_path, dest_path)))
+    monkeypatch.setattr('app.s3.sync_directory',
+                        lambda bucket_name, src_path, dest_path, **kwargs:
+                        calls.append(('sync', src_path, dest_path))
+                        or {'copied': ['index.html'], 'deleted': [],
+                            'redirected': []})
+    monkeypatch.setattr('app.s3.delete_directory',
+                        lambda bucket, root_path, *args, **kwargs:
+                        calls.append(('delete', root_path)))
+    monkeypatch.setattr('app.s3.put_alias_marker',
+                        lambda bucket, root_path, target_path,
+                        *args, **kwargs:
+                        calls.append(('alias', root_path, target_path)))
+    routes = []
+    monkeypatch.setattr('app.fastly.FastlyService.set_dictionary_item',
+                        lambda self, dictionary_id, key, value:
+                        routes.append(('set', key, value)))
+    monkeypatch.setattr('app.fastly.FastlyService.delete_dictionary_item',
+                        lambda self, dictionary_id, key:
+                        routes.append(('delete', key)))
+    monkeypatch.setitem(client.app.config, 'FASTLY_ALIAS_DICTIONARY_ID',
+                        'aliases')
+    monkeypatch.setattr('app.fastly.FastlyService.purge_keys',
+                        lambda self, keys, soft=False:
+                        purges.extend(keys) or {})
+    monkeypatch.setattr('app.fastly.FastlyService.purge_url',
+                        lambda self, url, soft=False: purges.append(url))
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+    monkeypatch.setitem(client.app.config, 'FASTLY_SERVICE_ID', 'service')
+    monkeypatch.setitem(client.app.config, 'FASTLY_KEY', 'key')
+
+    r = client.post('/products/pipelines/builds/', {'git_refs': ['master']})
+    b1_url = r.json['self_url']
+    client.patch(b1_url, {'uploaded': True})
+    r = client.get('/products/pipelines/editions/')
+    main_url = r.json['editions'][0]
+
+    # Create an alias of the main edition
+    del calls[:]
+    r = client.post('/products/pipelines/editions/',
+                    {'slug': 'latest',
+                     'title': 'Latest',
+                     'alias_of_url': main_url})
+    assert r.status == 201
+    alias_url = r.headers['Location']
+    assert calls == [('delete', 'pipelines/v/latest'),
+                     ('alias', 'pipelines/v/latest', 'pipelines/v/main')]
+    assert routes == [('set', 'pipelines/v/latest', 'pipelines/v/main')]
+    r = client.get(alias_url)
+    assert r.json['alias_of_url'] == main_url
+    assert r.json['build_url'] == b1_url
+    assert r.json['tracked_refs'] is None
+    alias_key = r.json['surrogate_key']
+    assert purges[-2] == alias_key
+
+    # Rebuilding the target updates and purges the alias without any S3
+    # requests for the alias
+    del calls[:]
+    del purges[:]
+    r = client.post('/products/pipelines/builds/', {'git_refs': ['master']})
+    b2_url = r.json['self_url']
+    client.patch(b2_url, {'uploaded': True})
+    assert calls == [('sync', 'pipelines/builds/2', 'pipelines/v/main')]
+    assert len(routes) == 1
+    assert purges[:4] == ['https://pipelines.lsst.io/index.html',
+                          'https://pipelines.lsst.io/',
+                          'https://pipelines.lsst.io/v/latest/index.html',
+                          'https://pipelines.lsst.io/v/latest/']
+    assert purges[4:] == [client.get('/products/pipelines')
+                          .json['surrogate_key']]
+    r = client.get(alias_url)
+    assert r.json['build_url'] == b2_url
+
+    # Aliases can't be verified, or be the target of aliases
+    with pytest.raises(ValidationError):
+        client.post(alias_url + '/verify', {})
+    with pytest.raises(ValidationError):
+        client.post('/products/pipelines/editions/',
+                    {'slug': 'alias2',
+                     'title': 'Alias of an alias',
+                     'alias_of_url': alias_url})
+    with pytest.raises(ValidationError):
+        client.patch(alias_url, {'alias_of_url': alias_url})
+
+    # Renaming the target updates the alias' route
+    del calls[:]
+    del purges[:]
+    r = client.post('/products/pipelines/editions/',
+                    {'slug': 'target',
+                     'title': 'Target',
+                     'tracked_refs': ['target'],
+                     'build_url': b2_url})
+    target_url = r.headers['Location']
+    client.patch(alias_url, {'alias_of_url': target_url})
+    del calls[:]
+    client.patch(target_url, {'slug': 'renamed'})
+    assert calls[-1] == ('alias', 'pipelines/v/latest', 'pipelines/v/renamed')
+    assert routes[-1] == ('set', 'pipelines/v/latest', 'pipelines/v/renamed')
+    assert alias_key in purges
+
+    # Renaming the alias moves its marker object and route
+    del calls[:]
+    del routes[:]
+    client.patch(alias_url, {'slug': 'newest'})
+    assert calls == [('alias', 'pipelines/v/newest', 'pipelines/v/renamed'),
+                     ('delete', 'pipelines/v/latest')]
+    assert routes == [('set', 'pipelines/v/newest', 'pipelines/v/renamed'),
+                      ('delete', 'pipelines/v/latest')]
+    client.patch(alias_url, {'slug': 'latest'})
+
+    # Deprecating the target gives the alias a copy of its build
+    del calls[:]
+    client.delete(target_url)
+    r = client.get(alias_url)
+    assert r.json['alias_of_url'] is None
+    assert r.json['build_url'] == b2_url
+    assert calls == [('copy', 'pipelines/builds/2', 'pipelines/v/latest')]
+    assert routes[-1] == ('delete', 'pipelines/v/latest')
+
+    # Rebuilding an alias turns it into a regular edition
+    client.patch(alias_url, {'alias_of_url': main_url})
+    del calls[:]
+    del routes[:]
+    r = client.patch(alias_url, {'build_url': b1_url})
+    assert r.json['alias_of_url'] is None
+    assert calls == [('copy', 'pipelines/builds/1', 'pipelines/v/latest')]
+    assert routes == [('delete', 'pipelines/v/latest')]
+
+
+def test_verify_edition(client, monkeypatch):
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    product_url = r.headers['Location']
+
+    # Editions without builds can't be verified
+    r = client.get(product_url + '/editions/')
+    e1_url = r.json['editions'][0]
+    with pytest.raises(ValidationError):
+        client.post(e1_url + '/verify', {})
+
+    r = client.post('/products/pipelines/builds/', {'git_refs': ['master']})
+    b1_url = r.json['self_url']
+    client.patch(b1_url, {'uploaded': True})
+
+    listings = {
+        'pipelines/builds/1': {'index.html': {'size': 100, 'etag': 'a'}},
+        'pipelines/v/main': {'index.html': {'size': 100, 'etag': 'a'}},
+    }
+    repairs = []
+
+    def list_directory(bucket_name, root_path, *args, **kwargs):
+        return listings[root_path]
+
+    def repair_edition(edition_id):
+        repairs.append(edition_id)
+
+    monkeypatch.setattr('app.s3.list_directory', list_directory)
+    monkeypatch.setattr('app.api_v1.editions.repair_edition', repair_edition)
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+
+    r = client.post(e1_url + '/verify', {'repair': True})
+    assert r.status == 200
+    assert r.json['ok'] is True
+    assert r.json['repair_queued'] is False
+    assert r.json['build_url'] == b1_url
+    assert r.json['missing'] == []
+
+    # Break the edition
+    listings['pipelines/v/main'] = {'extra.html': {'size': 1, 'etag': 'b'}}
+    r = client.post(e1_url + '/verify', {})
+    assert r.json['ok'] is False
+    assert r.json['missing'] == ['index.html']
+    assert r.json['extra'] == ['extra.html']
+    assert r.json['repair_queued'] is False
+    assert len(repairs) == 0
+
+    r = client.post(e1_url + '/verify', {'repair': True})
+    assert r.json['repair_queued'] is True
+    assert repairs == [1]
+
+
 # Authorizion tests: POST /products/<slug>/editions/ =========================
 # Only the full admin client and the edition-authorized client should get in
 
@@ -170,3 +637,22 @@ def test_delete_edition_auth_builduploader_client(upload_build_client):
 def test_delete_edition_auth_builddeprecator_client(deprecate_build_client):
     r = deprecate_build_client.delete('/editions/1')
     assert r.status == 403
+
+
+# Authorizion tests: POST /editions/<id>/verify ==============================
+# Only the full admin client and the edition-authorized client should get in
+
+
+def test_verify_edition_auth_anon(anon_client):
+    r = anon_client.post('/editions/1/verify', {})
+    assert r.status == 401
+
+
+def test_verify_edition_auth_product_client(product_client):
+    r = product_client.post('/editions/1/verify', {})
+    assert r.status == 403
+
+
+def test_verify_edition_auth_edition_client(edition_client):
+    with pytest.raises(NotFound):
+        edition_client.post('/editions/1/verify', {})
@@ -1,8 +1,10 @@
+import json
 import uuid
 import pytest
 import responses
 
-from app.fastly import FastlyService
+from app.fastly import (FastlyService, get_rate_limits,
+                        raise_for_failed_purges)
 from app.exceptions import FastlyError
 
 
@@ -47,3 +49,105 @@ def test_purge_key_fail():
     assert responses.calls[0].request.url == url
     assert responses.calls[0].request.headers['Fastly-Key'] == api_key
     assert responses.calls[0].request.headers['Accept'] == 'application/json'
+
+
+@responses.activate
+def test_purge_keys(monkeypatch):
+    service_id = 'SU1Z0isxPaozGVKXdv0eY'
+    api_key = 'd3cafb4dde4dbeef'
+    url = 'https://api.fastly.com/service/{0}/purge'.format(service_id)
+    monkeypatch.setattr(FastlyService, 'MAX_PURGE_KEYS', 2)
+
+    def callback(request):
+        keys = request.headers['Surrogate-Key'].split(' ')
+        if 'bad' in keys:
+            return (500, {}, '{"msg": "error"}')
+        return (200, {}, json.dumps({key: 'id-' + key for key in keys}))
+
+    responses.add_callback(responses.POST, url, callback=callback)
+
+    client = FastlyService(service_id, api_key)
+
+    results = client.purge_keys(['a', 'b', 'a', 'c', 'bad'])
+    # Keys are purged in batches, once each
+    assert len(responses.calls) == 2
+    assert responses.calls[0].request.headers['Surrogate-Key'] == 'a b'
+    assert responses.calls[0].request.headers['Fastly-Key'] == api_key
+    assert responses.calls[1].request.headers['Surrogate-Key'] == 'c bad'
+    assert list(results.keys()) == ['a', 'b', 'c', 'bad']
+    assert results['a'] == {'purged': True, 'purge_id': 'id-a',
+                            'error': None}
+    # A failed batch fails each of its keys
+    assert results['c']['purged'] is False
+    assert results['bad']['purged'] is False
+    assert '500' in results['bad']['error']
+    assert 'Fastly-Soft-Purge' not in responses.calls[0].request.headers
+
+    client.purge_keys(['a'], soft=True)
+    assert responses.calls[2].request.headers['Fastly-Soft-Purge'] == '1'
+
+    with pytest.raises(FastlyError):
+        raise_for_failed_purges(results)
+    raise_for_failed_purges({'a': results['a']})
+
+
+@responses.activate
+def test_purge_url():
+    service_id = 'SU1Z0isxPaozGVKXdv0eY'
+    api_key = 'd3cafb4dde4dbeef'
+
+    url = 'https://api.fastly.com/purge/pipelines.lsst.io/v/v1/index.html'
+
+    # Mock the API call and response
+    responses.add(responses.POST, url, status=200)
+
+    client = FastlyService(service_id, api_key)
+
+    client.purge_url('https://pipelines.lsst.io/v/v1/index.html')
+    assert len(responses.calls) == 1
+    assert responses.calls[0].request.url == url
+    assert responses.calls[0].request.headers['Fastly-Key'] == api_key
+
+
+@responses.activate
+def test_purge_all_rate_limit():
+    service_id = 'SU1Z0isxPaozGVKXdv0eY-all'
+    api_key = 'd3cafb4dde4dbeef'
+    url = 'https://api.fastly.com/service/{0}/purge_all'.format(service_id)
+
+    responses.add(responses.POST, url, status=200, json={'status': 'ok'},
+                  headers={'Fastly-RateLimit-Remaining': '999',
+                           'Fastly-RateLimit-Reset': '1452032384'})
+
+    client = FastlyService(service_id, api_key)
+    assert client.rate_limit is None
+
+    client.purge_all()
+    assert len(responses.calls) == 1
+    assert responses.calls[0].request.headers['Fastly-Key'] == api_key
+    # The API budget is tracked from the response headers
+    assert client.rate_limit['remaining'] == 999
+    assert client.rate_limit['reset'] == 1452032384.
+    assert get_rate_limits()[service_id]['remaining'] == 999
+
+
+@responses.activate
+def test_dictionary_items():
+    service_id = 'SU1Z0isxPaozGVKXdv0eY'
+    api_key = 'd3cafb4dde4dbeef'
+    url = 'https://api.fastly.com/service/{0}/dictionary/aliases/item/' \
+        'pipelines%2Fv%2Flatest'.format(service_id)
+
+    responses.add(responses.PUT, url, status=200, json={})
+    responses.add(responses.DELETE, url, status=404, json={})
+
+    client = FastlyService(service_id, api_key)
+    client.set_dictionary_item('aliases', 'pipelines/v/latest',
+                               'pipelines/v/main')
+    assert responses.calls[0].request.body == \
+        'item_value=pipelines%2Fv%2Fmain'
+    assert responses.calls[0].request.headers['Fastly-Key'] == api_key
+
+    # Deleting an item that doesn't exist isn't an error
+    client.delete_dictionary_item('aliases', 'pipelines/v/latest')
+    assert len(responses.calls) == 2
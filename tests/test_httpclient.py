@@ -0,0 +1,40 @@
+"""Tests for the httpclient module (shared HTTP sessions)."""
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import httpclient
+
+
+def test_get_session():
+    httpclient.configure(pool_maxsize=4, timeout=(1., 2.))
+    session = httpclient.get_session('fastly')
+    assert httpclient.get_session('fastly') is session
+    assert httpclient.get_session('dasher') is not session
+    adapter = session.get_adapter('https://api.fastly.com')
+    assert isinstance(adapter, HTTPAdapter)
+    assert adapter._pool_maxsize == 4
+
+    # Configuring replaces the sessions
+    httpclient.configure(timeout=5.)
+    assert httpclient.get_session('fastly') is not session
+    assert httpclient.get_session('fastly').timeout == 5.
+
+
+def test_session_timeout(monkeypatch):
+    timeouts = []
+
+    def record_send(self, request, **kwargs):
+        timeouts.append(kwargs.get('timeout'))
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, 'send', record_send)
+    httpclient.configure(timeout=(1., 2.))
+    session = httpclient.get_session('test')
+    session.post('https://example.test/')
+    session.post('https://example.test/', timeout=10.)
+    assert timeouts == [(1., 2.), 10.]
+    httpclient.close_sessions()
@@ -0,0 +1,56 @@
+"""Tests for the jobs module (background job execution)."""
+
+import threading
+
+import pytest
+
+from app import db
+from app.jobs import submit, submit_later
+from app.models import User
+
+
+def _count_users():
+    return (threading.current_thread().name, User.query.count())
+
+
+def _fail():
+    raise RuntimeError('job failed')
+
+
+def test_eager_job(empty_app):
+    future = submit(_count_users)
+    thread_name, n_users = future.result()
+    assert thread_name == threading.current_thread().name
+    assert n_users == 5
+
+
+def test_background_job(empty_app):
+    empty_app.config['JOBS_EAGER'] = False
+
+    future = submit(_count_users)
+    thread_name, n_users = future.result(timeout=10)
+    assert thread_name != threading.current_thread().name
+    assert n_users == 5
+
+    future = submit(_fail)
+    with pytest.raises(RuntimeError):
+        future.result(timeout=10)
+
+    # The request's session is untouched by the jobs
+    assert db.session.query(User).count() == 5
+
+
+def test_submit_later(empty_app):
+    empty_app.config['JOBS_EAGER'] = False
+    done = threading.Event()
+    results = []
+
+    def job():
+        results.append(_count_users())
+        done.set()
+
+    timer = submit_later(0.01, job)
+    assert done.wait(timeout=10)
+    timer.join(timeout=10)
+    assert results[0][0] != timer.name
+    assert results[0][1] == 5
@@ -0,0 +1,46 @@
+"""Tests for the metrics module and the /metrics route."""
+
+import pytest
+
+from app.metrics import Registry
+
+
+def test_registry_render():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests.')
+    requests.inc(method='GET')
+    requests.inc(2, method='GET')
+    requests.inc(method='POST')
+    registry.gauge('queue_length', 'Queue length.',
+                   callback=lambda: [({'queue': 'a"b'}, 3)])
+
+    assert requests.get(method='GET') == 3
+    assert requests.get(method='PUT') == 0
+    assert registry.gauge('queue_length', 'Queue length.')\
+        .get(queue='a"b') == 3
+    assert registry.render() == (
+        '# HELP requests_total Requests.\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{method="GET"} 3.0\n'
+        'requests_total{method="POST"} 1.0\n'
+        '# HELP queue_length Queue length.\n'
+        '# TYPE queue_length gauge\n'
+        'queue_length{queue="a\\"b"} 3.0\n')
+
+
+def test_registry_kind_conflict():
+    registry = Registry()
+    gauge = registry.gauge('size', 'Size.')
+    gauge.set(5)
+    assert registry.gauge('size', 'Size.') is gauge
+    assert gauge.get() == 5
+    with pytest.raises(ValueError):
+        registry.counter('size', 'Size.')
+
+
+def test_get_metrics(client):
+    r = client.app.test_client().get('/metrics')
+    assert r.status_code == 200
+    assert r.headers['Content-Type'].startswith('text/plain')
+    assert '# TYPE ltd_keeper_mirror_lag_seconds gauge' \
+        in r.get_data(as_text=True)
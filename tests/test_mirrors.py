@@ -0,0 +1,94 @@
+"""Tests for the mirrors module (replication to mirror buckets)."""
+
+import pytest
+
+from app import mirrors
+
+
+def test_replicate(empty_app, monkeypatch):
+    empty_app.config['S3_MIRROR_BUCKETS'] = ['mirror-1', 'mirror-2']
+    calls = []
+
+    def mirror_directory(src_bucket_name, dest_bucket_name, root_path,
+                         *args, copied_paths=None, deleted_paths=None,
+                         **kwargs):
+        calls.append((dest_bucket_name, root_path, copied_paths,
+                      deleted_paths))
+        if dest_bucket_name == 'mirror-2' and root_path == 'p/v/fail':
+            raise RuntimeError('mirror failed')
+        return {'copied': copied_paths or ['a.html', 'b.html'],
+                'deleted': deleted_paths or []}
+
+    monkeypatch.setattr('app.s3.mirror_directory', mirror_directory)
+    copied = mirrors._objects_copied.get(mirror='mirror-1')
+    failures = mirrors._failures.get(mirror='mirror-2')
+
+    mirrors.replicate('bucket', 'p/v/main', copied_paths=['index.html'],
+                      deleted_paths=['old.html'])
+    assert calls == [('mirror-1', 'p/v/main', ['index.html'], ['old.html']),
+                     ('mirror-2', 'p/v/main', ['index.html'], ['old.html'])]
+    assert mirrors._objects_copied.get(mirror='mirror-1') == copied + 1
+
+    # After a failure, the next replication to that mirror is a full sync
+    del calls[:]
+    mirrors.replicate('bucket', 'p/v/fail', copied_paths=['index.html'])
+    assert mirrors._failures.get(mirror='mirror-2') == failures + 1
+    mirrors.replicate('bucket', 'p/v/fail', copied_paths=['index.html'])
+    assert calls[2:] == [('mirror-1', 'p/v/fail', ['index.html'], None),
+                         ('mirror-2', 'p/v/fail', None, None)]
+
+    status = mirrors.get_status()
+    assert status['mirror-1']['pending'] == 0
+    assert status['mirror-1']['lag'] == 0.
+    assert status['mirror-1']['last_replicated'] is not None
+
+
+def test_replicate_unconfigured(empty_app, monkeypatch):
+    calls = []
+    monkeypatch.setattr('app.s3.mirror_directory',
+                        lambda *args, **kwargs: calls.append(args))
+    mirrors.replicate('bucket', 'p/v/main')
+    assert calls == []
+
+
+def test_drain_queue_error(empty_app, monkeypatch):
+    empty_app.config['S3_MIRROR_BUCKETS'] = ['mirror-stuck']
+    # A malformed result fails outside of the replication's error handling
+    monkeypatch.setattr('app.s3.mirror_directory',
+                        lambda *args, **kwargs: {})
+    with pytest.raises(KeyError):
+        mirrors.replicate('bucket', 'p/v/main')
+
+    # The queue isn't left draining, so later replications still run,
+    # after the one that was interrupted
+    calls = []
+    monkeypatch.setattr('app.s3.mirror_directory',
+                        lambda *args, **kwargs: calls.append(args) or
+                        {'copied': [], 'deleted': []})
+    mirrors.replicate('bucket', 'p/v/main')
+    assert [args[2] for args in calls] == ['p/v/main', 'p/v/main']
+    assert mirrors.get_status()['mirror-stuck']['pending'] == 0
+
+
+def test_get_mirror_region(empty_app, monkeypatch):
+    config = empty_app.config
+    config['S3_BUCKET_REGIONS'] = {'mirror-eu': 'eu-west-1'}
+    config['S3_DISCOVER_BUCKET_REGIONS'] = True
+    calls = []
+
+    def get_bucket_region(bucket_name, *args, **kwargs):
+        calls.append(bucket_name)
+        return 'ap-south-1'
+
+    monkeypatch.setattr('app.s3.get_bucket_region', get_bucket_region)
+    monkeypatch.setattr('app.mirrors._regions', {})
+
+    assert mirrors.get_mirror_region('mirror-eu', config) == 'eu-west-1'
+    # Discovered regions are cached
+    assert mirrors.get_mirror_region('mirror-ap', config) == 'ap-south-1'
+    assert mirrors.get_mirror_region('mirror-ap', config) == 'ap-south-1'
+    assert calls == ['mirror-ap']
+
+    config['S3_DISCOVER_BUCKET_REGIONS'] = False
+    config['AWS_REGION'] = 'us-west-2'
+    assert mirrors.get_mirror_region('mirror-us', config) == 'us-west-2'
@@ -0,0 +1,83 @@
+"""Tests for the probes module (purge verification)."""
+
+import responses
+
+from app import probes
+
+
+def _target():
+    return {'edition': 'pipelines/1',
+            'url': 'https://pipelines.lsst.io/v/1/index.html',
+            'bucket_name': 'bucket',
+            'key': 'pipelines/v/1/index.html',
+            'aws_args': {'aws_access_key_id': 'id',
+                         'aws_secret_access_key': 'secret'},
+            'rebuilt': 1000.}
+
+
+@responses.activate
+def test_verify_edition(monkeypatch):
+    clock = {'now': 1002.}
+
+    def sleep(seconds):
+        clock['now'] += seconds
+
+    monkeypatch.setattr('app.probes.time.time', lambda: clock['now'])
+    # Run the rescheduled canary requests right away
+    monkeypatch.setattr(
+        'app.jobs.submit_later',
+        lambda delay, func, *args, **kwargs:
+        sleep(delay) or func(*args, **kwargs))
+    monkeypatch.setattr('app.s3.get_object_etag',
+                        lambda bucket_name, key, **kwargs: 'new')
+    url = 'https://pipelines.lsst.io/v/1/index.html'
+    # Fastly serves the old build, then the new one
+    responses.add(responses.GET, url, headers={'ETag': '"old"'})
+    responses.add(responses.GET, url, headers={'ETag': '"old"'})
+    responses.add(responses.GET, url, headers={'ETag': 'W/"new"'})
+    fresh = probes._verifications.get(result='fresh')
+
+    probes.verify_edition(_target(), timeout=60., interval=5.)
+    status = probes.get_status()['pipelines/1']
+    assert status['result'] == 'fresh'
+    assert status['requests'] == 3
+    assert status['time_to_fresh'] == 12.
+    assert probes._verifications.get(result='fresh') == fresh + 1
+
+    # The edition is stale if the canary never matches
+    monkeypatch.setattr('app.s3.get_object_etag',
+                        lambda bucket_name, key, **kwargs: 'newer')
+    status = probes.verify_edition(_target(), timeout=0., interval=5.)
+    assert status['result'] == 'stale'
+    assert status['time_to_fresh'] is None
+
+
+def test_verify_edition_missing_canary(monkeypatch):
+    monkeypatch.setattr('app.s3.get_object_etag',
+                        lambda bucket_name, key, **kwargs: None)
+    status = probes.verify_edition(_target())
+    assert status['result'] == 'error'
+    assert status['requests'] == 0
+
+
+def test_schedule_disabled(empty_app, monkeypatch):
+    jobs = []
+    monkeypatch.setattr('app.jobs.submit',
+                        lambda func, *args, **kwargs: jobs.append(func))
+    monkeypatch.setitem(empty_app.config, 'FASTLY_SERVICE_ID', 'service')
+    monkeypatch.setitem(empty_app.config, 'FASTLY_KEY', 'key')
+    probes.schedule(None)
+    assert jobs == []
+
+
+def test_check_canary_superseded(monkeypatch):
+    status = {'url': _target()['url'], 'etag': 'new', 'result': None,
+              'requests': 0, 'rebuilt': 1000., 'finished': None,
+              'time_to_fresh': None}
+    requests = []
+    monkeypatch.setattr('app.probes._is_fresh',
+                        lambda session, url, etag: requests.append(url))
+    # Verifications of earlier rebuilds stop
+    monkeypatch.setitem(probes._status, 'pipelines/1', dict(status))
+    assert probes.check_canary(_target(), status) == status
+    assert requests == []
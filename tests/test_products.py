@@ -3,6 +3,7 @@
 import pytest
 from werkzeug.exceptions import NotFound
 from app.exceptions import ValidationError
+from app.models import Product
 
 
 def test_products(client):
@@ -112,6 +113,147 @@ def test_products(client):
         assert r.json[k] == v
 
 
+def test_product_bucket_region(client, monkeypatch):
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    product_url = r.headers['Location']
+    r = client.get(product_url)
+    assert r.json['bucket_region'] is None
+    assert r.json['bucket_endpoint_url'] is None
+
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+    monkeypatch.setitem(client.app.config, 'S3_DISCOVER_BUCKET_REGIONS',
+                        True)
+    calls = []
+
+    def get_bucket_region(bucket_name, *args, **kwargs):
+        calls.append(bucket_name)
+        return 'eu-west-1'
+
+    monkeypatch.setattr('app.s3.get_bucket_region', get_bucket_region)
+
+    # The region is discovered once, and saved
+    product = Product.query.filter_by(slug='pipelines').one()
+    aws_args = product.get_aws_args()
+    assert aws_args['aws_region_name'] == 'eu-west-1'
+    assert aws_args['aws_endpoint_url'] is None
+    assert product.get_bucket_region() == 'eu-west-1'
+    assert calls == ['bucket-name']
+    r = client.get(product_url)
+    assert r.json['bucket_region'] == 'eu-west-1'
+
+    # Regions and endpoints can be set for S3-compatible stores
+    r = client.patch(product_url,
+                     {'bucket_region': 'us-west-2',
+                      'bucket_endpoint_url': 'https://s3.example.test'})
+    assert r.status == 200
+    product = Product.query.filter_by(slug='pipelines').one()
+    assert product.get_aws_args() == {
+        'aws_access_key_id': 'id',
+        'aws_secret_access_key': 'secret',
+        'aws_region_name': 'us-west-2',
+        'aws_endpoint_url': 'https://s3.example.test'}
+    assert calls == ['bucket-name']
+
+
+def test_delete_product(client):
+    p1 = {'slug': 'pipelines',
+          'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+          'title': 'LSST Science Pipelines',
+          'root_domain': 'lsst.io',
+          'root_fastly_domain': 'global.ssl.fastly.net',
+          'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p1)
+    assert r.status == 201
+    p1_url = r.headers['Location']
+
+    p2 = dict(p1)
+    p2['slug'] = 'qserv'
+    r = client.post('/products/', p2)
+    assert r.status == 201
+    p2_url = r.headers['Location']
+
+    # Add builds, which also get tracked by the main edition
+    for slug in ('pipelines', 'qserv'):
+        r = client.post('/products/{0}/builds/'.format(slug),
+                        {'git_refs': ['master']})
+        assert r.status == 201
+        r = client.patch(r.json['self_url'], {'uploaded': True})
+        assert r.status == 200
+
+    # Delete the product (jobs are eager in the test harness)
+    r = client.delete('/products/pipelines')
+    assert r.status == 202
+
+    r = client.get('/products/')
+    assert r.json['products'] == [p2_url]
+    with pytest.raises(NotFound):
+        client.get(p1_url)
+    with pytest.raises(NotFound):
+        client.get('/builds/1')
+    with pytest.raises(NotFound):
+        client.get('/editions/1')
+
+    # The other product is intact
+    r = client.get('/products/qserv/builds/')
+    assert len(r.json['builds']) == 1
+    r = client.get('/products/qserv/editions/')
+    assert len(r.json['editions']) == 1
+    r = client.get(r.json['editions'][0])
+    assert r.json['build_url'] is not None
+
+
+def test_delete_product_s3(client, monkeypatch):
+    config = client.app.config
+    monkeypatch.setitem(config, 'AWS_ID', 'id')
+    monkeypatch.setitem(config, 'AWS_SECRET', 'secret')
+    monkeypatch.setitem(config, 'DISABLE_ROUTE53', True)
+    monkeypatch.setitem(config, 'S3_MIRROR_BUCKETS', ['mirror'])
+    calls = []
+    monkeypatch.setattr('app.s3.delete_directory',
+                        lambda bucket_name, root_path, **kwargs:
+                        calls.append(('delete', bucket_name, root_path)))
+    monkeypatch.setattr('app.mirrors.replicate',
+                        lambda bucket_name, root_path, **kwargs:
+                        calls.append(('replicate', bucket_name, root_path)))
+    monkeypatch.setattr('app.purges.enqueue',
+                        lambda keys, **kwargs: calls.append(('purge', keys)))
+
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    client.post('/products/', p)
+    client.post('/products/', dict(p, slug='qserv', bucket_name=None))
+    product_key = client.get('/products/pipelines').json['surrogate_key']
+    r = client.get('/products/pipelines/editions/')
+    edition_key = client.get(r.json['editions'][0]).json['surrogate_key']
+
+    # The deletion of the product's directory is mirrored, and its keys
+    # are queued for a purge that's planned against the Fastly API budget
+    del calls[:]
+    r = client.delete('/products/pipelines')
+    assert r.status == 202
+    assert calls == [('delete', 'bucket-name', 'pipelines/'),
+                     ('replicate', 'bucket-name', 'pipelines'),
+                     ('purge', [product_key, edition_key])]
+
+    # Products without a bucket don't have a directory
+    del calls[:]
+    r = client.delete('/products/qserv')
+    assert r.status == 202
+    assert [call[0] for call in calls] == ['purge']
+    assert client.get('/products/').json['products'] == []
+
+
 # Authorizion tests: POST /products/ =========================================
 # Only the full admin client and the product-authorized client should get in
 
@@ -192,3 +334,27 @@ def test_post_dashboard_auth_edition_client(edition_client):
 def test_post_dashboard_auth_builduploader_client(upload_build_client):
     r = upload_build_client.post('/products/test/dashboard', {})
     assert r.status == 403
+
+
+# Authorizion tests: DELETE /products/<slug> =================================
+# Only the full admin client and the product-authorized client should get in
+
+
+def test_delete_product_auth_anon(anon_client):
+    r = anon_client.delete('/products/test')
+    assert r.status == 401
+
+
+def test_delete_product_auth_product_client(product_client):
+    with pytest.raises(NotFound):
+        product_client.delete('/products/test')
+
+
+def test_delete_product_auth_edition_client(edition_client):
+    r = edition_client.delete('/products/test')
+    assert r.status == 403
+
+
+def test_delete_product_auth_builduploader_client(upload_build_client):
+    r = upload_build_client.delete('/products/test')
+    assert r.status == 403
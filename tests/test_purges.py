@@ -0,0 +1,271 @@
+"""Tests for the purges module (debounced Fastly purges)."""
+
+import pytest
+
+from app import purges
+from app.exceptions import FastlyError
+
+
+@pytest.fixture
+def purge_queue(empty_app, monkeypatch):
+    """Configure Fastly and a debounce window, with a fake clock, and
+    record bulk purges and scheduled jobs.
+    """
+    config = empty_app.config
+    monkeypatch.setitem(config, 'FASTLY_SERVICE_ID', 'service')
+    monkeypatch.setitem(config, 'FASTLY_KEY', 'key')
+    monkeypatch.setitem(config, 'FASTLY_PURGE_DEBOUNCE', 10.)
+    monkeypatch.setitem(config, 'JOBS_EAGER', False)
+    monkeypatch.setattr('app.purges._pending', purges.OrderedDict())
+    monkeypatch.setattr('app.purges._scheduled', set())
+    monkeypatch.setattr('app.purges._attempts', {})
+
+    queue = {'now': 1000., 'purged': [], 'jobs': []}
+
+    def purge_keys(self, keys, soft=False):
+        queue['purged'].append((list(keys), soft))
+        return {key: {'purged': True, 'purge_id': None, 'error': None}
+                for key in keys}
+
+    monkeypatch.setattr('app.purges.time.time', lambda: queue['now'])
+    monkeypatch.setattr('app.fastly.FastlyService.purge_keys', purge_keys)
+    monkeypatch.setattr('app.jobs.submit_later',
+                        lambda delay, func, *args: queue['jobs'].append(
+                            (queue['now'] + delay, func, args)))
+    return queue
+
+
+def run_jobs(queue, until=None):
+    """Run the scheduled jobs in order, advancing the fake clock to each
+    job's time, optionally only those scheduled until a given time.
+    """
+    while len(queue['jobs']) > 0:
+        queue['jobs'].sort(key=lambda job: job[0])
+        if until is not None and queue['jobs'][0][0] > until:
+            break
+        when, func, args = queue['jobs'].pop(0)
+        queue['now'] = max(queue['now'], when)
+        func(*args)
+
+
+def test_enqueue(purge_queue):
+    coalesced = purges._coalesced.get()
+    purged = purges._keys_purged.get()
+
+    purges.enqueue(['a'])
+    purge_queue['now'] += 4.
+    purges.enqueue(['a', 'b'])
+    # A single job is scheduled for the end of the first window, and
+    # nothing is purged yet
+    assert purge_queue['jobs'] == [(1010., purges._flush_queue, (1010.,))]
+    assert purge_queue['purged'] == []
+    assert purges.get_status() == {'pending': 2, 'next_flush': 1010.}
+    assert purges._coalesced.get() == coalesced + 1
+
+    # Keys are purged once, at the end of their windows
+    run_jobs(purge_queue)
+    assert purge_queue['purged'] == [(['a'], False), (['b'], False)]
+    assert purge_queue['now'] == 1014.
+    assert purges.get_status() == {'pending': 0, 'next_flush': None}
+    assert purges._keys_purged.get() == purged + 2
+    assert purges._scheduled == set()
+
+    # Keys queued after their purge are purged again
+    purges.enqueue(['a'])
+    assert len(purge_queue['jobs']) == 1
+    run_jobs(purge_queue)
+    assert purge_queue['purged'][-1] == (['a'], False)
+
+    # Soft purges are batched separately, and hard purges take precedence
+    purges.enqueue(['a', 'b'], soft=True)
+    purges.enqueue(['c'], soft=True)
+    purges.enqueue(['b'])
+    run_jobs(purge_queue)
+    assert purge_queue['purged'][-2:] == [(['b'], False), (['a', 'c'], True)]
+
+    # Purges with a delay postpone queued keys instead of coalescing
+    purges.enqueue(['a', 'b'])
+    purges.enqueue(['b'], delay=60.)
+    assert purges.get_status()['next_flush'] == purge_queue['now'] + 10.
+    run_jobs(purge_queue)
+    assert purge_queue['purged'][-2:] == [(['a'], False), (['b'], False)]
+
+    # A key with an earlier deadline than the scheduled flush gets its own
+    # flush job
+    purges.enqueue(['a'], delay=60.)
+    purges.enqueue(['b'])
+    assert sorted(job[0] for job in purge_queue['jobs']) == \
+        [purge_queue['now'] + 10., purge_queue['now'] + 60.]
+    run_jobs(purge_queue)
+    assert purge_queue['purged'][-2:] == [(['b'], False), (['a'], False)]
+
+
+def test_enqueue_immediate(purge_queue, empty_app, monkeypatch):
+    monkeypatch.setitem(empty_app.config, 'FASTLY_PURGE_DEBOUNCE', 0)
+    purges.enqueue(['a', 'b'])
+    assert purge_queue['purged'] == [(['a', 'b'], False)]
+    assert purge_queue['jobs'] == []
+
+    monkeypatch.setattr(
+        'app.fastly.FastlyService.purge_keys',
+        lambda self, keys, soft=False: {
+            key: {'purged': False, 'purge_id': None, 'error': 'error'}
+            for key in keys})
+    with pytest.raises(FastlyError):
+        purges.enqueue(['a'])
+
+
+def test_enqueue_urls(purge_queue, empty_app, monkeypatch):
+    purged = purges._urls_purged.get()
+    failures = purges._failures.get()
+
+    def purge_url(self, url, soft=False):
+        purge_queue['purged'].append((url, soft))
+        # '/b' fails on its first attempt
+        if url == '/b' and purge_queue['purged'].count((url, soft)) == 1:
+            raise FastlyError('error')
+
+    monkeypatch.setattr('app.fastly.FastlyService.purge_url', purge_url)
+    monkeypatch.setitem(empty_app.config, 'FASTLY_PURGE_RETRY_DELAY', 5.)
+
+    # URLs are debounced with keys, and failures are retried
+    purges.enqueue_urls(['/a', '/b'], soft=True)
+    purges.enqueue(['k'])
+    purges.enqueue_urls(['/a'], soft=True)
+    assert purge_queue['purged'] == []
+    assert purges.get_status()['pending'] == 3
+    assert not purges.is_pending('/a')
+    run_jobs(purge_queue)
+    assert purge_queue['purged'] == [(['k'], False), ('/a', True),
+                                     ('/b', True), ('/b', True)]
+    assert purge_queue['now'] == 1015.
+    assert purges._urls_purged.get() == purged + 2
+    assert purges._failures.get() == failures + 1
+    assert purges._attempts == {}
+
+    # Immediate URL purges log failures instead of raising them
+    monkeypatch.setitem(empty_app.config, 'FASTLY_PURGE_DEBOUNCE', 0)
+    purges.enqueue_urls(['/b'])
+    assert purge_queue['purged'][-1] == ('/b', False)
+    assert purges._failures.get() == failures + 2
+    assert purge_queue['jobs'] == []
+
+
+def test_plan_purge(monkeypatch):
+    monkeypatch.setattr('app.fastly.FastlyService.MAX_PURGE_KEYS', 10)
+    rate_limit = {'remaining': 5, 'reset': 1060.}
+
+    # The purge-all threshold applies whatever the budget
+    assert purges.plan_purge(100, None, 1000., purge_all_threshold=100) \
+        == ('purge_all', 100, 0.)
+    # Unknown and expired budgets don't limit purges
+    assert purges.plan_purge(99, None, 1000.) == ('keys', 99, 0.)
+    assert purges.plan_purge(99, rate_limit, 1060.) == ('keys', 99, 0.)
+    # 3 requests fit in the budget, less the reserve
+    assert purges.plan_purge(30, rate_limit, 1000., budget_reserve=2) \
+        == ('keys', 30, 0.)
+    assert purges.plan_purge(31, rate_limit, 1000., budget_reserve=2) \
+        == ('spread', 30, 60.)
+    assert purges.plan_purge(31, rate_limit, 1000., budget_reserve=5) \
+        == ('defer', 0, 60.)
+
+    # URLs take a request each, and fit the budget after the keys
+    assert purges.plan_purge(10, rate_limit, 1000., n_urls=4) \
+        == ('keys', 14, 0.)
+    assert purges.plan_purge(10, rate_limit, 1000., n_urls=5) \
+        == ('spread', 14, 60.)
+    assert purges.plan_purge(0, rate_limit, 1000., budget_reserve=2,
+                             n_urls=5) == ('spread', 3, 60.)
+    assert purges.plan_purge(60, rate_limit, 1000., n_urls=5) \
+        == ('spread', 50, 60.)
+    assert purges.plan_purge(5, rate_limit, 1000., budget_reserve=4,
+                             n_urls=5) == ('spread', 5, 60.)
+    assert purges.plan_purge(90, None, 1000., purge_all_threshold=100,
+                             n_urls=10) == ('purge_all', 100, 0.)
+
+
+def test_flush_budget(purge_queue, empty_app, monkeypatch):
+    monkeypatch.setattr('app.fastly.FastlyService.MAX_PURGE_KEYS', 2)
+    monkeypatch.setitem(empty_app.config, 'FASTLY_PURGE_ALL_THRESHOLD', 5)
+    monkeypatch.setitem(empty_app.config, 'FASTLY_PURGE_BUDGET_RESERVE', 1)
+    rate_limit = {'remaining': 2, 'reset': 1100.}
+    monkeypatch.setattr('app.fastly.FastlyService.rate_limit', rate_limit)
+    monkeypatch.setattr(
+        'app.fastly.FastlyService.purge_all',
+        lambda self: purge_queue['purged'].append('all'))
+    spread = purges._decisions.get(action='spread')
+
+    # Only one request fits the budget, so hard purges go first and the
+    # other keys wait for the rate limit window to reset
+    purges.enqueue(['a', 'b'], soft=True)
+    purges.enqueue(['c', 'd'])
+    run_jobs(purge_queue)
+    assert purge_queue['purged'] == [(['c', 'd'], False),
+                                     (['a', 'b'], True)]
+    assert purge_queue['now'] == 1100.
+    assert purges._decisions.get(action='spread') == spread + 1
+
+    # URLs share the budget, after the keys
+    monkeypatch.setattr(
+        'app.fastly.FastlyService.purge_url',
+        lambda self, url, soft=False: purge_queue['purged'].append(url))
+    rate_limit['reset'] = 1200.
+    purges.enqueue_urls(['/a', '/b'])
+    purges.enqueue(['a'])
+    run_jobs(purge_queue, until=1110.)
+    assert purge_queue['purged'][-1] == (['a'], False)
+    run_jobs(purge_queue)
+    assert purge_queue['purged'][-2:] == ['/a', '/b']
+    assert purge_queue['now'] == 1200.
+
+    # Enough keys and URLs purge the whole service
+    purges.enqueue(['a', 'b', 'c'])
+    purges.enqueue_urls(['/a', '/b'])
+    run_jobs(purge_queue)
+    assert purge_queue['purged'][-1] == 'all'
+    assert purges.get_status()['pending'] == 0
+
+
+def test_flush_retries(purge_queue, empty_app, monkeypatch):
+    monkeypatch.setitem(empty_app.config, 'FASTLY_PURGE_RETRIES', 2)
+    monkeypatch.setitem(empty_app.config, 'FASTLY_PURGE_RETRY_DELAY', 5.)
+    retries = purges._retries.get()
+
+    def purge_keys(self, keys, soft=False):
+        purge_queue['purged'].append((purge_queue['now'], list(keys)))
+        # 'a' is purged on its second attempt, and 'b' always fails
+        return {key: {'purged': key == 'a' and
+                      len(purge_queue['purged']) > 1,
+                      'purge_id': None, 'error': None}
+                for key in keys}
+
+    monkeypatch.setattr('app.fastly.FastlyService.purge_keys', purge_keys)
+    purges.enqueue(['a', 'b'])
+    run_jobs(purge_queue)
+    # Failed keys are retried with backoff, until they've been retried
+    # FASTLY_PURGE_RETRIES times
+    assert purge_queue['purged'] == [(1010., ['a', 'b']),
+                                     (1015., ['a', 'b']),
+                                     (1025., ['b'])]
+    assert purges._retries.get() == retries + 3
+    assert purges.get_status()['pending'] == 0
+    assert purges._attempts == {}
+
+
+def test_flush_error(purge_queue, monkeypatch):
+    plan = purges._plan
+
+    def failing_plan(*args, **kwargs):
+        raise RuntimeError('unexpected')
+
+    monkeypatch.setattr('app.purges._plan', failing_plan)
+    purges.enqueue(['a'])
+    with pytest.raises(RuntimeError):
+        run_jobs(purge_queue)
+    assert purges._scheduled == set()
+
+    # The queue isn't stuck: later keys schedule a new flush
+    monkeypatch.setattr('app.purges._plan', plan)
+    purges.enqueue(['b'])
+    run_jobs(purge_queue)
+    assert purge_queue['purged'] == [(['b'], False)]
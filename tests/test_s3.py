@@ -23,9 +23,20 @@ import os
 import uuid
 
 import boto3
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
 import pytest
 
-from app.s3 import delete_directory, copy_directory
+from app.s3 import (delete_directory, copy_directory, diff_directories,
+                    plan_copy_directory, plan_sync_directory,
+                    fingerprint_directory,
+                    sync_directory, presign_post, presign_uploads,
+                    _presign_upload, _copy_object,
+                    directory_redirect_paths, mirror_directory,
+                    _mirror_object, get_client, get_bucket_region,
+                    get_object_etag, put_alias_marker,
+                    put_directory_redirects)
+from app.cachepolicy import CachePolicy
 
 
 @pytest.mark.skipif(os.getenv('LTD_KEEPER_TEST_AWS_ID') is None or
@@ -155,6 +166,413 @@ def test_copy_dir_dest_in_src():
         copy_directory('example', 'src', 'src/dest', 'id', 'key')
 
 
+def test_plan_copy_directory():
+    src_objects = {'{0:d}.html'.format(i): {'size': 100, 'etag': 'a'}
+                   for i in range(2500)}
+    dest_objects = {'{0:d}.html'.format(i): {'size': 10, 'etag': 'b'}
+                    for i in range(1001)}
+
+    plan = plan_copy_directory(src_objects, dest_objects, max_workers=2,
+                               request_latency=1., copy_bandwidth=1e3)
+    assert plan['src_objects'] == 2500
+    assert plan['dest_objects'] == 1001
+    assert plan['requests'] == {'list': 5, 'head': 2500, 'copy': 2500,
+                                'delete': 2, 'put': 1}
+    assert plan['bytes_copied'] == 250000
+    assert plan['bytes_deleted'] == 10010
+    # 2 dest pages + 1 round of deletes + 3 src pages + 2500 rounds of
+    # head/copy requests + 125 seconds of copying + 1 put.
+    assert plan['estimated_seconds'] == pytest.approx(2632.)
+
+
+def test_plan_copy_directory_redirects():
+    src_objects = {'index.html': {'size': 1, 'etag': 'a'},
+                   'a/index.html': {'size': 1, 'etag': 'b'},
+                   'b/index.html': {'size': 1, 'etag': 'c'},
+                   'b/c/index.html': {'size': 1, 'etag': 'd'},
+                   # The build already has this redirect object
+                   'b': {'size': 0, 'etag': 'e'}}
+    plan = plan_copy_directory(src_objects, {})
+    # The root, a and b/c redirect objects
+    assert plan['requests']['put'] == 3
+
+
+def test_plan_sync_directory():
+    src_objects = {'index.html': {'size': 100, 'etag': 'a'},
+                   'new.html': {'size': 50, 'etag': 'b'},
+                   'changed.html': {'size': 20, 'etag': 'c'},
+                   'd/index.html': {'size': 10, 'etag': 'd'}}
+    dest_objects = {'index.html': {'size': 100, 'etag': 'a'},
+                    'changed.html': {'size': 20, 'etag': 'x'},
+                    'd/index.html': {'size': 10, 'etag': 'd'},
+                    'old.html': {'size': 5, 'etag': 'e'}}
+    plan = plan_sync_directory(src_objects, dest_objects, max_workers=2,
+                               request_latency=1., copy_bandwidth=1e3)
+    assert plan['requests'] == {'list': 2, 'head': 2, 'copy': 2,
+                                'delete': 1, 'put': 1}
+    assert plan['bytes_copied'] == 70
+    assert plan['bytes_deleted'] == 5
+    # 2 listings + 2 rounds of head/copy requests + 0.035 seconds of
+    # copying + 1 delete + 1 put
+    assert plan['estimated_seconds'] == pytest.approx(6.035)
+
+    # Identical directories, with their redirect objects, are only listed
+    dest_objects = dict(src_objects, d={'size': 0, 'etag': 'f'})
+    plan = plan_sync_directory(src_objects, dest_objects)
+    assert plan['requests'] == {'list': 2, 'head': 0, 'copy': 0,
+                                'delete': 0, 'put': 0}
+
+
+def test_plan_copy_empty_directory():
+    plan = plan_copy_directory({}, {})
+    assert plan['requests'] == {'list': 2, 'head': 0, 'copy': 0,
+                                'delete': 0, 'put': 1}
+    assert plan['bytes_copied'] == 0
+
+
+def test_diff_directories():
+    src_objects = {'same.html': {'size': 1, 'etag': 'a'},
+                   'missing.html': {'size': 1, 'etag': 'b'},
+                   'changed.html': {'size': 1, 'etag': 'c'},
+                   'resized.html': {'size': 1, 'etag': 'd'},
+                   'multipart.bin': {'size': 100, 'etag': 'e-2'},
+                   'same_multipart.bin': {'size': 100, 'etag': 'f-2'}}
+    dest_objects = {'same.html': {'size': 1, 'etag': 'a'},
+                    'changed.html': {'size': 1, 'etag': 'x'},
+                    'resized.html': {'size': 2, 'etag': 'd'},
+                    'multipart.bin': {'size': 100, 'etag': 'y'},
+                    'same_multipart.bin': {'size': 100, 'etag': 'f-2'},
+                    'extra.html': {'size': 1, 'etag': 'z'}}
+    diff = diff_directories(src_objects, dest_objects)
+    assert diff == {'missing': ['missing.html'],
+                    'extra': ['extra.html'],
+                    'mismatched': ['changed.html', 'multipart.bin',
+                                   'resized.html']}
+
+    assert diff_directories(src_objects, src_objects) == \
+        {'missing': [], 'extra': [], 'mismatched': []}
+
+
+def test_sync_directory(monkeypatch):
+    listings = {'src': {'same.html': {'size': 1, 'etag': 'a'},
+                        'changed.html': {'size': 1, 'etag': 'b'},
+                        'new.html': {'size': 1, 'etag': 'c'},
+                        'a/index.html': {'size': 1, 'etag': 'e'},
+                        'b/index.html': {'size': 1, 'etag': 'f'},
+                        'c/index.html': {'size': 1, 'etag': 'g'}},
+                'dest': {'same.html': {'size': 1, 'etag': 'a'},
+                         'changed.html': {'size': 1, 'etag': 'x'},
+                         'old.html': {'size': 1, 'etag': 'd'},
+                         'a': {'size': 0, 'etag': 'h'},
+                         'a/index.html': {'size': 1, 'etag': 'e'},
+                         'b': {'size': 1, 'etag': 'i'},
+                         'b/index.html': {'size': 1, 'etag': 'f'},
+                         'old': {'size': 0, 'etag': 'h'},
+                         'old/index.html': {'size': 1, 'etag': 'j'}}}
+    calls = []
+    monkeypatch.setattr('app.s3.list_directory',
+                        lambda bucket, root_path, **kwargs:
+                        listings[root_path])
+    monkeypatch.setattr('app.s3.copy_objects',
+                        lambda bucket, src, dest, paths, **kwargs:
+                        calls.append(('copy', paths, kwargs['surrogate_key'])))
+    monkeypatch.setattr('app.s3.delete_objects',
+                        lambda bucket, root_path, paths, **kwargs:
+                        calls.append(('delete', paths)))
+    monkeypatch.setattr('app.s3.put_directory_redirects',
+                        lambda bucket, root_path, paths, **kwargs:
+                        calls.append(('redirect', paths,
+                                      kwargs['surrogate_key'])))
+
+    changes = sync_directory('bucket', 'src', 'dest', 'id', 'secret',
+                             surrogate_key='key')
+    assert changes == {'copied': ['c/index.html', 'changed.html',
+                                  'new.html'],
+                       'deleted': ['old', 'old.html', 'old/index.html'],
+                       'redirected': ['b', 'c']}
+    assert calls == [('copy', ['c/index.html', 'changed.html', 'new.html'],
+                      'key'),
+                     ('delete', ['old', 'old.html', 'old/index.html']),
+                     ('redirect', ['b', 'c'], 'key')]
+
+
+def test_mirror_directory(monkeypatch):
+    listings = {'src': {'same.html': {'size': 1, 'etag': 'a'},
+                        'new.html': {'size': 1, 'etag': 'c'},
+                        'a': {'size': 0, 'etag': 'e'},
+                        'a/index.html': {'size': 1, 'etag': 'f'}},
+                'mirror': {'same.html': {'size': 1, 'etag': 'a'},
+                           'old.html': {'size': 1, 'etag': 'd'},
+                           'b': {'size': 0, 'etag': 'e'},
+                           'b/index.html': {'size': 1, 'etag': 'g'}}}
+    calls = []
+    monkeypatch.setattr('app.s3.list_directory',
+                        lambda bucket, root_path, **kwargs:
+                        listings[bucket])
+    monkeypatch.setattr('app.s3._mirror_object',
+                        lambda src_client, client, src, dest, key:
+                        calls.append(('copy', dest, key)))
+    monkeypatch.setattr('app.s3._mirror_root_object',
+                        lambda src_client, client, src, dest, key:
+                        calls.append(('root', dest, key)))
+    monkeypatch.setattr('app.s3.delete_objects',
+                        lambda bucket, root_path, paths, **kwargs:
+                        calls.append(('delete', bucket, paths)))
+
+    # Full synchronization
+    changes = mirror_directory('src', 'mirror', 'p/v/main', 'id', 'secret')
+    assert changes == {'copied': ['a', 'a/index.html', 'new.html'],
+                       'deleted': ['b', 'b/index.html', 'old.html']}
+    assert calls[0] == ('root', 'mirror', 'p/v/main')
+    assert sorted(calls[1:4]) == [('copy', 'mirror', 'p/v/main/a'),
+                                  ('copy', 'mirror', 'p/v/main/a/index.html'),
+                                  ('copy', 'mirror', 'p/v/main/new.html')]
+    assert calls[4] == ('delete', 'mirror', ['b', 'b/index.html', 'old.html'])
+
+    # Incremental replication
+    del calls[:]
+    changes = mirror_directory('src', 'mirror', 'p/v/main', 'id', 'secret',
+                               copied_paths=['new.html'],
+                               deleted_paths=['old.html'])
+    assert changes == {'copied': ['new.html'], 'deleted': ['old.html']}
+    assert calls == [('copy', 'mirror', 'p/v/main/new.html'),
+                     ('delete', 'mirror', ['old.html'])]
+
+
+def test_mirror_object():
+    client = boto3.session.Session(
+        aws_access_key_id='id',
+        aws_secret_access_key='secret',
+        region_name='us-east-1').client('s3')
+    stubber = Stubber(client)
+    stubber.add_response(
+        'head_object',
+        {'ContentType': 'text/html', 'CacheControl': 'no-cache',
+         'WebsiteRedirectLocation': '/v/main/',
+         'Metadata': {'surrogate-key': 'key'}},
+        {'Bucket': 'src', 'Key': 'p/v/alias/index.html'})
+    stubber.add_response(
+        'copy_object', {},
+        {'Bucket': 'mirror', 'Key': 'p/v/alias/index.html',
+         'CopySource': {'Bucket': 'src', 'Key': 'p/v/alias/index.html'},
+         'MetadataDirective': 'REPLACE',
+         'Metadata': {'surrogate-key': 'key'},
+         'ACL': 'public-read',
+         'ContentType': 'text/html',
+         'CacheControl': 'no-cache',
+         'WebsiteRedirectLocation': '/v/main/'})
+    with stubber:
+        _mirror_object(client, client, 'src', 'mirror',
+                       'p/v/alias/index.html')
+    stubber.assert_no_pending_responses()
+
+
+def test_get_client():
+    client = get_client('id', 'secret', aws_region_name='eu-west-1')
+    assert get_client('id', 'secret', aws_region_name='eu-west-1') is client
+    assert client.meta.region_name == 'eu-west-1'
+
+    # Each region and endpoint has its own client (and connection pool)
+    assert get_client('id', 'secret',
+                      aws_region_name='us-west-2') is not client
+    endpoint_client = get_client('id', 'secret',
+                                 aws_region_name='eu-west-1',
+                                 aws_endpoint_url='http://s3.example.test')
+    assert endpoint_client is not client
+    assert endpoint_client.meta.endpoint_url == 'http://s3.example.test'
+
+
+@pytest.mark.parametrize('constraint,region', [
+    (None, 'us-east-1'), ('EU', 'eu-west-1'), ('ap-south-1', 'ap-south-1')])
+def test_get_bucket_region(constraint, region):
+    client = get_client('id', 'secret', aws_region_name='us-east-1')
+    stubber = Stubber(client)
+    response = {}
+    if constraint is not None:
+        response['LocationConstraint'] = constraint
+    stubber.add_response('get_bucket_location', response,
+                         {'Bucket': 'bucket'})
+    with stubber:
+        assert get_bucket_region('bucket', 'id', 'secret') == region
+    stubber.assert_no_pending_responses()
+
+
+def test_get_object_etag():
+    client = get_client('id', 'secret')
+    stubber = Stubber(client)
+    stubber.add_response('head_object', {'ETag': '"abc"'},
+                         {'Bucket': 'bucket', 'Key': 'a/index.html'})
+    stubber.add_client_error('head_object', service_error_code='404',
+                             http_status_code=404)
+    with stubber:
+        assert get_object_etag('bucket', 'a/index.html', 'id',
+                               'secret') == 'abc'
+        assert get_object_etag('bucket', 'b/index.html', 'id',
+                               'secret') is None
+    stubber.assert_no_pending_responses()
+
+
+def test_put_alias_marker():
+    client = get_client('id', 'secret')
+    stubber = Stubber(client)
+    stubber.add_response(
+        'put_object', {},
+        {'Bucket': 'bucket', 'Key': 'p/v/latest', 'Body': '',
+         'ACL': 'public-read',
+         'Metadata': {'alias-of': 'p/v/main', 'dir-redirect': 'true',
+                      'surrogate-key': 'key'},
+         'CacheControl': 'no-cache'})
+    with stubber:
+        put_alias_marker('bucket', 'p/v/latest/', 'p/v/main/', 'id',
+                         'secret', surrogate_key='key',
+                         cache_control='no-cache')
+    stubber.assert_no_pending_responses()
+
+
+def test_put_directory_redirects():
+    client = get_client('id', 'secret')
+    stubber = Stubber(client)
+    stubber.add_response(
+        'put_object', {},
+        {'Bucket': 'bucket', 'Key': 'p/v/main/a', 'Body': '',
+         'ACL': 'public-read',
+         'Metadata': {'dir-redirect': 'true', 'surrogate-key': 'key',
+                      'surrogate-control': 'max-age=31536000'},
+         'CacheControl': 'no-cache'})
+    with stubber:
+        put_directory_redirects('bucket', 'p/v/main', ['a'], 'id', 'secret',
+                                surrogate_key='key', cache_control='no-cache',
+                                surrogate_control='max-age=31536000')
+    stubber.assert_no_pending_responses()
+
+
+def test_directory_redirect_paths():
+    paths = ['index.html', 'a/index.html', 'a/b/index.html', 'a/c.html',
+             'd/e/index.html', 'f/index.htm']
+    assert directory_redirect_paths(paths) == ['a', 'a/b', 'd/e']
+
+
+def test_fingerprint_directory():
+    objects = {'a.html': {'size': 1, 'etag': 'x'},
+               'b.html': {'size': 1, 'etag': 'y'}}
+    fingerprint = fingerprint_directory(objects)
+    assert len(fingerprint) == 64
+    assert fingerprint == fingerprint_directory(dict(objects))
+    assert fingerprint != fingerprint_directory(
+        {'a.html': {'size': 1, 'etag': 'x'},
+         'b.html': {'size': 1, 'etag': 'z'}})
+    assert fingerprint != fingerprint_directory(
+        {'a.html': {'size': 1, 'etag': 'x'}})
+
+
+def test_presign_post():
+    # Presigning doesn't make requests, so fake credentials work
+    post = presign_post('bucket', 'prod/builds/1', 'id', 'secret',
+                        aws_region_name='us-east-1', surrogate_key='abc')
+    assert 'bucket' in post['url']
+    assert post['fields']['key'] == 'prod/builds/1/${filename}'
+    assert post['fields']['acl'] == 'public-read'
+    assert post['fields']['x-amz-meta-surrogate-key'] == 'abc'
+    assert 'policy' in post['fields']
+
+
+def test_presign_uploads():
+    files = [{'path': 'index.html', 'size': 100},
+             {'path': 'data.bin', 'size': 100, 'content_type': 'text/csv'}]
+    uploads = presign_uploads('bucket', 'prod/builds/1', files,
+                              'id', 'secret', aws_region_name='us-east-1',
+                              surrogate_key='abc')
+    assert [u['method'] for u in uploads] == ['PUT', 'PUT']
+    assert uploads[0]['key'] == 'prod/builds/1/index.html'
+    assert 'prod/builds/1/index.html' in uploads[0]['url']
+    assert uploads[0]['headers'] == {'Content-Type': 'text/html',
+                                     'x-amz-acl': 'public-read',
+                                     'x-amz-meta-surrogate-key': 'abc'}
+    assert uploads[1]['headers']['Content-Type'] == 'text/csv'
+
+
+def test_presign_multipart_upload():
+    client = boto3.session.Session(
+        aws_access_key_id='id',
+        aws_secret_access_key='secret',
+        region_name='us-east-1').client('s3')
+    stubber = Stubber(client)
+    stubber.add_response(
+        'create_multipart_upload',
+        {'Bucket': 'bucket', 'Key': 'prod/builds/1/big.bin',
+         'UploadId': 'upload-1'},
+        {'Bucket': 'bucket', 'Key': 'prod/builds/1/big.bin',
+         'ACL': 'public-read', 'ContentType': 'application/octet-stream'})
+    with stubber:
+        upload = _presign_upload(client, 'bucket', 'prod/builds/1/',
+                                 {'path': 'big.bin', 'size': 250},
+                                 {'ACL': 'public-read'}, 60,
+                                 multipart_threshold=100, part_size=100)
+    stubber.assert_no_pending_responses()
+    assert upload['method'] == 'multipart'
+    assert upload['upload_id'] == 'upload-1'
+    assert upload['part_size'] == 100
+    assert [p['part_number'] for p in upload['parts']] == [1, 2, 3]
+    assert 'partNumber=3' in upload['parts'][2]['url']
+    assert 'uploadId=upload-1' in upload['complete_url']
+    assert 'uploadId=upload-1' in upload['abort_url']
+
+
+def test_presign_uploads_abort():
+    client = get_client('id', 'secret', aws_region_name='us-east-1')
+    stubber = Stubber(client)
+    stubber.add_response(
+        'create_multipart_upload',
+        {'Bucket': 'bucket', 'Key': 'prod/builds/1/a.bin',
+         'UploadId': 'upload-1'})
+    stubber.add_client_error('create_multipart_upload',
+                             service_error_code='InternalError',
+                             http_status_code=500)
+    stubber.add_response(
+        'abort_multipart_upload', {},
+        {'Bucket': 'bucket', 'Key': 'prod/builds/1/a.bin',
+         'UploadId': 'upload-1'})
+    files = [{'path': 'a.bin', 'size': 100}, {'path': 'b.bin', 'size': 100}]
+    with stubber:
+        # Uploads that were created before the failure are aborted
+        with pytest.raises(ClientError):
+            presign_uploads('bucket', 'prod/builds/1', files, 'id', 'secret',
+                            aws_region_name='us-east-1',
+                            multipart_threshold=10)
+    stubber.assert_no_pending_responses()
+
+
+def test_copy_object_cache_policy():
+    client = boto3.session.Session(
+        aws_access_key_id='id',
+        aws_secret_access_key='secret',
+        region_name='us-east-1').client('s3')
+    policy = CachePolicy(
+        [{'content_type': 'text/html', 'cache_control': 'max-age=60'}],
+        cache_control='no-cache', surrogate_control='max-age=31536000')
+    stubber = Stubber(client)
+    stubber.add_response(
+        'head_object',
+        {'ContentType': 'text/html', 'CacheControl': 'max-age=3600',
+         'Metadata': {}},
+        {'Bucket': 'bucket', 'Key': 'b/1/a/index.html'})
+    stubber.add_response(
+        'copy_object', {},
+        {'Bucket': 'bucket', 'Key': 'v/main/a/index.html',
+         'CopySource': {'Bucket': 'bucket', 'Key': 'b/1/a/index.html'},
+         'MetadataDirective': 'REPLACE',
+         'Metadata': {'surrogate-control': 'max-age=31536000',
+                      'surrogate-key': 'key'},
+         'ACL': 'public-read',
+         'ContentType': 'text/html',
+         'CacheControl': 'max-age=60'})
+    with stubber:
+        _copy_object(client, 'bucket', 'b/1/a/index.html',
+                     'v/main/a/index.html', surrogate_key='key',
+                     cache_policy=policy, path='a/index.html')
+    stubber.assert_no_pending_responses()
+
+
 def _upload_files(file_paths, bucket, bucket_root,
                   surrogate_key, cache_control, content_type):
     with tempfile.TemporaryDirectory() as temp_dir:
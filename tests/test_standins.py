@@ -0,0 +1,91 @@
+"""Tests for the standins module (stand-in servers for external services),
+and of LTD Keeper's clients against them.
+"""
+
+import logging
+
+from app import dasher
+from app.fastly import FastlyService
+from app.route53 import create_cname, delete_cname
+from app.standins import FastlyStandin
+
+
+def test_fastly_standin(fastly_standin):
+    fastly_standin.rate_limit = 3
+    service = FastlyService('service', 'key', api_root=fastly_standin.url)
+
+    results = service.purge_keys(['a', 'b'])
+    assert all(result['purged'] for result in results.values())
+    service.purge_key('c')
+    service.purge_url('https://pipelines.lsst.io/index.html')
+    assert fastly_standin.purged_keys == ['a', 'b', 'c']
+    assert fastly_standin.purged_urls == ['pipelines.lsst.io/index.html']
+    assert fastly_standin.requests[0]['headers']['Fastly-Key'] == 'key'
+    assert service.rate_limit['remaining'] == 0
+
+    # Requests beyond the rate limit fail
+    results = service.purge_keys(['d'])
+    assert results['d']['purged'] is False
+    assert '429' in results['d']['error']
+
+
+def test_fastly_standin_dictionaries(fastly_standin):
+    service = FastlyService('service', 'key', api_root=fastly_standin.url)
+    service.set_dictionary_item('aliases', 'p/v/latest', 'p/v/main')
+    assert fastly_standin.dictionaries == {'aliases': {'p/v/latest':
+                                                       'p/v/main'}}
+    service.delete_dictionary_item('aliases', 'p/v/latest')
+    service.delete_dictionary_item('aliases', 'p/v/latest')
+    assert fastly_standin.dictionaries == {'aliases': {}}
+
+
+def test_fastly_standin_failures():
+    with FastlyStandin(failure_rate=1.) as server:
+        service = FastlyService('service', 'key', api_root=server.url)
+        results = service.purge_keys(['a'])
+    assert results['a']['purged'] is False
+    assert server.purged_keys == []
+
+
+def test_route53_standin(route53_standin):
+    create_cname('docs.ltdtest.local', 'global.ssl.fastly.net', 'id',
+                 'secret', aws_endpoint_url=route53_standin.url)
+    record = route53_standin.records['Z1'][('docs.ltdtest.local.', 'CNAME')]
+    assert record['ResourceRecords'] == [{'Value': 'global.ssl.fastly.net'}]
+
+    delete_cname('docs.ltdtest.local', 'id', 'secret',
+                 aws_endpoint_url=route53_standin.url)
+    assert route53_standin.records['Z1'] == {}
+
+
+def test_dasher_standin(dasher_standin):
+    dasher.build_dashboards(['https://keeper.lsst.codes/products/a'],
+                            dasher_standin.url, logging.getLogger(__name__))
+    assert dasher_standin.product_urls == [
+        'https://keeper.lsst.codes/products/a']
+
+
+def test_post_product(client, empty_app, monkeypatch, route53_standin,
+                      fastly_standin, dasher_standin):
+    config = empty_app.config
+    monkeypatch.setitem(config, 'ROUTE53_ENDPOINT_URL', route53_standin.url)
+    monkeypatch.setitem(config, 'FASTLY_API_ROOT', fastly_standin.url)
+    monkeypatch.setitem(config, 'FASTLY_SERVICE_ID', 'service')
+    monkeypatch.setitem(config, 'FASTLY_KEY', 'key')
+    monkeypatch.setitem(config, 'LTD_DASHER_URL', dasher_standin.url)
+    monkeypatch.setitem(config, 'AWS_ID', 'id')
+    monkeypatch.setitem(config, 'AWS_SECRET', 'secret')
+
+    r = client.post('/products/',
+                    {'slug': 'pipelines',
+                     'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+                     'title': 'LSST Science Pipelines',
+                     'root_domain': 'ltdtest.local',
+                     'root_fastly_domain': 'global.ssl.fastly.net',
+                     'bucket_name': 'bucket-name'})
+    assert r.status == 201
+    assert ('pipelines.ltdtest.local.', 'CNAME') \
+        in route53_standin.records['Z1']
+    assert len(dasher_standin.product_urls) == 1
+    # The dashboard's purge is sent to the Fastly stand-in
+    assert len(fastly_standin.purged_keys) == 1
@@ -0,0 +1,173 @@
+"""Tests for the tasks module (background jobs and maintenance tasks)."""
+
+from app.tasks import resync_editions, verify_editions
+
+
+def _setup_product(client):
+    p = {'slug': 'pipelines',
+         'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+         'title': 'LSST Science Pipelines',
+         'root_domain': 'lsst.io',
+         'root_fastly_domain': 'global.ssl.fastly.net',
+         'bucket_name': 'bucket-name'}
+    r = client.post('/products/', p)
+    product_url = r.headers['Location']
+
+    # The main edition tracks this build
+    r = client.post('/products/pipelines/builds/', {'git_refs': ['master']})
+    b1_url = r.json['self_url']
+    client.patch(b1_url, {'uploaded': True})
+
+    # An edition on the same build
+    client.post(product_url + '/editions/',
+                {'tracked_refs': ['v1'], 'slug': 'v1', 'title': 'v1',
+                 'build_url': b1_url})
+
+    # A deprecated edition, and an edition without a build, are skipped
+    r = client.post(product_url + '/editions/',
+                    {'tracked_refs': ['v2'], 'slug': 'v2', 'title': 'v2',
+                     'build_url': b1_url})
+    client.delete(r.headers['Location'])
+    client.post(product_url + '/editions/',
+                {'tracked_refs': ['v3'], 'slug': 'v3', 'title': 'v3'})
+
+
+def test_resync_editions(client, monkeypatch):
+    _setup_product(client)
+
+    listings = {
+        'pipelines/builds/1': {'index.html': {'size': 100, 'etag': 'a'},
+                               'a.html': {'size': 50, 'etag': 'b'}},
+        'pipelines/v/main': {'index.html': {'size': 100, 'etag': 'a'},
+                             'a.html': {'size': 50, 'etag': 'b'}},
+        'pipelines/v/v1': {'index.html': {'size': 100, 'etag': 'a'}},
+    }
+    copies = []
+
+    def list_directory(bucket_name, root_path, *args, **kwargs):
+        return listings[root_path]
+
+    def copy_directory(**kwargs):
+        copies.append(kwargs)
+        return 2
+
+    replications = []
+
+    def replicate(bucket_name, root_path, copied_paths=None,
+                  deleted_paths=None, **kwargs):
+        replications.append((root_path, copied_paths, deleted_paths))
+
+    monkeypatch.setattr('app.s3.list_directory', list_directory)
+    monkeypatch.setattr('app.s3.copy_directory', copy_directory)
+    monkeypatch.setattr('app.mirrors.replicate', replicate)
+    monkeypatch.setitem(client.app.config, 'S3_MIRROR_BUCKETS', ['mirror'])
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+
+    # Dry run
+    progress = []
+    summary = resync_editions(max_workers=2, dry_run=True,
+                              progress=progress.append)
+    assert summary['editions'] == 2
+    assert summary['matched'] == 1
+    assert summary['planned'] == 1
+    assert summary['resynced'] == 0
+    assert summary['objects_copied'] == 2
+    assert summary['bytes_copied'] == 150
+    assert len(copies) == 0
+    assert len(progress) == 2
+    planned = [r for r in summary['results'] if r['status'] == 'planned'][0]
+    assert planned['edition'] == 'pipelines/v1'
+    assert planned['missing'] == 1
+    assert planned['plan']['requests']['copy'] == 2
+
+    # Real run
+    summary = resync_editions(max_workers=2)
+    assert summary['resynced'] == 1
+    assert summary['matched'] == 1
+    assert len(copies) == 1
+    assert copies[0]['src_path'] == 'pipelines/builds/1'
+    assert copies[0]['dest_path'] == 'pipelines/v/v1'
+    assert copies[0]['aws_access_key_id'] == 'id'
+    # The resynced edition is fully synchronized to the mirrors
+    assert replications == [('pipelines/v/v1', None, None)]
+
+    # Failures are reported rather than raised
+    def failing_copy_directory(**kwargs):
+        raise RuntimeError('S3 is down')
+
+    monkeypatch.setattr('app.s3.copy_directory', failing_copy_directory)
+    summary = resync_editions(product_slug='pipelines')
+    assert summary['failed'] == 1
+    failed = [r for r in summary['results'] if r['status'] == 'failed'][0]
+    assert failed['error'] == 'S3 is down'
+
+    summary = resync_editions(product_slug='other')
+    assert summary['editions'] == 0
+
+
+def test_verify_editions(client, monkeypatch):
+    _setup_product(client)
+
+    listings = {
+        'pipelines/builds/1': {'index.html': {'size': 100, 'etag': 'a'},
+                               'a.html': {'size': 50, 'etag': 'b'},
+                               'b.html': {'size': 50, 'etag': 'c'}},
+        'pipelines/v/main': {'index.html': {'size': 100, 'etag': 'a'},
+                             'a.html': {'size': 50, 'etag': 'b'},
+                             'b.html': {'size': 50, 'etag': 'c'}},
+        'pipelines/v/v1': {'index.html': {'size': 100, 'etag': 'a'},
+                           'a.html': {'size': 50, 'etag': 'x'},
+                           'old.html': {'size': 50, 'etag': 'd'}},
+    }
+    copies = []
+    deletes = []
+
+    def list_directory(bucket_name, root_path, *args, **kwargs):
+        return listings[root_path]
+
+    def copy_objects(bucket_name, src_path, dest_path, paths, **kwargs):
+        copies.append((src_path, dest_path, paths))
+        return len(paths)
+
+    def delete_objects(bucket_name, root_path, paths, **kwargs):
+        deletes.append((root_path, paths))
+        return len(paths)
+
+    monkeypatch.setattr('app.s3.list_directory', list_directory)
+    monkeypatch.setattr('app.s3.copy_objects', copy_objects)
+    monkeypatch.setattr('app.s3.delete_objects', delete_objects)
+    replications = []
+
+    def replicate(bucket_name, root_path, copied_paths=None,
+                  deleted_paths=None, **kwargs):
+        replications.append((root_path, copied_paths, deleted_paths))
+
+    monkeypatch.setattr('app.mirrors.replicate', replicate)
+    monkeypatch.setitem(client.app.config, 'S3_MIRROR_BUCKETS', ['mirror'])
+    monkeypatch.setitem(client.app.config, 'AWS_ID', 'id')
+    monkeypatch.setitem(client.app.config, 'AWS_SECRET', 'secret')
+
+    summary = verify_editions(max_workers=2)
+    assert summary['editions'] == 2
+    assert summary['matched'] == 1
+    assert summary['mismatched'] == 1
+    assert len(copies) == 0
+    assert replications == []
+    result = [r for r in summary['results']
+              if r['status'] == 'mismatched'][0]
+    assert result['edition'] == 'pipelines/v1'
+    assert result['diff'] == {'missing': ['b.html'],
+                              'extra': ['old.html'],
+                              'mismatched': ['a.html']}
+
+    summary = verify_editions(max_workers=2, repair=True)
+    assert summary['repaired'] == 1
+    assert summary['objects_copied'] == 2
+    assert summary['bytes_copied'] == 100
+    assert copies == [('pipelines/builds/1', 'pipelines/v/v1',
+                       ['b.html', 'a.html'])]
+    assert deletes == [('pipelines/v/v1', ['old.html'])]
+    # Only the repaired objects are replicated to the mirrors
+    assert replications == [('pipelines/v/v1', ['b.html', 'a.html'],
+                             ['old.html'])]
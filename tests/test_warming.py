@@ -0,0 +1,133 @@
+"""Tests for the warming module (Fastly cache warming)."""
+
+import responses
+
+from app import metrics, warming
+from app.httpclient import get_session
+
+
+SITEMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://pipelines.lsst.io/v/1/about.html</loc></url>
+  <url><loc>https://pipelines.lsst.io/v/1/a/</loc></url>
+  <url><loc>https://other.lsst.io/index.html</loc></url>
+</urlset>
+"""
+
+
+def _target():
+    return {'edition': 'pipelines/1',
+            'published_url': 'https://pipelines.lsst.io/v/1',
+            'surrogate_key': 'key',
+            'bucket_name': 'bucket',
+            'root_path': 'pipelines/v/1',
+            'aws_args': {'aws_access_key_id': 'id',
+                         'aws_secret_access_key': 'secret'},
+            'scheduled': 1000.}
+
+
+@responses.activate
+def test_collect_urls(monkeypatch):
+    monkeypatch.setattr(
+        'app.s3.list_directory',
+        lambda bucket_name, root_path, **kwargs:
+        {'index.html': {}, 'a/b/index.html': {}, 'a/index.html': {},
+         'a/style.css': {}})
+    responses.add(responses.GET, 'https://pipelines.lsst.io/v/1/sitemap.xml',
+                  body=SITEMAP, status=200)
+
+    urls = warming.collect_urls(_target(), get_session('test'),
+                                paths=['', 'genindex.html'])
+    assert urls == ['https://pipelines.lsst.io/v/1/',
+                    'https://pipelines.lsst.io/v/1/genindex.html',
+                    'https://pipelines.lsst.io/v/1/a/',
+                    'https://pipelines.lsst.io/v/1/a/b/',
+                    'https://pipelines.lsst.io/v/1/about.html']
+
+    # The hot list and directory pages come first
+    urls = warming.collect_urls(_target(), get_session('test'),
+                                paths=['genindex.html'], max_urls=2)
+    assert urls == ['https://pipelines.lsst.io/v/1/genindex.html',
+                    'https://pipelines.lsst.io/v/1/']
+
+
+@responses.activate
+def test_warm_edition(monkeypatch):
+    target = _target()
+    target['aws_args'] = None
+    responses.add(responses.GET, 'https://pipelines.lsst.io/v/1/sitemap.xml',
+                  status=404)
+    responses.add(responses.GET, 'https://pipelines.lsst.io/v/1/',
+                  headers={'X-Cache': 'MISS, MISS'})
+    responses.add(responses.GET, 'https://pipelines.lsst.io/v/1/hot.html',
+                  headers={'X-Cache': 'MISS, HIT'})
+    responses.add(responses.GET, 'https://pipelines.lsst.io/v/1/gone.html',
+                  status=404)
+    misses = warming._requests.get(result='miss')
+
+    status = warming.warm_edition(target,
+                                  paths=['', 'hot.html', 'gone.html'])
+    assert status['urls'] == 3
+    assert status['done'] == 3
+    assert (status['hits'], status['misses'], status['errors']) == (1, 1, 1)
+    assert status['finished'] is not None
+    assert warming.get_status()['pipelines/1'] == status
+    assert warming._requests.get(result='miss') == misses + 1
+
+    # The progress is exported as gauges
+    text = metrics.render()
+    assert 'ltd_keeper_warming_urls{edition="pipelines/1"} 3.0' in text
+    assert 'ltd_keeper_warming_warmed{edition="pipelines/1"} 2.0' in text
+    assert 'ltd_keeper_warming_failed{edition="pipelines/1"} 1.0' in text
+
+
+def test_schedule_disabled(empty_app, monkeypatch):
+    jobs = []
+    monkeypatch.setattr('app.jobs.submit',
+                        lambda func, *args, **kwargs: jobs.append(func))
+    monkeypatch.setitem(empty_app.config, 'FASTLY_SERVICE_ID', 'service')
+    monkeypatch.setitem(empty_app.config, 'FASTLY_KEY', 'key')
+    warming.schedule(None)
+    assert jobs == []
+
+
+def test_schedule_hot_paths(client, empty_app, monkeypatch):
+    from app import db
+    from app.models import Edition, HotPath
+
+    r = client.post('/products/',
+                    {'slug': 'pipelines',
+                     'doc_repo': 'https://github.com/lsst/pipelines_docs.git',
+                     'title': 'LSST Science Pipelines',
+                     'root_domain': 'lsst.io',
+                     'root_fastly_domain': 'global.ssl.fastly.net',
+                     'bucket_name': 'bucket-name'})
+    assert r.status == 201
+    edition = Edition.query.filter(Edition.slug == 'main').one()
+    db.session.add(HotPath(edition=edition, path='b.html', hits=1, rank=1))
+    db.session.add(HotPath(edition=edition, path='a.html', hits=2, rank=0))
+    db.session.commit()
+
+    jobs = []
+    monkeypatch.setattr('app.jobs.submit',
+                        lambda func, *args, **kwargs: jobs.append(kwargs))
+    monkeypatch.setitem(empty_app.config, 'FASTLY_SERVICE_ID', 'service')
+    monkeypatch.setitem(empty_app.config, 'FASTLY_KEY', 'key')
+    monkeypatch.setitem(empty_app.config, 'CACHE_WARMING', True)
+    monkeypatch.setitem(empty_app.config, 'CACHE_WARMING_PATHS', [''])
+    warming.schedule(edition)
+    # The edition's hot paths follow the configured hot list
+    assert jobs[0]['paths'] == ['', 'a.html', 'b.html']
+
+
+def test_warm_edition_pending_purge(monkeypatch):
+    later = []
+    monkeypatch.setattr('app.purges.is_pending', lambda key: key == 'key')
+    monkeypatch.setattr('app.jobs.submit_later',
+                        lambda delay, func, *args, **kwargs:
+                        later.append((delay, func, kwargs['paths'])))
+    monkeypatch.setattr('app.warming.time.time', lambda: 1100.)
+    # The job is scheduled again while the edition's purge is pending
+    assert warming.warm_edition(_target(), paths=['a.html']) is None
+    assert later == [(warming.PURGE_POLL_INTERVAL, warming.warm_edition,
+                      ['a.html'])]